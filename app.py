@@ -1,92 +1,171 @@
 import os
-import sqlite3
+from dotenv import load_dotenv
 from flask import Flask
 
 from models import db
 from routes.public import public_bp
 from routes.upload import upload_bp
+from routes.resumable import resumable_bp, uploads_purge_command
 from routes.admin import admin_bp
+from routes.pwa import pwa_bp
 from chat_routes import chat_bp
+from storage import storage_gc_command, storage_tier_command
+from migrations import db_upgrade_command, db_version_command
+from jobs import jobs_worker_command, media_transcode_command
+from audit import audit_query_command, audit_reindex_command
+from crypto import crypto_rotate_command
+from stats import stats_rebuild_command
+import audit
+import ratelimit
+import migrations
+import db_instrumentation
+import db_engine
 
 
-def _ensure_sqlite_columns(db_path: str):
-    """MVP migration: adiciona colunas novas sem usar Alembic.
-    Evita quebrar o app caso o database.db já exista.
-    """
-    if not os.path.exists(db_path):
-        return
-
-    conn = sqlite3.connect(db_path)
-    try:
-        cur = conn.cursor()
-
-        def has_col(table: str, col: str) -> bool:
-            cur.execute(f"PRAGMA table_info({table})")
-            return any(row[1] == col for row in cur.fetchall())
-
-        # user
-        if has_col("user", "id"):
-            if not has_col("user", "created_at"):
-                cur.execute("ALTER TABLE user ADD COLUMN created_at DATETIME")
-
-        # submission
-        if has_col("submission", "id"):
-            if not has_col("submission", "status"):
-                cur.execute("ALTER TABLE submission ADD COLUMN status VARCHAR(30) DEFAULT 'recebido'")
-            if not has_col("submission", "created_at"):
-                cur.execute("ALTER TABLE submission ADD COLUMN created_at DATETIME")
-
-        # file
-        if has_col("file", "id"):
-            for col, sql in [
-                ("original_name", "ALTER TABLE file ADD COLUMN original_name VARCHAR(255)"),
-                ("mime_type", "ALTER TABLE file ADD COLUMN mime_type VARCHAR(120)"),
-                ("size_bytes", "ALTER TABLE file ADD COLUMN size_bytes INTEGER"),
-                ("sha256", "ALTER TABLE file ADD COLUMN sha256 VARCHAR(64)"),
-                ("uploaded_at", "ALTER TABLE file ADD COLUMN uploaded_at DATETIME"),
-            ]:
-                if not has_col("file", col):
-                    cur.execute(sql)
-
-        conn.commit()
-    finally:
-        conn.close()
-
-
-app = Flask(__name__)
-
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 DB_PATH = os.path.join(BASE_DIR, "database.db")
 
-app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "chave-super-secreta")
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{DB_PATH}"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
-# Uploads (padrão do sistema)
-app.config["UPLOAD_FOLDER"] = os.path.join(BASE_DIR, "static", "uploads")
+def _configuracao_padrao(app: Flask) -> None:
+    """Configuração a partir do ambiente (.env já carregado)."""
+    app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "chave-super-secreta")
+    # DATABASE_URL=postgresql://... para sair do arquivo único (ver db_engine.py)
+    app.config["SQLALCHEMY_DATABASE_URI"] = db_engine.database_url(DB_PATH)
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # Admin fixo do MVP (produção: hash + tabela de admins)
+    app.config["ADMIN_USER"] = os.environ.get("ADMIN_USER", "admin")
+    app.config["ADMIN_PASS"] = os.environ.get("ADMIN_PASS", "admin123")
+
+    # Uploads (padrão do sistema)
+    app.config["UPLOAD_FOLDER"] = os.path.join(BASE_DIR, "static", "uploads")
+
+    # Uploads específicos do chat (Capivara) — legado; anexos novos vão para os blobs
+    app.config["CHAT_UPLOAD_FOLDER"] = os.path.join(app.config["UPLOAD_FOLDER"], "chat")
+
+    # Repositório endereçado por conteúdo (storage.py): blobs/<aa>/<bb>/<sha256><ext>
+    app.config["BLOB_FOLDER"] = os.path.join(app.config["UPLOAD_FOLDER"], "blobs")
+
+    # Armazenamento frio dos originais (storage-tier): disco mais barato, gzip quando compensa
+    app.config["COLD_STORAGE_FOLDER"] = os.environ.get("COLD_STORAGE_FOLDER", os.path.join(BASE_DIR, "cold"))
+    app.config["COLD_AFTER_DAYS"] = int(os.environ.get("COLD_AFTER_DAYS", 180))
+
+    # Entrega de anexos no painel (delivery.py): direct | x-sendfile | x-accel (nginx)
+    app.config["FILE_DELIVERY"] = os.environ.get("FILE_DELIVERY", "direct")
+    app.config["X_ACCEL_PREFIX"] = os.environ.get("X_ACCEL_PREFIX", "/_protected/")
+
+    # Cache de prévias redimensionadas do painel (previews.py): LRU limitado em bytes
+    app.config["PREVIEW_CACHE_FOLDER"] = os.path.join(BASE_DIR, "cache", "previews")
+    app.config["PREVIEW_CACHE_MAX_BYTES"] = int(os.environ.get("PREVIEW_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+    # Compressão no navegador antes do envio (upload.html + static/compress.js):
+    # maior lado e qualidade das imagens; WAV reamostrado para N Hz mono (0 = desliga)
+    app.config["UPLOAD_IMAGE_MAX_PX"] = int(os.environ.get("UPLOAD_IMAGE_MAX_PX", 2048))
+    app.config["UPLOAD_IMAGE_QUALITY"] = float(os.environ.get("UPLOAD_IMAGE_QUALITY", 0.82))
+    app.config["UPLOAD_AUDIO_SAMPLE_RATE"] = int(os.environ.get("UPLOAD_AUDIO_SAMPLE_RATE", 16000))
+
+    # Busca textual (search.py): correspondências mais recentes que entram no ranking
+    app.config["SEARCH_RANK_WINDOW"] = int(os.environ.get("SEARCH_RANK_WINDOW", 2000))
+
+
+def create_app(config: dict = None) -> Flask:
+    """Monta o app. `config` sobrepõe a configuração do ambiente (testes, bench).
+
+    Nada de rede ou de arquivos grandes aqui: o cliente do LLM e a cifra dos
+    dados pessoais são criados no primeiro uso. Com o gunicorn em preload
+    (gunicorn.conf.py), isto roda uma vez no master e os workers herdam.
+    """
+    load_dotenv()
+
+    app = Flask(__name__)
+    _configuracao_padrao(app)
+    if config:
+        app.config.update(config)
+        # Pastas padrão dentro de uploads acompanham um UPLOAD_FOLDER sobreposto
+        if "UPLOAD_FOLDER" in config:
+            for chave, pasta in (("CHAT_UPLOAD_FOLDER", "chat"), ("BLOB_FOLDER", "blobs")):
+                if chave not in config:
+                    app.config[chave] = os.path.join(config["UPLOAD_FOLDER"], pasta)
+    app.config.setdefault(
+        "SQLALCHEMY_ENGINE_OPTIONS", db_engine.engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+    )
+
+    # Garante que as pastas existam
+    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+    os.makedirs(app.config["CHAT_UPLOAD_FOLDER"], exist_ok=True)
+
+    # Inicializa ORM (WAL/busy_timeout no SQLite, pool, engine de leitura)
+    db.init_app(app)
+    db_engine.init_app(app, db)
+    db_instrumentation.init_app(app)
+
+    # Auditoria do painel: fila + gravação em lote em audit/admin_audit.jsonl
+    audit.init_app(app)
+
+    # Limites por cliente (token bucket): 429 + Retry-After
+    ratelimit.init_app(app)
+
+    # Blueprints
+    app.register_blueprint(public_bp)
+    app.register_blueprint(upload_bp)
+    app.register_blueprint(resumable_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(chat_bp)
+    app.register_blueprint(pwa_bp)
+
+    # Comandos de manutenção (flask --app app <comando>)
+    app.cli.add_command(storage_gc_command)
+    app.cli.add_command(storage_tier_command)
+    app.cli.add_command(uploads_purge_command)
+    app.cli.add_command(db_upgrade_command)
+    app.cli.add_command(db_version_command)
+    app.cli.add_command(jobs_worker_command)
+    app.cli.add_command(media_transcode_command)
+    app.cli.add_command(audit_query_command)
+    app.cli.add_command(audit_reindex_command)
+    app.cli.add_command(crypto_rotate_command)
+    app.cli.add_command(stats_rebuild_command)
+
+    # Schema: só confere a versão (migrações via `flask --app app db-upgrade`)
+    if app.config.get("SCHEMA_CHECK", True):
+        migrations.check(app)
+
+    return app
+
+
+def warmup(app: Flask) -> None:
+    """Trabalho caro feito uma vez no master do gunicorn, antes do fork.
+
+    Importa as bibliotecas pesadas (cliente do LLM, Pillow) e compila os
+    templates: os workers herdam tudo pronto (copy-on-write) e não pagam isso
+    na primeira requisição. Conexões e clientes HTTP NÃO são criados aqui.
+    """
+    import chat_routes
+    import media  # noqa: F401  (Pillow, se instalado)
 
-# Uploads específicos do chat (Capivara)
-app.config["CHAT_UPLOAD_FOLDER"] = os.path.join(app.config["UPLOAD_FOLDER"], "chat")
+    chat_routes.import_llm()
+    for nome in app.jinja_env.list_templates():
+        if nome.endswith(".html"):
+            app.jinja_env.get_template(nome)
 
-# Garante que as pastas existam
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
-os.makedirs(app.config["CHAT_UPLOAD_FOLDER"], exist_ok=True)
 
-# (1) migra sqlite (se existir)
-_ensure_sqlite_columns(DB_PATH)
+_app = None
 
-# (2) inicializa ORM
-db.init_app(app)
 
-# Blueprints
-app.register_blueprint(public_bp)
-app.register_blueprint(upload_bp)
-app.register_blueprint(admin_bp)
-app.register_blueprint(chat_bp)
+def __getattr__(nome):
+    # `app:app` (gunicorn), `flask --app app` e `from app import app` continuam
+    # funcionando; o app padrão só é montado quando alguém pede.
+    global _app
+    if nome == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(nome)
 
-# Cria tabelas ausentes
-with app.app_context():
-    db.create_all()
 
 if __name__ == "__main__":
+    # Desenvolvimento: aplica migrações pendentes antes de subir
+    app = create_app()
+    with app.app_context():
+        migrations.upgrade(db.engine, echo=print)
     app.run(debug=True)  # em produção: debug=False
@@ -0,0 +1,294 @@
+# audit.py — trilha de auditoria do painel admin (JSON Lines, gravação em lote)
+#
+# A requisição só monta o registro e o coloca numa fila em memória; uma thread
+# por processo grava os registros em lote em AUDIT_DIR/admin_audit.jsonl, com
+# um único write + fsync por lote.
+#
+# Vários workers (processos) escrevem no mesmo arquivo: cada lote é gravado
+# sob flock em AUDIT_DIR/.lock, então linhas nunca se misturam. A rotação
+# (por tamanho e por dia) acontece sob a mesma trava; quem ainda tem o
+# arquivo antigo aberto percebe pela troca de inode e reabre.
+#
+# Cada lote também entra num índice SQLite (audit_index.db), usado pelo
+#   flask --app app audit-query --admin X --action Y --protocolo Z
+# sem varrer os .jsonl. O índice pode ser refeito com `audit-reindex`.
+
+import os
+import json
+import glob
+import time
+import queue
+import atexit
+import sqlite3
+import datetime
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+import click
+from flask import current_app, request, session, has_request_context
+from flask.cli import with_appcontext
+
+LOG_NAME = "admin_audit.jsonl"
+INDEX_NAME = "audit_index.db"
+
+# Campos com coluna própria no índice (os demais ficam só no JSON)
+_INDEXADOS = ("admin", "protocolo", "file_id")
+
+
+def _agora_iso() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds")
+
+
+class AuditLog:
+    """Fila limitada + thread gravadora (uma por processo)."""
+
+    def __init__(self, directory: str, max_bytes: int, rotate_daily: bool = True,
+                 queue_max: int = 10000, flush_interval: float = 0.5, batch_max: int = 500):
+        self.directory = directory
+        self.path = os.path.join(directory, LOG_NAME)
+        self.lock_path = os.path.join(directory, ".lock")
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.flush_interval = flush_interval
+        self.batch_max = batch_max
+        self.queue_max = queue_max
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._fp = None
+        self.dropped_to_sync = 0
+        os.makedirs(directory, exist_ok=True)
+
+    # ---------------- produtor ----------------
+    def _ensure_thread(self) -> None:
+        # Depois de um fork (gunicorn --preload) a thread do pai não existe no filho
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_max)
+            self._fp = None
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def put(self, registro: dict) -> None:
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(registro)
+        except queue.Full:
+            # Auditoria não pode ser perdida: com a fila cheia, grava na própria requisição
+            self.dropped_to_sync += 1
+            self._write_batch([registro])
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Espera a fila esvaziar (testes, encerramento do processo)."""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        fim = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < fim:
+            time.sleep(0.01)
+
+    # ---------------- gravador ----------------
+    def _run(self) -> None:
+        q = self._queue
+        while True:
+            lote = [q.get()]
+            prazo = time.monotonic() + self.flush_interval
+            while len(lote) < self.batch_max:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(q.get(timeout=restante))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(lote)
+            except Exception:
+                # Em último caso, não derruba a thread (a próxima tentativa reabre tudo)
+                self._fp = None
+            finally:
+                for _ in lote:
+                    q.task_done()
+
+    def _open(self):
+        if self._fp is not None:
+            try:
+                if os.fstat(self._fp.fileno()).st_ino == os.stat(self.path).st_ino:
+                    return self._fp
+            except OSError:
+                pass
+            self._fp.close()
+        self._fp = open(self.path, "ab")
+        return self._fp
+
+    def _rotate_if_needed(self) -> None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        dia_arquivo = datetime.date.fromtimestamp(st.st_mtime)
+        por_dia = self.rotate_daily and st.st_size > 0 and dia_arquivo != datetime.date.today()
+        if st.st_size < self.max_bytes and not por_dia:
+            return
+        stamp = datetime.datetime.fromtimestamp(st.st_mtime).strftime("%Y%m%d-%H%M%S")
+        destino = os.path.join(self.directory, f"admin_audit-{stamp}-{st.st_ino}.jsonl")
+        os.rename(self.path, destino)
+        # O que já estava indexado aponta para o arquivo novo
+        with self._index() as conn:
+            conn.execute("UPDATE audit SET arquivo = ? WHERE arquivo = ?", (os.path.basename(destino), LOG_NAME))
+
+    def _write_batch(self, lote: list) -> None:
+        linhas = [json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in lote]
+        dados = "".join(linhas).encode("utf-8")
+        with open(self.lock_path, "a") as lock_fp:
+            if fcntl:
+                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX)
+            self._rotate_if_needed()
+            fp = self._open()
+            inicio = fp.seek(0, os.SEEK_END)
+            fp.write(dados)
+            fp.flush()
+            os.fsync(fp.fileno())
+            self._index_batch(lote, linhas, inicio)
+
+    # ---------------- índice ----------------
+    def _index(self):
+        conn = sqlite3.connect(self.index_path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS audit ("
+            " id INTEGER PRIMARY KEY, ts TEXT NOT NULL, action TEXT NOT NULL,"
+            " admin TEXT, protocolo TEXT, file_id INTEGER,"
+            " arquivo TEXT NOT NULL, offset INTEGER NOT NULL, registro TEXT NOT NULL)"
+        )
+        for col in ("admin", "action", "protocolo"):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS ix_audit_{col}_ts ON audit ({col}, ts)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_audit_ts ON audit (ts)")
+        return conn
+
+    def _index_batch(self, lote, linhas, inicio: int, arquivo: str = LOG_NAME) -> None:
+        rows = []
+        offset = inicio
+        for r, linha in zip(lote, linhas):
+            rows.append((r["ts"], r["action"], r.get("admin"), r.get("protocolo"), r.get("file_id"),
+                         arquivo, offset, linha.rstrip("\n")))
+            offset += len(linha.encode("utf-8"))
+        with self._index() as conn:
+            conn.executemany(
+                "INSERT INTO audit (ts, action, admin, protocolo, file_id, arquivo, offset, registro)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def reindex(self) -> int:
+        """Refaz o índice a partir de todos os .jsonl (o log é a fonte da verdade)."""
+        with open(self.lock_path, "a") as lock_fp:
+            if fcntl:
+                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX)
+            with self._index() as conn:
+                conn.execute("DELETE FROM audit")
+            total = 0
+            arquivos = sorted(glob.glob(os.path.join(self.directory, "admin_audit-*.jsonl")))
+            if os.path.exists(self.path):
+                arquivos.append(self.path)
+            for path in arquivos:
+                lote, linhas, offset, inicio = [], [], 0, 0
+                with open(path, "rb") as fp:
+                    for raw in fp:
+                        try:
+                            r = json.loads(raw)
+                        except ValueError:
+                            offset += len(raw)
+                            continue
+                        if not lote:
+                            inicio = offset
+                        lote.append(r)
+                        linhas.append(raw.decode("utf-8"))
+                        offset += len(raw)
+                        if len(lote) >= 1000:
+                            self._index_batch(lote, linhas, inicio, os.path.basename(path))
+                            total += len(lote)
+                            lote, linhas = [], []
+                if lote:
+                    self._index_batch(lote, linhas, inicio, os.path.basename(path))
+                    total += len(lote)
+            return total
+
+    def query(self, admin=None, action=None, protocolo=None, since=None, until=None, limit=100) -> list:
+        conds, params = [], []
+        for col, val in (("admin", admin), ("action", action), ("protocolo", protocolo)):
+            if val:
+                conds.append(f"{col} = ?")
+                params.append(val)
+        if since:
+            conds.append("ts >= ?")
+            params.append(since)
+        if until:
+            conds.append("ts < ?")
+            params.append(until)
+        where = ("WHERE " + " AND ".join(conds)) if conds else ""
+        with self._index() as conn:
+            rows = conn.execute(
+                f"SELECT registro FROM audit {where} ORDER BY ts DESC, id DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+
+# ----------------------------------------------------------
+# Integração com o app
+# ----------------------------------------------------------
+def init_app(app) -> AuditLog:
+    log = AuditLog(
+        app.config.setdefault("AUDIT_DIR", os.path.join(app.root_path, "audit")),
+        app.config.setdefault("AUDIT_MAX_BYTES", int(os.environ.get("AUDIT_MAX_BYTES", 50 * 1024 * 1024))),
+        rotate_daily=app.config.setdefault("AUDIT_ROTATE_DAILY", True),
+    )
+    app.extensions["audit"] = log
+    atexit.register(log.flush)
+    return log
+
+
+def record(action: str, **fields) -> None:
+    """Registra uma ação do painel. Não bloqueia a requisição nem levanta erro."""
+    try:
+        registro = {"ts": _agora_iso(), "action": action}
+        if has_request_context():
+            registro["admin"] = session.get("admin_user")
+            registro["ip"] = request.headers.get("X-Forwarded-For", request.remote_addr)
+            registro["ua"] = request.headers.get("User-Agent")
+            registro["path"] = request.full_path.rstrip("?")
+        registro.update(fields)
+        current_app.extensions["audit"].put(registro)
+    except Exception:
+        # Auditoria não pode derrubar o painel
+        current_app.logger.exception("falha ao registrar auditoria %s", action)
+
+
+@click.command("audit-query")
+@click.option("--admin")
+@click.option("--action")
+@click.option("--protocolo")
+@click.option("--since", help="ISO 8601 (ex.: 2026-01-31 ou 2026-01-31T12:00)")
+@click.option("--until", help="ISO 8601, exclusivo")
+@click.option("--limit", default=100, show_default=True)
+@with_appcontext
+def audit_query_command(admin, action, protocolo, since, until, limit):
+    """Consulta a trilha de auditoria pelo índice (JSON Lines na saída)."""
+    for r in current_app.extensions["audit"].query(admin, action, protocolo, since, until, limit):
+        click.echo(json.dumps(r, ensure_ascii=False))
+
+
+@click.command("audit-reindex")
+@with_appcontext
+def audit_reindex_command():
+    """Refaz o índice de auditoria a partir dos arquivos .jsonl."""
+    n = current_app.extensions["audit"].reindex()
+    click.echo(f"registros indexados={n}")
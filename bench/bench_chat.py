@@ -0,0 +1,120 @@
+# bench/bench_chat.py — commits por mensagem e latência do /api/chat/enviar
+#
+# Sobe o LLM falso (bench/fake_llm.py), aponta o app para um banco SQLite
+# temporário e dispara mensagens (com anexos) de vários clientes em paralelo.
+#
+#   python bench/bench_chat.py --messages 400 --concurrency 8 --llm-latency 0.05
+#
+# Mede: COMMITs por mensagem (contados no engine) e latência p50/p99.
+
+import io
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(__file__))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do chat (commits e latência)")
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--conversations", type=int, default=16)
+    parser.add_argument("--attachments", type=int, default=2, help="anexos por mensagem")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    import fake_llm
+    server = fake_llm.serve(args.port, args.llm_latency, 0.0, 20)
+
+    workdir = tempfile.mkdtemp(prefix="bench-chat-")
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    # Mede o chat, não o rate limit (ratelimit.py) nem o teto de vagas do LLM
+    os.environ.setdefault("RATELIMIT_BACKEND", "off")
+    os.environ.setdefault("LLM_MAX_CONCORRENTES", "64")
+
+    from sqlalchemy import event
+    from app import create_app
+    from models import db
+    import migrations
+
+    flask_app = create_app({
+        "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+        "BLOB_FOLDER": os.path.join(workdir, "uploads", "blobs"),
+        "CHAT_UPLOAD_FOLDER": os.path.join(workdir, "uploads", "chat"),
+        "SCHEMA_CHECK": False,
+    })
+
+    commits = 0
+    lock = threading.Lock()
+
+    with flask_app.app_context():
+        migrations.upgrade(db.engine)
+        engine = db.engine
+
+    @event.listens_for(engine, "commit")
+    def _count_commit(conn):
+        nonlocal commits
+        with lock:
+            commits += 1
+
+    client = flask_app.test_client()
+
+    # Uma conversa por "usuário"; mensagens seguintes reaproveitam o histórico
+    conversas = []
+    for i in range(args.conversations):
+        r = client.post("/api/chat/enviar", data={"texto": f"olá {i}"})
+        conversas.append(r.get_json()["conversa_id"])
+
+    commits = 0
+    latencias = []
+
+    def enviar(n):
+        data = {"texto": f"mensagem {n}", "conversa_id": str(conversas[n % len(conversas)])}
+        if args.attachments:
+            data["arquivos[]"] = [
+                (io.BytesIO(os.urandom(2048)), f"foto{k}.jpg", "image/jpeg")
+                for k in range(args.attachments)
+            ]
+        t0 = time.perf_counter()
+        r = client.post("/api/chat/enviar", data=data, content_type="multipart/form-data")
+        dt = time.perf_counter() - t0
+        if r.status_code != 200:
+            raise RuntimeError(r.get_data(as_text=True))
+        with lock:
+            latencias.append(dt)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(enviar, range(args.messages)))
+    total = time.perf_counter() - t0
+
+    server.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"mensagens={args.messages} concorrência={args.concurrency} anexos/msg={args.attachments} "
+          f"latência_llm={args.llm_latency * 1000:.0f}ms")
+    print(f"commits/mensagem={commits / args.messages:.2f}")
+    print(f"latência p50={percentile(latencias, 50) * 1000:.1f}ms "
+          f"p99={percentile(latencias, 99) * 1000:.1f}ms "
+          f"vazão={args.messages / total:.1f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
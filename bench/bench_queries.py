@@ -0,0 +1,106 @@
+# bench/bench_queries.py — consultas SQL por página (guarda contra N+1)
+#
+# Monta um banco SQLite temporário com um protocolo de várias manifestações
+# (cada uma com anexos) e uma conversa do chat com anexos, e confere com
+# db_instrumentation.assert_max_queries que as páginas não voltaram a fazer
+# uma consulta por item:
+#
+#   /admin/protocolo/<protocolo>   usuário + manifestações + anexos (IN)
+#   /api/chat/historico            última mensagem + mensagens + anexos (IN)
+#
+#   python bench/bench_queries.py --submissions 20 --files 3 --messages 60
+#
+# Sai com código 1 (e a lista de consultas) se alguma página passar do teto.
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+MAX_QUERIES = 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consultas SQL por página (N+1)")
+    parser.add_argument("--submissions", type=int, default=20)
+    parser.add_argument("--files", type=int, default=3, help="anexos por manifestação")
+    parser.add_argument("--messages", type=int, default=60)
+    parser.add_argument("--max-queries", type=int, default=MAX_QUERIES)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-queries-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault("RATELIMIT_BACKEND", "off")
+
+    from app import create_app
+    from models import db, User, Submission, File, ChatConversa, ChatMensagem, ChatAnexo
+    from db_instrumentation import assert_max_queries
+    import migrations
+
+    flask_app = create_app({
+        "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+        "BLOB_FOLDER": os.path.join(workdir, "uploads", "blobs"),
+        "CHAT_UPLOAD_FOLDER": os.path.join(workdir, "uploads", "chat"),
+        "SCHEMA_CHECK": False,
+    })
+
+    with flask_app.app_context():
+        migrations.upgrade(db.engine)
+        user = User(protocolo="BENCH-N1", is_public=False)
+        db.session.add(user)
+        db.session.flush()
+        for i in range(args.submissions):
+            sub = Submission(user_id=user.id, tipo="texto", texto=f"manifestação {i}")
+            db.session.add(sub)
+            db.session.flush()
+            for k in range(args.files):
+                db.session.add(File(submission_id=sub.id, file_type="image", original_name=f"foto{k}.jpg",
+                                    file_path=f"static/uploads/foto{i}-{k}.jpg", mime_type="image/jpeg"))
+        conversa = ChatConversa()
+        db.session.add(conversa)
+        db.session.flush()
+        for i in range(args.messages):
+            msg = ChatMensagem(conversa_id=conversa.id, autor="usuario" if i % 2 == 0 else "capivara",
+                               conteudo_texto=f"mensagem {i}")
+            db.session.add(msg)
+            db.session.flush()
+            if i % 2 == 0:
+                db.session.add(ChatAnexo(mensagem_id=msg.id, tipo="imagem", nome_arquivo=f"anexo{i}.jpg",
+                                         url_arquivo=f"/static/uploads/chat/anexo{i}.jpg", mime_type="image/jpeg"))
+        db.session.commit()
+        conversa_id = conversa.id
+
+    client = flask_app.test_client()
+    with client.session_transaction() as s:
+        s["admin_logged"] = True
+
+    paginas = [
+        ("protocolo", "/admin/protocolo/BENCH-N1"),
+        ("historico", f"/api/chat/historico?conversa_id={conversa_id}"),
+        ("historico (antes)", f"/api/chat/historico?conversa_id={conversa_id}&before_id={args.messages // 2}"),
+    ]
+    falhou = False
+    for nome, url in paginas:
+        try:
+            with assert_max_queries(args.max_queries) as contador:
+                r = client.get(url)
+        except AssertionError as exc:
+            falhou = True
+            print(f"{nome:<18} FALHOU  {exc}")
+            continue
+        if r.status_code != 200:
+            falhou = True
+            print(f"{nome:<18} HTTP {r.status_code}")
+            continue
+        print(f"{nome:<18} ok      {contador.count} consultas (máx. {args.max_queries})")
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if falhou else 0)
+
+
+if __name__ == "__main__":
+    main()
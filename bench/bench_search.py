@@ -0,0 +1,114 @@
+# bench/bench_search.py — latência da busca textual (search.py / FTS5)
+#
+# Popula um banco SQLite temporário com N manifestações sintéticas (palavras com
+# frequência de Zipf; o índice é mantido pelos triggers da migração 005, como em
+# produção) e mede buscar() para consultas comuns, raras e por prefixo.
+#
+#   python bench/bench_search.py --rows 1000000 --queries 200
+#
+# Alvo: p99 < 50ms.
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+PALAVRAS = (
+    "calçada quebrada buraco rua avenida iluminação pública poste apagado lixo coleta "
+    "ônibus atrasado linha parada escola creche saúde posto atendimento fila demora "
+    "água esgoto vazamento asfalto semáforo trânsito praça árvore poda ruído barulho "
+    "reclamação denúncia sugestão elogio servidor hospital remédio segurança polícia"
+).split()
+BAIRROS = ["Ceilândia", "Taguatinga", "Samambaia", "Planaltina", "Gama", "Sobradinho",
+           "Guará", "Águas Claras", "Recanto das Emas", "São Sebastião"]
+
+CONSULTAS = ["calcada quebrada", "iluminacao", "onibus atrasado", "reclam", "sao sebastiao buraco",
+             "semaforo", "poda arvore praca", "esgoto vazamento ceilandia", "posto saude fila", "ru"]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+def vocabulario(rng, tamanho=30000):
+    """Vocabulário com frequências de Zipf (como texto real): as palavras do
+    domínio ficam espalhadas entre as posições 1 e ~3000, o resto é preenchido
+    com palavras sintéticas."""
+    palavras = [f"p{i:05d}" for i in range(tamanho)]
+    for w in PALAVRAS:
+        palavras[int(rng.paretovariate(0.6)) % 3000] = w
+    pesos = [1.0 / (i + 1) for i in range(tamanho)]
+    acumulado, total = [], 0.0
+    for p in pesos:
+        total += p
+        acumulado.append(total)
+    return palavras, acumulado
+
+
+def texto_aleatorio(rng, vocab):
+    palavras, acumulado = vocab
+    n = rng.randint(8, 40)
+    return " ".join(rng.choices(palavras, cum_weights=acumulado, k=n)) + " em " + rng.choice(BAIRROS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da busca textual")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=20000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-search-")
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from app import create_app
+    from models import db
+    from sqlalchemy import text
+    import migrations
+    import search
+
+    flask_app = create_app({"SCHEMA_CHECK": False})
+    rng = random.Random(42)
+    vocab = vocabulario(rng)
+    try:
+        with flask_app.app_context():
+            migrations.upgrade(db.engine)
+            t0 = time.perf_counter()
+            with db.engine.begin() as conn:
+                conn.execute(text("INSERT INTO user (protocolo, is_public) VALUES ('BENCH', 0)"))
+                for inicio in range(0, args.rows, args.batch):
+                    n = min(args.batch, args.rows - inicio)
+                    conn.execute(
+                        text("INSERT INTO submission (user_id, tipo, texto, status) VALUES (1, 'texto', :t, 'recebido')"),
+                        [{"t": texto_aleatorio(rng, vocab)} for _ in range(n)],
+                    )
+            carga = time.perf_counter() - t0
+            print(f"linhas={args.rows} carga+índice={carga:.1f}s")
+
+            latencias = {q: [] for q in CONSULTAS}
+            for i in range(args.queries):
+                q = CONSULTAS[i % len(CONSULTAS)]
+                t = time.perf_counter()
+                search.buscar(q, "manifestacoes", pagina=1 + (i % 3))
+                latencias[q].append(time.perf_counter() - t)
+                db.session.remove()
+
+            todas = [v for vs in latencias.values() for v in vs]
+            for q, vs in latencias.items():
+                print(f"  {q!r:28} p50={percentile(vs, 50) * 1000:6.1f}ms p99={percentile(vs, 99) * 1000:6.1f}ms")
+            print(f"latência p50={percentile(todas, 50) * 1000:.1f}ms p99={percentile(todas, 99) * 1000:.1f}ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# bench/bench_startup.py — custo de subir um worker: import, create_app e 1ª requisição
+#
+# Cada medição roda num processo Python novo (como um worker recém-criado):
+#
+#   import      -> `import app` (módulos, sem montar o app)
+#   create_app  -> montar o app (config, engines, blueprints, conferência do schema)
+#   1ª req      -> GET / e GET /admin/login pelo test client (inclui compilar templates)
+#   preload     -> 1ª requisição num processo em que warmup() já rodou, como um
+#                  worker nascido por fork do master com preload_app
+#
+#   python bench/bench_startup.py --runs 10
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+FILHO = r"""
+import json, os, sys, time
+sys.path.insert(0, os.environ["BENCH_ROOT"])
+os.chdir(os.environ["BENCH_ROOT"])
+t0 = time.perf_counter()
+import app as modulo
+t1 = time.perf_counter()
+# Árvores antigas (sem create_app) montavam o app no import
+flask_app = modulo.create_app() if hasattr(modulo, "create_app") else modulo.app
+t2 = time.perf_counter()
+if os.environ.get("BENCH_PRELOAD") and hasattr(modulo, "warmup"):
+    modulo.warmup(flask_app)
+t3 = time.perf_counter()
+c = flask_app.test_client()
+assert c.get("/").status_code == 200
+assert c.get("/admin/login").status_code == 200
+t4 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "create_app": t2 - t1, "warmup": t3 - t2, "primeira_req": t4 - t3}))
+"""
+
+
+def medir(runs: int, preload: bool, env: dict) -> dict:
+    amostras = {}
+    for _ in range(runs):
+        e = dict(env, BENCH_PRELOAD="1" if preload else "")
+        out = subprocess.run([sys.executable, "-c", FILHO], env=e, capture_output=True, text=True, check=True)
+        for k, v in json.loads(out.stdout.strip().splitlines()[-1]).items():
+            amostras.setdefault(k, []).append(v)
+    return {k: statistics.median(v) for k, v in amostras.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de inicialização do app")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--root", default=ROOT, help="árvore do app a medir (ex.: um worktree antigo)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    env = dict(os.environ)
+    env.setdefault("GROQ_API_KEY", "bench")
+    env["BENCH_ROOT"] = os.path.abspath(args.root)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    frio = medir(args.runs, False, env)
+    pre = medir(args.runs, True, env)
+    ms = lambda s: f"{s * 1000:7.1f}ms"  # noqa: E731
+    print(f"execuções={args.runs} (medianas)")
+    print(f"  import       {ms(frio['import'])}")
+    print(f"  create_app   {ms(frio['create_app'])}")
+    print(f"  1ª req       {ms(frio['primeira_req'])}   (worker sem preload)")
+    print(f"  1ª req       {ms(pre['primeira_req'])}   (depois do warmup, como worker com preload)")
+    print(f"  warmup       {ms(pre['warmup'])}   (pago uma vez no master)")
+    print(f"  até servir   {ms(frio['import'] + frio['create_app'] + frio['primeira_req'])} sem preload")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# bench/fake_llm.py — servidor LLM falso, compatível com a API do Groq (OpenAI)
+#
+# Serve POST /openai/v1/chat/completions, com ou sem stream=True, para testar o
+# chat da Capivara sem chave nem custo:
+#
+#   python bench/fake_llm.py --port 8001 --latency 0.8 --tokens 40
+#   GROQ_API_KEY=x GROQ_BASE_URL=http://127.0.0.1:8001 python app.py
+#
+# --latency simula o tempo até o primeiro token; --token-delay o intervalo
+# entre tokens no modo stream.
+
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPOSTA = "Olá! Sou a Capivara GDF. Posso ajudar a registrar sua manifestação. "
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    token_delay = 0.0
+    tokens = 20
+    calls = 0
+    _lock = threading.Lock()
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _tokens(self):
+        palavras = (RESPOSTA * (self.tokens // 8 + 1)).split(" ")
+        return [p + " " for p in palavras[: self.tokens]]
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        with FakeLLMHandler._lock:
+            FakeLLMHandler.calls += 1
+
+        time.sleep(self.latency)
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model", "fake")}
+
+        if not body.get("stream"):
+            payload = json.dumps({
+                **base,
+                "object": "chat.completion",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(self._tokens())},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": self.tokens, "total_tokens": self.tokens},
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(obj):
+            data = b"data: " + (obj if isinstance(obj, bytes) else json.dumps(obj).encode("utf-8")) + b"\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        for tok in self._tokens():
+            send({**base, "object": "chat.completion.chunk",
+                  "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}]})
+            time.sleep(self.token_delay)
+        send({**base, "object": "chat.completion.chunk",
+              "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        send(b"[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve(port: int = 8001, latency: float = 0.0, token_delay: float = 0.0, tokens: int = 20):
+    """Sobe o servidor em background e devolve a instância (use .shutdown())."""
+    FakeLLMHandler.latency = latency
+    FakeLLMHandler.token_delay = token_delay
+    FakeLLMHandler.tokens = tokens
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeLLMHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM falso compatível com Groq/OpenAI")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--tokens", type=int, default=30)
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency, args.token_delay, args.tokens)
+    print(f"LLM falso em http://127.0.0.1:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,220 @@
+# chat_context.py — contexto do LLM por conversa (cache LRU + janela por tokens)
+#
+# Cada turno do chat precisava reconsultar as últimas 12 ChatMensagem e mandava
+# todas ao Groq, qualquer que fosse o tamanho. Aqui:
+#   - o histórico recente de cada conversa fica num LRU em memória (por processo),
+#     chaveado por conversa_id; cada leitura confere o max(id) da conversa no
+#     banco (um lookup no índice) e traz só o que outro worker gravou depois;
+#   - mensagens gravadas entram no cache no commit (eventos do SQLAlchemy) e
+#     edições/remoções invalidam a entrada;
+#   - a janela enviada ao LLM é escolhida por orçamento de tokens, e as
+#     mensagens antigas que não cabem viram um resumo curto.
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, object_session
+
+from models import db, ChatConversa, ChatMensagem
+
+# Orçamento de tokens do histórico (sem contar o prompt de sistema)
+TOKENS_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKENS", "1500"))
+# Teto do resumo das mensagens antigas
+RESUMO_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "250"))
+# Conversas mantidas em memória e mensagens guardadas por conversa
+CACHE_MAX = int(os.getenv("CHAT_CONTEXT_CACHE_SIZE", "1000"))
+HISTORICO_MAX = 40
+
+# Custo fixo aproximado por mensagem no formato de chat (role, separadores)
+_TOKENS_POR_MENSAGEM = 4
+
+Turno = namedtuple("Turno", "id role content tokens")
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimativa barata (~4 caracteres por token), sem depender de tokenizer."""
+    return _TOKENS_POR_MENSAGEM + (len(texto or "") + 3) // 4
+
+
+def turno(msg_id, autor: str, conteudo: str) -> Turno:
+    role = "assistant" if autor == "capivara" else "user"
+    conteudo = conteudo or ""
+    return Turno(msg_id, role, conteudo, estimar_tokens(conteudo))
+
+
+class ContextCache:
+    """LRU thread-safe: conversa_id -> lista de Turno (ordem crescente de id)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conversa_id):
+        with self._lock:
+            turnos = self._data.get(conversa_id)
+            if turnos is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(conversa_id)
+            self.hits += 1
+            return list(turnos)
+
+    def put(self, conversa_id, turnos) -> None:
+        with self._lock:
+            self._data[conversa_id] = list(turnos)[-HISTORICO_MAX:]
+            self._data.move_to_end(conversa_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def append(self, conversa_id, novos) -> None:
+        """Acrescenta turnos recém-gravados (só se a conversa já estiver no cache)."""
+        with self._lock:
+            turnos = self._data.get(conversa_id)
+            if turnos is None:
+                return
+            conhecidos = {t.id for t in turnos}
+            turnos.extend(t for t in novos if t.id not in conhecidos)
+            turnos.sort(key=lambda t: t.id)
+            del turnos[:-HISTORICO_MAX]
+
+    def invalidate(self, conversa_id) -> None:
+        with self._lock:
+            self._data.pop(conversa_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+cache = ContextCache(CACHE_MAX)
+
+
+def _consultar(conversa_id, depois_de=None) -> list:
+    """Últimas HISTORICO_MAX mensagens (conversa_id, id desc), opcionalmente só id > depois_de."""
+    q = (ChatMensagem.query
+         .with_entities(ChatMensagem.id, ChatMensagem.autor, ChatMensagem.conteudo_texto)
+         .filter_by(conversa_id=conversa_id))
+    if depois_de is not None:
+        q = q.filter(ChatMensagem.id > depois_de)
+    rows = q.order_by(ChatMensagem.id.desc()).limit(HISTORICO_MAX).all()
+    return [turno(i, autor, conteudo) for i, autor, conteudo in reversed(rows)]
+
+
+def carregar(conversa_id) -> list:
+    """Histórico recente da conversa: do cache ou de uma consulta (conversa_id, id desc).
+
+    O cache é por processo: outro worker do gunicorn pode ter gravado turnos
+    desta conversa. A entrada só é usada se o último id bate com o max(id) do
+    banco; se o banco estiver à frente, carrega só a diferença.
+    """
+    turnos = cache.get(conversa_id)
+    if turnos is not None:
+        ultimo_banco = (db.session.query(func.max(ChatMensagem.id))
+                        .filter(ChatMensagem.conversa_id == conversa_id)
+                        .scalar())
+        ultimo = turnos[-1].id if turnos else None
+        if ultimo_banco == ultimo:
+            return turnos
+        if ultimo_banco is not None and (ultimo is None or ultimo_banco > ultimo):
+            cache.append(conversa_id, _consultar(conversa_id, depois_de=ultimo))
+            return cache.get(conversa_id) or []
+        # Banco atrás do cache (mensagem removida em outro worker): recarrega
+
+    turnos = _consultar(conversa_id)
+    cache.put(conversa_id, turnos)
+    return turnos
+
+
+def _resumir(antigos, limite_tokens: int) -> str:
+    """Resumo extrativo: primeira frase de cada mensagem, das mais novas às mais
+    antigas, até o teto de tokens. Não chama o LLM (custo zero)."""
+    linhas = []
+    usado = estimar_tokens("Resumo da conversa anterior:")
+    for t in reversed(antigos):
+        texto = " ".join(t.content.split())
+        if not texto:
+            continue
+        frase = texto.split(". ")[0][:160]
+        quem = "Capivara" if t.role == "assistant" else "Usuário"
+        linha = f"- {quem}: {frase}"
+        custo = estimar_tokens(linha) - _TOKENS_POR_MENSAGEM
+        if usado + custo > limite_tokens:
+            break
+        linhas.append(linha)
+        usado += custo
+    if not linhas:
+        return None
+    return "Resumo da conversa anterior:\n" + "\n".join(reversed(linhas))
+
+
+def janela(turnos, budget: int = None):
+    """Escolhe as mensagens mais recentes que cabem no orçamento de tokens.
+
+    Retorna (resumo_ou_None, recentes). A última mensagem (a do usuário)
+    sempre entra, mesmo que sozinha estoure o orçamento.
+    """
+    budget = TOKENS_BUDGET if budget is None else budget
+    recentes = []
+    usado = 0
+    for i in range(len(turnos) - 1, -1, -1):
+        t = turnos[i]
+        if recentes and usado + t.tokens > budget:
+            return _resumir(turnos[:i + 1], RESUMO_TOKENS), list(reversed(recentes))
+        recentes.append(t)
+        usado += t.tokens
+    return None, list(reversed(recentes))
+
+
+# ----------------------------------------------------------
+# Sincronização com o banco: aplica no cache só o que foi commitado
+# ----------------------------------------------------------
+@event.listens_for(ChatConversa, "after_insert")
+def _conversa_criada(mapper, connection, target):
+    # Conversa nova começa no cache vazia: o próximo turno não precisa consultar
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("chat_ctx_criadas", []).append(target.id)
+
+
+@event.listens_for(ChatMensagem, "after_insert")
+def _msg_inserida(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("chat_ctx_novos", []).append(
+            (target.conversa_id, turno(target.id, target.autor, target.conteudo_texto))
+        )
+
+
+@event.listens_for(ChatMensagem, "after_update")
+@event.listens_for(ChatMensagem, "after_delete")
+def _msg_alterada(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("chat_ctx_invalidar", set()).add(target.conversa_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _aplicar(session):
+    for conversa_id in session.info.pop("chat_ctx_criadas", []):
+        cache.put(conversa_id, [])
+    novos = session.info.pop("chat_ctx_novos", [])
+    for conversa_id in session.info.pop("chat_ctx_invalidar", set()):
+        cache.invalidate(conversa_id)
+    por_conversa = {}
+    for conversa_id, t in novos:
+        por_conversa.setdefault(conversa_id, []).append(t)
+    for conversa_id, turnos in por_conversa.items():
+        cache.append(conversa_id, turnos)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _descartar(session, previous_transaction):
+    session.info.pop("chat_ctx_criadas", None)
+    session.info.pop("chat_ctx_novos", None)
+    for conversa_id in session.info.pop("chat_ctx_invalidar", set()):
+        cache.invalidate(conversa_id)
@@ -1,18 +1,50 @@
 # chat_routes.py (COMPATÍVEL com SQLite + SQLAlchemy)
 
 import os
-import uuid
-from dotenv import load_dotenv
-from flask import Blueprint, request, jsonify, current_app
+import json
+import threading
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from werkzeug.http import is_resource_modified
 from werkzeug.utils import secure_filename
-from groq import Groq
+from sqlalchemy import insert, func
+from sqlalchemy.orm import selectinload
 
 from models import db, ChatConversa, ChatMensagem, ChatAnexo
-
-load_dotenv()
+from ingest import ingest_stream
+import storage
+import chat_context
+import llm_cache
+import ratelimit
 
 chat_bp = Blueprint("chat_bp", __name__)
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def import_llm():
+    """Importa o SDK do Groq (pesado: httpx, pydantic) sem criar o cliente."""
+    from groq import Groq
+    return Groq
+
+
+def llm_client():
+    """Cliente do Groq, criado no primeiro uso em cada processo.
+
+    Por processo porque o pool de conexões HTTP não pode ser herdado de um
+    fork (gunicorn em preload). GROQ_BASE_URL permite apontar para um
+    servidor local (ex.: bench/fake_llm.py).
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                Groq = import_llm()
+                _client = Groq(api_key=os.getenv("GROQ_API_KEY"), base_url=os.getenv("GROQ_BASE_URL") or None)
+                _client_pid = os.getpid()
+    return _client
+
 
 ALLOWED = {
     "imagem": {"image/png", "image/jpeg", "image/webp"},
@@ -26,7 +58,12 @@ def detect_tipo(mime: str):
             return tipo
     return None
 
-def salvar_arquivo(file_storage):
+def receber_arquivo(file_storage):
+    """Grava o anexo num temporário (hash + escrita em passada única).
+
+    O blob só é registrado no banco em _gravar_turno, junto com a mensagem.
+    Retorna (tipo, ingested, ext, erro).
+    """
     mime = file_storage.mimetype
     tipo = detect_tipo(mime)
     if not tipo:
@@ -34,27 +71,43 @@ def salvar_arquivo(file_storage):
 
     original = secure_filename(file_storage.filename or "")
     ext = os.path.splitext(original)[1].lower()
-    fname = f"{tipo}_{uuid.uuid4().hex}{ext}"
 
-    # Usa a config nova do app.py
-    upload_folder = current_app.config.get("CHAT_UPLOAD_FOLDER") or os.path.join("static", "uploads", "chat")
-    os.makedirs(upload_folder, exist_ok=True)
+    ingested = ingest_stream(file_storage.stream, current_app.config["UPLOAD_FOLDER"], original, 0)
+    ingested.mimetype = mime
+    ingested.filename = file_storage.filename
+    return tipo, ingested, ext, None
 
-    path = os.path.join(upload_folder, fname)
-    file_storage.save(path)
+SYSTEM_PROMPT = (
+    "Você é a Capivara GDF (Capivarinha), um assistente simpático e objetivo. "
+    "Ajude o usuário com orientações e registre solicitações de forma clara. "
+    "Quando houver anexos, peça descrição do que analisar no arquivo."
+)
 
-    url = "/" + path.replace("\\", "/")
-    size = os.path.getsize(path)
-    return tipo, url, size, None
+def _llm_params(messages):
+    return {
+        "model": os.getenv("GROQ_MODEL", "llama-3.1-70b-versatile"),
+        "messages": messages,
+        "temperature": 0.4,
+        "max_tokens": 500,
+    }
 
-@chat_bp.post("/api/chat/enviar")
-def chat_enviar():
-    """
-    Form-data:
-      - conversa_id (opcional)
-      - usuario_id (opcional)
-      - texto (opcional)
-      - arquivos[] (opcional, múltiplos)
+def _limitar_turno():
+    """Fichas do turno: por IP antes de ler o corpo; depois, da conversa."""
+    ratelimit.exigir(requisicoes=1, llm=1, bytes=request.content_length or 0)
+    conversa_id = request.form.get("conversa_id")
+    if conversa_id:
+        ratelimit.exigir(f"conversa:{conversa_id}", ip=False, llm=1)
+
+def _completar(params):
+    """Chamada ao LLM (sem stream), ocupando uma das vagas globais."""
+    with ratelimit.vaga_llm():
+        return llm_client().chat.completions.create(**params).choices[0].message.content.strip()
+
+def _preparar_turno():
+    """Lê o form-data e monta o turno do usuário em memória (sem escrever no banco).
+
+    Retorna (conversa, msg_user, pendentes, None) ou (None, None, None, resposta_erro).
+    `pendentes` é a lista de (tipo, ingested, ext) dos anexos já em disco.
     """
     texto = (request.form.get("texto") or "").strip()
     conversa_id = request.form.get("conversa_id")
@@ -62,97 +115,171 @@ def chat_enviar():
     files = request.files.getlist("arquivos[]")
 
     if not texto and not files:
-        return jsonify({"ok": False, "erro": "Envie um texto ou um arquivo."}), 400
+        return None, None, None, (jsonify({"ok": False, "erro": "Envie um texto ou um arquivo."}), 400)
 
-    # 1) conversa
+    # 1) conversa (existente: só leitura; nova: criada no commit do turno)
     if conversa_id:
         conversa = ChatConversa.query.get(int(conversa_id))
         if not conversa:
-            return jsonify({"ok": False, "erro": "conversa_id inválido."}), 400
+            return None, None, None, (jsonify({"ok": False, "erro": "conversa_id inválido."}), 400)
     else:
         conversa = ChatConversa(
             usuario_id=int(usuario_id) if usuario_id else None,
             titulo="Chat Capivara"
         )
-        db.session.add(conversa)
-        db.session.commit()
 
-    # 2) mensagem do usuário
-    msg_user = ChatMensagem(
-        conversa_id=conversa.id,
-        autor="usuario",
-        conteudo_texto=texto if texto else None
-    )
-    db.session.add(msg_user)
-    db.session.commit()
+    # 2) mensagem do usuário (ligada à conversa só na gravação)
+    msg_user = ChatMensagem(autor="usuario", conteudo_texto=texto if texto else None)
 
-    # 3) anexos
-    anexos_salvos = []
+    # 3) anexos: bytes vão para o disco agora; linhas no banco, em lote, depois
+    pendentes = []
     for f in files:
-        tipo, url, size, err = salvar_arquivo(f)
+        tipo, ingested, ext, err = receber_arquivo(f)
         if err:
             continue
+        pendentes.append((tipo, ingested, ext))
 
-        anexo = ChatAnexo(
-            mensagem_id=msg_user.id,
-            tipo=tipo,
-            nome_arquivo=f.filename,
-            mime_type=f.mimetype,
-            tamanho_bytes=size,
-            url_arquivo=url
-        )
-        db.session.add(anexo)
-        anexos_salvos.append({"tipo": tipo, "url": url, "mime": f.mimetype})
+    if request.content_length is None and pendentes:
+        # Corpo chunked: _limitar_turno não cobrou bytes; cobra o que chegou
+        try:
+            ratelimit.exigir(bytes=sum(ingested.size for _, ingested, _ in pendentes))
+        except ratelimit.LimiteExcedido:
+            for _, ingested, _ in pendentes:
+                ingested.discard()
+            raise
+
+    return conversa, msg_user, pendentes, None
+
+def _gravar_turno(conversa, msg_user, pendentes, resposta=None):
+    """Uma única transação: conversa nova + mensagem + anexos (INSERT em lote)
+    e, se houver, a resposta da capivara. Retorna (anexos_salvos, msg_bot).
+    """
+    if conversa.id is None:
+        db.session.add(conversa)
+    msg_user.conversa = conversa
+    db.session.add(msg_user)
+
+    msg_bot = None
+    if resposta is not None:
+        msg_bot = ChatMensagem(conversa=conversa, autor="capivara", conteudo_texto=resposta)
+        db.session.add(msg_bot)
+
+    db.session.flush()  # ids de conversa/mensagens
+
+    anexos_salvos = []
+    rows = []
+    for tipo, ingested, ext in pendentes:
+        url = "/" + storage.store(ingested, ext)
+        rows.append({
+            "mensagem_id": msg_user.id,
+            "tipo": tipo,
+            "nome_arquivo": ingested.filename,
+            "mime_type": ingested.mimetype,
+            "tamanho_bytes": ingested.size,
+            "url_arquivo": url,
+            "sha256": ingested.sha256,
+        })
+        anexos_salvos.append({"tipo": tipo, "url": url, "mime": ingested.mimetype})
+
+    if rows:
+        db.session.execute(insert(ChatAnexo), rows)
 
     db.session.commit()
+    return anexos_salvos, msg_bot
 
-    # 4) contexto mínimo (últimas 12)
-    ultimas = (ChatMensagem.query
-               .filter_by(conversa_id=conversa.id)
-               .order_by(ChatMensagem.id.desc())
-               .limit(12)
-               .all())
-    ultimas = list(reversed(ultimas))
-
-    messages = [{
-        "role": "system",
-        "content": (
-            "Você é a Capivara GDF (Capivarinha), um assistente simpático e objetivo. "
-            "Ajude o usuário com orientações e registre solicitações de forma clara. "
-            "Quando houver anexos, peça descrição do que analisar no arquivo."
-        )
-    }]
+def _montar_contexto(conversa, msg_user, pendentes):
+    """Prompt do LLM: system + histórico recente dentro do orçamento de tokens
+    (+ resumo do que ficou de fora, + aviso de anexos).
 
-    for m in ultimas:
-        role = "assistant" if m.autor == "capivara" else "user"
-        messages.append({"role": role, "content": m.conteudo_texto or ""})
+    O histórico vem do cache por conversa (chat_context.py), conferido com
+    o max(id) no banco; a consulta completa só acontece quando a conversa
+    não está em memória. A mensagem atual ainda não foi gravada e entra por
+    último.
+    """
+    historico = []
+    if conversa.id is not None:
+        with db.session.no_autoflush:
+            historico = chat_context.carregar(conversa.id)
+
+    atual = chat_context.turno(None, "usuario", msg_user.conteudo_texto)
+    resumo, recentes = chat_context.janela(historico + [atual])
+
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if resumo:
+        messages.append({"role": "system", "content": resumo})
 
-    if anexos_salvos:
+    for t in recentes:
+        messages.append({"role": t.role, "content": t.content})
+
+    if pendentes:
         messages.append({
             "role": "user",
             "content": (
-                f"Enviei anexos no chat: {', '.join([a['tipo'] for a in anexos_salvos])}. "
+                f"Enviei anexos no chat: {', '.join([tipo for tipo, _, _ in pendentes])}. "
                 "Considere que eles estão registrados no sistema."
             )
         })
+    return messages
 
-    # 5) Groq
-    resp = client.chat.completions.create(
-        model=os.getenv("GROQ_MODEL", "llama-3.1-70b-versatile"),
-        messages=messages,
-        temperature=0.4,
-        max_tokens=500
-    )
-    resposta = resp.choices[0].message.content.strip()
-
-    # 6) salva resposta da capivara
+def _salvar_resposta(conversa_id, resposta):
     msg_bot = ChatMensagem(
-        conversa_id=conversa.id,
+        conversa_id=conversa_id,
         autor="capivara",
         conteudo_texto=resposta
     )
     db.session.add(msg_bot)
     db.session.commit()
+    return msg_bot
+
+@chat_bp.post("/api/chat/enviar")
+def chat_enviar():
+    """
+    Form-data:
+      - conversa_id (opcional)
+      - usuario_id (opcional)
+      - texto (opcional)
+      - arquivos[] (opcional, múltiplos)
+
+    Nenhuma escrita no banco acontece durante a chamada ao LLM: o turno
+    inteiro (conversa, mensagem, anexos e resposta) vai num único commit.
+    """
+    _limitar_turno()
+    conversa, msg_user, pendentes, erro = _preparar_turno()
+    if erro:
+        return erro
+
+    # 4) contexto (cache por conversa; janela por tokens)
+    messages = _montar_contexto(conversa, msg_user, pendentes)
+
+    # 5) Groq (ou cache de respostas / pedido idêntico já em andamento)
+    params = _llm_params(messages)
+    try:
+        resposta = llm_cache.cache.get_or_compute(llm_cache.chave(params), lambda: _completar(params))
+    except ratelimit.LimiteExcedido as exc:
+        # Todas as vagas do LLM ocupadas: a mensagem fica gravada, sem resposta
+        _gravar_turno(conversa, msg_user, pendentes)
+        resp = jsonify({
+            "ok": False,
+            "erro": ratelimit.MENSAGENS["llm_concorrencia"],
+            "retry_after": ratelimit.retry_after(exc),
+            "conversa_id": conversa.id,
+            "usuario_msg_id": msg_user.id,
+        })
+        resp.headers["Retry-After"] = str(ratelimit.retry_after(exc))
+        return resp, 429
+    except Exception:
+        current_app.logger.exception("Falha na chamada ao LLM")
+        # A mensagem do usuário não se perde, mesmo sem resposta
+        _gravar_turno(conversa, msg_user, pendentes)
+        return jsonify({
+            "ok": False,
+            "erro": "Falha ao gerar a resposta. Tente novamente.",
+            "conversa_id": conversa.id,
+            "usuario_msg_id": msg_user.id,
+        }), 502
+
+    # 6) grava tudo de uma vez
+    anexos_salvos, _ = _gravar_turno(conversa, msg_user, pendentes, resposta)
 
     return jsonify({
         "ok": True,
@@ -162,34 +289,206 @@ def chat_enviar():
         "resposta": resposta
     })
 
+def _sse(data: dict, event: str = None) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    return (f"event: {event}\n" if event else "") + f"data: {payload}\n\n"
+
+@chat_bp.post("/api/chat/stream")
+def chat_stream():
+    """
+    Mesmo form-data de /api/chat/enviar, mas a resposta chega em
+    Server-Sent Events conforme o LLM gera os tokens:
+
+      event: meta   -> {"conversa_id", "usuario_msg_id", "anexos"}
+      data          -> {"delta": "..."} (vários)
+      event: done   -> {"capivara_msg_id", "resposta"}
+      event: error  -> {"erro"} (+ "retry_after" se o LLM estiver sem vagas)
+
+    O worker não fica bloqueado esperando a resposta inteira: rodando com
+    gunicorn + gevent (ver README), cada stream é um greenlet e o I/O com o
+    Groq cede a vez para os demais chats abertos.
+    """
+    _limitar_turno()
+    conversa, msg_user, pendentes, erro = _preparar_turno()
+    if erro:
+        return erro
+
+    # O turno do usuário é gravado antes do stream (o cliente recebe os ids no "meta")
+    messages = _montar_contexto(conversa, msg_user, pendentes)
+    anexos_salvos, _ = _gravar_turno(conversa, msg_user, pendentes)
+
+    # O gerador roda depois do retorno da view: guarda só valores simples
+    conversa_id = conversa.id
+    usuario_msg_id = msg_user.id
+
+    def gerar():
+        yield _sse({
+            "conversa_id": conversa_id,
+            "usuario_msg_id": usuario_msg_id,
+            "anexos": anexos_salvos,
+        }, event="meta")
+
+        params = _llm_params(messages)
+        chave = llm_cache.chave(params)
+        papel, valor = llm_cache.cache.begin(chave)
+
+        partes = []
+        falhou = False
+        ocupado = None
+        completo = False
+        try:
+            if papel == "hit":
+                partes.append(valor)
+                yield _sse({"delta": valor})
+            elif papel == "follower":
+                # Pedido idêntico já está no Groq: espera o resultado dele
+                texto = valor.result(timeout=llm_cache.COALESCE_TIMEOUT)
+                partes.append(texto)
+                yield _sse({"delta": texto})
+            else:
+                with ratelimit.vaga_llm():
+                    stream = llm_client().chat.completions.create(stream=True, **params)
+                    for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            partes.append(delta)
+                            yield _sse({"delta": delta})
+            completo = True
+        except ratelimit.LimiteExcedido as exc:
+            ocupado = exc
+        except Exception:
+            current_app.logger.exception("Falha no stream do LLM")
+            falhou = True
+        finally:
+            # Mesmo se o cliente desconectar no meio, guarda o que já foi gerado
+            resposta = "".join(partes).strip()
+            if papel == "leader":
+                if completo:
+                    llm_cache.cache.finish(chave, resposta)
+                else:
+                    llm_cache.cache.fail(chave, RuntimeError("stream do LLM interrompido"))
+            msg_bot = _salvar_resposta(conversa_id, resposta) if resposta else None
+
+        if ocupado is not None:
+            yield _sse({"erro": ratelimit.MENSAGENS["llm_concorrencia"],
+                        "retry_after": ratelimit.retry_after(ocupado)}, event="error")
+            return
+        if falhou:
+            yield _sse({"erro": "Falha ao gerar a resposta. Tente novamente."}, event="error")
+            return
+
+        capivara_msg_id = msg_bot.id if msg_bot else None
+        yield _sse({"capivara_msg_id": capivara_msg_id, "resposta": resposta}, event="done")
+
+    return Response(
+        stream_with_context(gerar()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # nginx: não acumular o stream
+        },
+    )
+
+HISTORICO_LIMIT = 50
+HISTORICO_LIMIT_MAX = 200
+
+
+def _int_arg(nome, padrao=None):
+    try:
+        return int(request.args.get(nome))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def _serializar(m):
+    return {
+        "id": m.id,
+        "autor": m.autor,
+        "conteudo_texto": m.conteudo_texto,
+        "criado_em": m.criado_em.isoformat() if m.criado_em else None,
+        "anexos": [{
+            "tipo": a.tipo,
+            "url_arquivo": a.url_arquivo,
+            "mime_type": a.mime_type,
+            "nome_arquivo": a.nome_arquivo
+        } for a in (m.anexos or [])]
+    }
+
+
 @chat_bp.get("/api/chat/historico")
 def chat_historico():
-    conversa_id = request.args.get("conversa_id")
+    """
+    Query string:
+      - conversa_id (obrigatório)
+      - limit (padrão 50, máx. 200)
+      - before_id: mensagens anteriores a este id (rolar para cima)
+      - after_id / since: só mensagens com id maior (polling de novas)
+    Sem cursor, devolve as `limit` mensagens mais recentes (não mais a
+    conversa inteira): com has_more, o cliente pede as anteriores passando o
+    before_id da resposta.
+
+    ETag/Last-Modified vêm da última mensagem da conversa e dos parâmetros da
+    página: um poll sem novidades custa uma consulta no índice
+    (conversa_id, id) e responde 304.
+    """
+    conversa_id = _int_arg("conversa_id")
     if not conversa_id:
         return jsonify({"ok": False, "erro": "conversa_id é obrigatório."}), 400
 
-    conversa = ChatConversa.query.get(int(conversa_id))
-    if not conversa:
+    limit = min(max(_int_arg("limit", HISTORICO_LIMIT), 1), HISTORICO_LIMIT_MAX)
+    before_id = _int_arg("before_id")
+    after_id = _int_arg("after_id", _int_arg("since"))
+
+    ultimo_id, ultimo_em = (db.session.query(func.max(ChatMensagem.id), func.max(ChatMensagem.criado_em))
+                            .filter(ChatMensagem.conversa_id == conversa_id)
+                            .one())
+    # Conversa com mensagens existe (FK); só a vazia precisa ser conferida
+    if ultimo_id is None and db.session.get(ChatConversa, conversa_id) is None:
         return jsonify({"ok": False, "erro": "conversa_id inválido."}), 400
 
-    mensagens = (ChatMensagem.query
-                 .filter_by(conversa_id=conversa.id)
-                 .order_by(ChatMensagem.id.asc())
-                 .all())
-
-    payload = []
-    for m in mensagens:
-        payload.append({
-            "id": m.id,
-            "autor": m.autor,
-            "conteudo_texto": m.conteudo_texto,
-            "criado_em": m.criado_em.isoformat() if m.criado_em else None,
-            "anexos": [{
-                "tipo": a.tipo,
-                "url_arquivo": a.url_arquivo,
-                "mime_type": a.mime_type,
-                "nome_arquivo": a.nome_arquivo
-            } for a in (m.anexos or [])]
-        })
+    # Cada página (limit/before_id/after_id) tem o próprio corpo: entra na ETag
+    etag = (f"c{conversa_id}-m{ultimo_id or 0}-l{limit}"
+            f"-b{'' if before_id is None else before_id}-a{'' if after_id is None else after_id}")
+    if not is_resource_modified(request.environ, etag=etag, last_modified=ultimo_em):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
 
-    return jsonify({"ok": True, "mensagens": payload})
+    query = (ChatMensagem.query
+             .options(selectinload(ChatMensagem.anexos))
+             .filter(ChatMensagem.conversa_id == conversa_id))
+
+    if after_id is not None:
+        # Novas mensagens, em ordem crescente a partir do cursor
+        mensagens = (query.filter(ChatMensagem.id > after_id)
+                     .order_by(ChatMensagem.id.asc())
+                     .limit(limit + 1)
+                     .all())
+        has_more = len(mensagens) > limit
+        mensagens = mensagens[:limit]
+    else:
+        # Página mais recente (ou anterior a before_id), devolvida em ordem crescente
+        if before_id is not None:
+            query = query.filter(ChatMensagem.id < before_id)
+        mensagens = (query.order_by(ChatMensagem.id.desc())
+                     .limit(limit + 1)
+                     .all())
+        has_more = len(mensagens) > limit
+        mensagens = list(reversed(mensagens[:limit]))
+
+    resp = jsonify({
+        "ok": True,
+        "mensagens": [_serializar(m) for m in mensagens],
+        "has_more": has_more,
+        "before_id": mensagens[0].id if mensagens else before_id,
+        "after_id": mensagens[-1].id if mensagens else (after_id if after_id is not None else ultimo_id),
+        "ultimo_id": ultimo_id,
+    })
+    resp.set_etag(etag)
+    if ultimo_em:
+        resp.last_modified = ultimo_em
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
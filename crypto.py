@@ -0,0 +1,219 @@
+# crypto.py — criptografia de campos pessoais (CPF/RG) com rotação de chave
+#
+# Chaves Fernet em FERNET_KEYS, separadas por vírgula: a primeira cifra, todas
+# decifram (MultiFernet). Para trocar a chave:
+#   1. FERNET_KEYS=<nova>,<antiga>   (deploy)
+#   2. flask --app app crypto-rotate (recifra tudo com a nova, em lotes)
+#   3. FERNET_KEYS=<nova>            (deploy)
+# FERNET_KEY (uma chave só) continua aceita.
+#
+# O CPF cifrado não serve para busca (cada cifragem dá um token diferente);
+# para isso existe o índice cego user.cpf_hash = HMAC-SHA256(BLIND_INDEX_KEY,
+# só os dígitos do CPF). Com BLIND_INDEX_KEY definida, o índice não muda com a
+# rotação das chaves Fernet. Sem ela, a chave do índice é derivada de
+# FERNET_KEYS[0]: no passo 1 a busca por CPF passa a usar a chave nova e não
+# acha ninguém até o crypto-rotate (passo 2) terminar de recalcular os
+# cpf_hash — rode os dois em seguida, ou defina BLIND_INDEX_KEY.
+#
+# A cifra é montada no primeiro uso (não no import), depois do load_dotenv.
+
+import os
+import hmac
+import hashlib
+import logging
+import threading
+
+import click
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+log = logging.getLogger(__name__)
+
+# Todo token Fernet começa com o byte de versão 0x80 -> "gAAAAA" em base64
+TOKEN_PREFIX = "gAAAAA"
+
+_lock = threading.Lock()
+_cipher = None
+_blind_key = None
+
+
+def _chaves() -> list:
+    brutas = os.environ.get("FERNET_KEYS") or os.environ.get("FERNET_KEY") or ""
+    return [k.strip() for k in brutas.split(",") if k.strip()]
+
+
+def configurado() -> bool:
+    return bool(_chaves())
+
+
+def cipher() -> MultiFernet:
+    global _cipher
+    if _cipher is None:
+        with _lock:
+            if _cipher is None:
+                chaves = _chaves()
+                if not chaves:
+                    # Só para desenvolvimento: o que for cifrado agora não abre depois de reiniciar
+                    log.warning("FERNET_KEYS não definida: usando chave temporária (dados cifrados serão perdidos)")
+                    chaves = [Fernet.generate_key().decode()]
+                _cipher = MultiFernet([Fernet(k) for k in chaves])
+    return _cipher
+
+
+def blind_key() -> bytes:
+    global _blind_key
+    if _blind_key is None:
+        chave = os.environ.get("BLIND_INDEX_KEY")
+        if chave:
+            _blind_key = chave.encode("utf-8")
+        else:
+            # Derivada da chave Fernet principal: trocar a principal exige crypto-rotate
+            # (que recalcula os hashes). Defina BLIND_INDEX_KEY para desacoplar.
+            chaves = _chaves()
+            # Sem chave nenhuma (desenvolvimento): temporária, como a da cifra
+            base = chaves[0].encode("utf-8") if chaves else os.urandom(32)
+            _blind_key = hmac.new(base, b"participa-df/cpf-blind-index", hashlib.sha256).digest()
+    return _blind_key
+
+
+def reset() -> None:
+    """Descarta a cifra/chave em memória (testes, troca de ambiente)."""
+    global _cipher, _blind_key
+    with _lock:
+        _cipher = None
+        _blind_key = None
+
+
+def encrypt(value: str) -> str:
+    return cipher().encrypt(value.encode("utf-8")).decode("utf-8")
+
+
+def decrypt(value: str) -> str:
+    return cipher().decrypt(value.encode("utf-8")).decode("utf-8")
+
+
+def is_token(value) -> bool:
+    return isinstance(value, str) and value.startswith(TOKEN_PREFIX)
+
+
+def somente_digitos(value: str) -> str:
+    return "".join(c for c in (value or "") if c.isdigit())
+
+
+def blind_index(cpf: str):
+    """Hash de busca do CPF (só dígitos). None para vazio."""
+    digitos = somente_digitos(cpf)
+    if not digitos:
+        return None
+    return hmac.new(blind_key(), digitos.encode("ascii"), hashlib.sha256).hexdigest()
+
+
+class EncryptedField:
+    """Atributo de modelo que guarda o texto cifrado na coluna `coluna`.
+
+    Atribuir cifra na hora; ler decifra só quando o campo é acessado (e guarda o
+    resultado na instância), então listagens que não exibem o campo não pagam
+    nada. Com `hash_col`, atualiza também o índice cego.
+    """
+
+    def __init__(self, coluna: str, hash_col: str = None):
+        self.coluna = coluna
+        self.hash_col = hash_col
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self._cache = f"_{name}_claro"
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        token = getattr(obj, self.coluna)
+        cache = obj.__dict__.get(self._cache)
+        if cache is not None and cache[0] == token:
+            return cache[1]
+        if token is None:
+            valor = None
+        elif not is_token(token):
+            valor = token  # legado ainda não migrado (texto puro)
+        else:
+            try:
+                valor = decrypt(token)
+            except InvalidToken:
+                log.error("%s.%s: token não abre com as chaves atuais", type(obj).__name__, self.name)
+                valor = None
+        obj.__dict__[self._cache] = (token, valor)
+        return valor
+
+    def __set__(self, obj, valor):
+        valor = (valor or "").strip() or None
+        token = encrypt(valor) if valor is not None else None
+        setattr(obj, self.coluna, token)
+        obj.__dict__[self._cache] = (token, valor)
+        if self.hash_col:
+            setattr(obj, self.hash_col, blind_index(valor))
+
+
+# ----------------------------------------------------------
+# Rotação em lotes
+# ----------------------------------------------------------
+def recifrar_lote(conn, depois_de: int, batch_size: int = 1000):
+    """Recifra cpf/rg de até `batch_size` usuários com id > `depois_de`, com a
+    chave principal, e recalcula cpf_hash. Texto puro (legado) é cifrado no
+    caminho. Retorna (último id visto ou None no fim, linhas alteradas).
+    """
+    f = cipher()
+    rows = conn.execute(
+        text('SELECT id, cpf, rg FROM "user" WHERE id > :ultimo ORDER BY id LIMIT :n'),
+        {"ultimo": depois_de, "n": batch_size},
+    ).all()
+    if not rows:
+        return None, 0
+    mudancas = []
+    for uid, cpf, rg in rows:
+        if not (cpf or rg):
+            continue
+        novo = {"id": uid, "cpf": None, "rg": None, "cpf_hash": None}
+        for campo, valor in (("cpf", cpf), ("rg", rg)):
+            if not valor:
+                continue
+            claro = f.decrypt(valor.encode()).decode() if is_token(valor) else valor
+            novo[campo] = f.encrypt(claro.encode()).decode()
+            if campo == "cpf":
+                novo["cpf_hash"] = blind_index(claro)
+        mudancas.append(novo)
+    if mudancas:
+        # Um UPDATE em lote (executemany) por página
+        conn.execute(
+            text('UPDATE "user" SET cpf = :cpf, rg = :rg, cpf_hash = :cpf_hash WHERE id = :id'),
+            mudancas,
+        )
+    return rows[-1][0], len(mudancas)
+
+
+def rotate(engine, batch_size: int = 1000, echo=None) -> int:
+    """Percorre `user` por id (keyset), uma transação por lote: nunca carrega a
+    tabela inteira, e interromper no meio não perde nada (o MultiFernet lê
+    tokens das duas chaves)."""
+    ultimo, total = 0, 0
+    while True:
+        with engine.begin() as conn:
+            ultimo, n = recifrar_lote(conn, ultimo, batch_size)
+        if ultimo is None:
+            return total
+        total += n
+        if echo:
+            echo(f"até id={ultimo}: {total} linha(s) recifradas")
+
+
+@click.command("crypto-rotate")
+@click.option("--batch-size", default=1000, show_default=True)
+@with_appcontext
+def crypto_rotate_command(batch_size: int):
+    """Recifra CPF/RG com a primeira chave de FERNET_KEYS e recalcula cpf_hash."""
+    from models import db
+
+    if not configurado():
+        raise click.ClickException("defina FERNET_KEYS antes de rotacionar")
+    total = rotate(db.engine, batch_size, echo=click.echo)
+    click.echo(f"linhas recifradas={total}")
@@ -0,0 +1,130 @@
+# db_engine.py — perfil do engine do banco (SQLite em produção ou PostgreSQL)
+#
+# DATABASE_URL escolhe o banco; sem ela, usa o database.db local.
+#
+# SQLite: cada conexão nova recebe os PRAGMAs abaixo (evento "connect"):
+#   journal_mode=WAL     leitores não bloqueiam o escritor (e vice-versa)
+#   synchronous=NORMAL   fsync só no checkpoint do WAL (seguro com WAL)
+#   busy_timeout         espera o lock em vez de "database is locked"
+#   mmap_size            leituras via mmap, sem cópia para o cache de páginas
+#
+# Leituras pesadas (painel admin) podem usar read_session(): um engine
+# separado, somente leitura (query_only no SQLite; DATABASE_READ_URL aponta
+# para uma réplica no PostgreSQL), que segue lendo enquanto há escrita.
+
+import os
+from contextlib import contextmanager
+
+from flask import current_app
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "20000"))
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+def _normalizar(url: str) -> str:
+    # SQLAlchemy não aceita mais o esquema postgres:// (Heroku/Render)
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def database_url(default_sqlite_path: str) -> str:
+    """URL do banco: DATABASE_URL, ou o arquivo SQLite local."""
+    return _normalizar(os.environ.get("DATABASE_URL") or f"sqlite:///{default_sqlite_path}")
+
+
+def engine_options(url: str) -> dict:
+    """SQLALCHEMY_ENGINE_OPTIONS para o banco da URL."""
+    if make_url(url).get_backend_name() == "sqlite":
+        return {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            # Conexões circulam entre threads do servidor (o pool serializa o uso)
+            "connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        }
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def _sqlite_pragmas(dbapi_conn, somente_leitura: bool) -> None:
+    cur = dbapi_conn.cursor()
+    try:
+        if not somente_leitura:
+            cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cur.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+        if somente_leitura:
+            cur.execute("PRAGMA query_only=ON")
+    finally:
+        cur.close()
+
+
+def configurar(engine, somente_leitura: bool = False) -> None:
+    """Registra os PRAGMAs de conexão (no-op fora do SQLite)."""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, connection_record):
+        _sqlite_pragmas(dbapi_conn, somente_leitura)
+
+
+def _engine_leitura(write_engine):
+    """Réplica (DATABASE_READ_URL), um segundo pool query_only no SQLite, ou o
+    próprio engine de escrita (PostgreSQL sem réplica já lê em paralelo)."""
+    url = os.environ.get("DATABASE_READ_URL")
+    if url:
+        url = _normalizar(url)
+    elif write_engine.dialect.name == "sqlite":
+        url = write_engine.url.render_as_string(hide_password=False)
+    else:
+        return write_engine
+
+    engine = create_engine(url, **engine_options(url))
+    configurar(engine, somente_leitura=True)
+    return engine
+
+
+def init_app(app, db) -> None:
+    """Aplica o perfil ao engine do Flask-SQLAlchemy e prepara o engine de leitura."""
+    with app.app_context():
+        write_engine = db.engine
+    configurar(write_engine)
+
+    app.extensions["db_read_engine"] = _engine_leitura(write_engine)
+
+
+def dispose_after_fork(app, db) -> None:
+    """No worker recém-criado por fork: abandona as conexões herdadas do master.
+
+    close=False: o socket/arquivo ainda é do pai; o filho só esquece o pool e
+    abre conexões próprias no primeiro uso.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    app.extensions["db_read_engine"].dispose(close=False)
+
+
+@contextmanager
+def read_session():
+    """Sessão só de leitura (não use para gravar; o SQLite recusa com query_only)."""
+    session = Session(current_app.extensions["db_read_engine"], autoflush=False)
+    try:
+        yield session
+    finally:
+        session.close()
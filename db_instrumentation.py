@@ -0,0 +1,87 @@
+# db_instrumentation.py — contagem de consultas SQL por requisição/bloco
+#
+# Serve para pegar N+1: um teste (ou benchmark) envolve a chamada em
+# count_queries()/assert_max_queries() e confere quantas consultas saíram.
+#
+#   with assert_max_queries(4):
+#       client.get("/admin/protocolo/XYZ")
+#
+# Com QUERY_COUNT_HEADER=1 no ambiente, toda resposta ganha o cabeçalho
+# X-Query-Count (útil no navegador / em testes de carga).
+
+import os
+import threading
+from contextlib import contextmanager
+
+from flask import g
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+
+def _ativos() -> list:
+    pilha = getattr(_local, "contadores", None)
+    if pilha is None:
+        pilha = _local.contadores = []
+    return pilha
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _contar(conn, cursor, statement, parameters, context, executemany):
+    for contador in getattr(_local, "contadores", ()):
+        contador.count += 1
+        contador.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """Conta as consultas executadas nesta thread dentro do bloco."""
+    contador = QueryCounter()
+    pilha = _ativos()
+    pilha.append(contador)
+    try:
+        yield contador
+    finally:
+        pilha.remove(contador)
+
+
+@contextmanager
+def assert_max_queries(maximo: int):
+    """Falha (AssertionError) se o bloco executar mais de `maximo` consultas."""
+    with count_queries() as contador:
+        yield contador
+    if contador.count > maximo:
+        listagem = "\n".join(f"  {i + 1}. {s}" for i, s in enumerate(contador.statements))
+        raise AssertionError(f"{contador.count} consultas (máximo {maximo}):\n{listagem}")
+
+
+def init_app(app) -> None:
+    """Liga o cabeçalho X-Query-Count se QUERY_COUNT_HEADER estiver ativo."""
+    app.config.setdefault("QUERY_COUNT_HEADER", os.environ.get("QUERY_COUNT_HEADER") == "1")
+    if not app.config["QUERY_COUNT_HEADER"]:
+        return
+
+    @app.before_request
+    def _iniciar_contagem():
+        g._query_counter = QueryCounter()
+        _ativos().append(g._query_counter)
+
+    @app.after_request
+    def _cabecalho(response):
+        contador = g.get("_query_counter")
+        if contador is not None:
+            response.headers["X-Query-Count"] = str(contador.count)
+        return response
+
+    @app.teardown_request
+    def _encerrar_contagem(exc=None):
+        contador = g.pop("_query_counter", None)
+        if contador is not None and contador in _ativos():
+            _ativos().remove(contador)
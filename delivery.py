@@ -0,0 +1,175 @@
+# delivery.py — entrega de arquivos protegidos (download e player do painel)
+#
+# A rota decide quem pode ver e registra a auditoria; os bytes saem por aqui:
+#   - ETag = sha256 do conteúdo, respostas 304 e HTTP Range (206) para o
+#     player poder pular no vídeo sem baixar tudo de novo;
+#   - FILE_DELIVERY=direct      (padrão) o próprio Python envia (wsgi.file_wrapper
+#                                 -> sendfile no gunicorn quando não há Range)
+#   - FILE_DELIVERY=x-sendfile  Apache/lighttpd enviam o arquivo (X-Sendfile)
+#   - FILE_DELIVERY=x-accel     nginx envia (X-Accel-Redirect para um location
+#                                 interno, X_ACCEL_PREFIX -> static/uploads)
+#
+# Exemplo nginx para x-accel:
+#   location /_protected/ { internal; alias /caminho/do/app/static/uploads/; }
+#
+# Tipo do conteúdo: vem da extensão gravada no blob, nunca do mime declarado
+# no envio. Só imagem/áudio/vídeo da lista INLINE abrem no navegador; o resto
+# sai como anexo application/octet-stream, sempre com nosniff (um .jpg que na
+# verdade é HTML não vira script no domínio do painel).
+#
+# Originais no armazenamento frio (storage.py) em gzip saem descomprimidos
+# pelo Python, sem Range; o player usa a versão de reprodução (send_playback),
+# que fica em derived/ e tem Range normalmente.
+
+import os
+import gzip
+import mimetypes
+from urllib.parse import quote
+
+from flask import current_app, request, Response
+from werkzeug.http import is_resource_modified, parse_range_header
+from werkzeug.utils import send_file
+
+import storage
+
+MODOS = ("direct", "x-sendfile", "x-accel")
+
+
+def modo() -> str:
+    m = (current_app.config.get("FILE_DELIVERY") or "direct").lower()
+    return m if m in MODOS else "direct"
+
+
+def is_first_range() -> bool:
+    """Requisição sem Range ou começando do byte 0 (abertura, não um "pulo" do player)."""
+    rng = parse_range_header(request.headers.get("Range"))
+    if rng is None or not rng.ranges:
+        return True
+    return rng.ranges[0][0] == 0
+
+
+INLINE = {
+    "image/jpeg", "image/png", "image/webp", "image/gif",
+    "audio/mpeg", "audio/ogg", "audio/wav", "audio/x-wav", "audio/webm", "audio/mp4",
+    "video/mp4", "video/webm", "video/ogg", "video/quicktime",
+}
+BINARIO = "application/octet-stream"
+
+
+def _mimetype(abs_path: str) -> str:
+    return mimetypes.guess_type(abs_path)[0] or BINARIO
+
+
+def _seguro(mimetype: str, as_attachment: bool):
+    """(mimetype, as_attachment) que podem ir ao navegador: fora da lista, anexo binário."""
+    if mimetype in INLINE:
+        return mimetype, as_attachment
+    return BINARIO, True
+
+
+def _x_accel(abs_path: str, mimetype: str, etag: str, as_attachment: bool, download_name: str):
+    if etag and not is_resource_modified(request.environ, etag=etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    uploads = os.path.abspath(current_app.config["UPLOAD_FOLDER"])
+    rel = os.path.relpath(abs_path, uploads).replace(os.sep, "/")
+    prefix = current_app.config.get("X_ACCEL_PREFIX", "/_protected/").rstrip("/") + "/"
+
+    resp = Response(mimetype=mimetype)
+    # O nginx cuida de Range, Content-Length e do envio (sendfile)
+    resp.headers["X-Accel-Redirect"] = prefix + quote(rel)
+    resp.headers["Content-Disposition"] = _disposition(as_attachment, download_name)
+    if etag:
+        resp.set_etag(etag)
+    return resp
+
+
+def _disposition(as_attachment: bool, download_name: str) -> str:
+    kind = "attachment" if as_attachment else "inline"
+    if not download_name:
+        return kind
+    return f"{kind}; filename*=UTF-8''{quote(download_name)}"
+
+
+def _gzip(abs_path: str, tamanho, mimetype: str, etag: str, as_attachment: bool, download_name: str):
+    if not os.path.isfile(abs_path):
+        raise FileNotFoundError(abs_path)
+    if etag and not is_resource_modified(request.environ, etag=etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    def corpo():
+        with gzip.open(abs_path, "rb") as fp:
+            for bloco in iter(lambda: fp.read(storage.COPIA_BLOCO), b""):
+                yield bloco
+
+    resp = Response(corpo(), mimetype=mimetype, direct_passthrough=True)
+    if tamanho:
+        resp.content_length = tamanho
+    resp.headers["Content-Disposition"] = _disposition(as_attachment, download_name)
+    resp.headers["Accept-Ranges"] = "none"
+    if etag:
+        resp.set_etag(etag)
+    return resp
+
+
+def send_record(record, as_attachment: bool = False, download_name: str = None):
+    """Entrega o conteúdo original de um File/ChatAnexo (quente ou frio).
+
+    Levanta ValueError (sem caminho), PermissionError (fora das pastas de
+    arquivos) ou FileNotFoundError — a rota converte em 404/403.
+    """
+    abs_path = storage.resolve(storage.path_of(record))
+    etag = getattr(record, "sha256", None)
+    download_name = download_name or os.path.basename(abs_path)
+    if storage.comprimido(abs_path):
+        mimetype, as_attachment = _seguro(_mimetype(abs_path[:-3]), as_attachment)
+        tamanho = getattr(record, "size_bytes", None) or getattr(record, "tamanho_bytes", None)
+        resp = _gzip(abs_path, tamanho, mimetype, etag, as_attachment, download_name)
+    else:
+        mimetype, as_attachment = _seguro(_mimetype(abs_path), as_attachment)
+        resp = _enviar(abs_path, mimetype, etag, as_attachment, download_name)
+    return _privado(resp)
+
+
+def send_playback(record, download_name: str = None):
+    """Entrega a versão de reprodução (transcode.py) de um File, inline e com Range."""
+    abs_path = storage.resolve(record.playback_path)
+    etag = f"{record.sha256}-play" if record.sha256 else None
+    mimetype, as_attachment = _seguro(_mimetype(abs_path), False)
+    resp = _enviar(abs_path, mimetype, etag, as_attachment, download_name or os.path.basename(abs_path))
+    return _privado(resp)
+
+
+def _enviar(abs_path: str, mimetype: str, etag: str, as_attachment: bool, download_name: str):
+    m = modo()
+    # O location interno do nginx só cobre static/uploads (o frio pode estar em outro disco)
+    if m == "x-accel" and not storage.no_frio(abs_path):
+        if not os.path.isfile(abs_path):
+            raise FileNotFoundError(abs_path)
+        resp = _x_accel(abs_path, mimetype, etag, as_attachment, download_name)
+    else:
+        resp = send_file(
+            abs_path,
+            request.environ,
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=True,       # 304 + Range/206
+            etag=etag or True,
+            use_x_sendfile=(m == "x-sendfile"),
+            response_class=current_app.response_class,
+            max_age=0,
+        )
+    return resp
+
+
+def _privado(resp):
+    # Conteúdo imutável (sha256), mas protegido: só o navegador do admin guarda
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    resp.headers["X-Content-Type-Options"] = "nosniff"
+    return resp
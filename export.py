@@ -0,0 +1,254 @@
+# export.py — exportação em massa para auditoria (protocolos, manifestações, anexos)
+#
+# GET /admin/export?formato=csv|jsonl|parquet[&arquivos=1] + os filtros do painel.
+# Uma linha por anexo (manifestações sem anexo saem com as colunas do arquivo
+# vazias). Tudo é gerado sob demanda, direto na resposta:
+#
+#   - a consulta roda no engine de leitura com stream_results/yield_per
+#     (cursor do lado do servidor no PostgreSQL), em lotes de LOTE linhas;
+#   - cada lote é serializado e enviado antes do próximo ser lido;
+#   - com arquivos=1 sai um ZIP (manifesto + anexos) montado no próprio
+#     stream: o zipfile escreve num "sink" que é esvaziado a cada bloco, sem
+#     arquivo temporário; os anexos vão sem recompressão (já são mídia).
+#
+# A memória fica limitada ao tamanho de um lote / um bloco de arquivo,
+# qualquer que seja o volume exportado.
+#
+# Dados pessoais (nome, contato, CPF/RG) não entram no export.
+
+import io
+import os
+import csv
+import json
+import zipfile
+import datetime
+import importlib.util
+
+from sqlalchemy import select, func
+
+from models import User, Submission, File, Blob
+import db_engine
+import storage
+
+# pyarrow (opcional, só Parquet) é importado no primeiro export: pesa no start
+_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+FORMATOS = ("csv", "jsonl", "parquet")
+LOTE = 1000
+BLOCO = 1024 * 1024
+
+COLUNAS = (
+    "protocolo", "modo", "protocolo_criado_em",
+    "submission_id", "tipo", "status", "enviado_em", "texto",
+    "file_id", "arquivo_nome", "mime_type", "size_bytes", "sha256", "arquivo_enviado_em",
+    "arquivo_zip",
+)
+
+
+class FormatoIndisponivel(Exception):
+    """Formato pedido depende de biblioteca ausente (pyarrow)."""
+
+
+def disponivel(formato: str) -> bool:
+    return formato in FORMATOS and (formato != "parquet" or _PYARROW)
+
+
+def consulta(condicoes: list):
+    """SELECT de uma linha por anexo, ordenado por (submission, file).
+
+    `condicoes` vêm do painel (routes.admin.user_conditions + submission_conditions):
+    sobre User e Submission.
+    """
+    return (
+        select(
+            User.protocolo, User.is_public, User.created_at,
+            Submission.id, Submission.tipo, Submission.status, Submission.created_at, Submission.texto,
+            File.id, File.original_name, File.mime_type, File.size_bytes, File.sha256, File.uploaded_at,
+            # Caminho físico sem N+1: blob deduplicado ou caminho legado
+            func.coalesce(Blob.path, File.file_path),
+        )
+        .join(Submission, Submission.user_id == User.id)
+        .outerjoin(File, File.submission_id == Submission.id)
+        .outerjoin(Blob, Blob.sha256 == File.sha256)
+        .where(*condicoes)
+        .order_by(Submission.id, File.id)
+    )
+
+
+def _nome_no_zip(protocolo, file_id, nome) -> str:
+    base = os.path.basename((nome or "").replace("\\", "/")) or "arquivo"
+    return f"arquivos/{protocolo}/{file_id}-{base}"
+
+
+def _iso(v):
+    return v.isoformat() if isinstance(v, (datetime.date, datetime.datetime)) else v
+
+
+def lotes(condicoes: list):
+    """Gera listas de até LOTE registros (dict), mais o caminho físico do anexo."""
+    stmt = consulta(condicoes).execution_options(stream_results=True, yield_per=LOTE)
+    with db_engine.read_session() as rs:
+        for parte in rs.execute(stmt).partitions():
+            lote = []
+            for (protocolo, is_public, u_criado, sid, tipo, status, s_criado, texto,
+                 fid, nome, mime, tamanho, sha, f_criado, caminho) in parte:
+                lote.append(({
+                    "protocolo": protocolo,
+                    "modo": "identificado" if is_public else "anonimo",
+                    "protocolo_criado_em": _iso(u_criado),
+                    "submission_id": sid,
+                    "tipo": tipo,
+                    "status": status,
+                    "enviado_em": _iso(s_criado),
+                    "texto": texto,
+                    "file_id": fid,
+                    "arquivo_nome": nome,
+                    "mime_type": mime,
+                    "size_bytes": tamanho,
+                    "sha256": sha,
+                    "arquivo_enviado_em": _iso(f_criado),
+                    "arquivo_zip": _nome_no_zip(protocolo, fid, nome) if fid else None,
+                }, caminho))
+            yield lote
+
+
+# ----------------------------------------------------------
+# Serializadores: cada um recebe os lotes e gera bytes
+# ----------------------------------------------------------
+def _csv(condicoes, com_zip: bool):
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=COLUNAS if com_zip else COLUNAS[:-1], extrasaction="ignore")
+    w.writeheader()
+    for lote in lotes(condicoes):
+        w.writerows(r for r, _ in lote)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def _jsonl(condicoes, com_zip: bool):
+    for lote in lotes(condicoes):
+        linhas = []
+        for r, _ in lote:
+            if not com_zip:
+                r.pop("arquivo_zip")
+            linhas.append(json.dumps(r, ensure_ascii=False))
+        yield ("\n".join(linhas) + "\n").encode("utf-8")
+
+
+class _Sink:
+    """Arquivo só de escrita cujo conteúdo é recolhido (e esvaziado) pelo gerador."""
+
+    def __init__(self):
+        self._partes = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._partes.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._partes)
+        self._partes.clear()
+        return data
+
+
+def _schema(pa):
+    texto, inteiro = pa.string(), pa.int64()
+    tipos = {"submission_id": inteiro, "file_id": inteiro, "size_bytes": inteiro}
+    return pa.schema([(c, tipos.get(c, texto)) for c in COLUNAS])
+
+
+def _parquet(condicoes, com_zip: bool):
+    if not _PYARROW:
+        raise FormatoIndisponivel("parquet")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _schema(pa) if com_zip else _schema(pa).remove(len(COLUNAS) - 1)
+    sink = _Sink()
+    # Um row group por lote: o rodapé (metadados) só sai no close()
+    with pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd") as writer:
+        for lote in lotes(condicoes):
+            writer.write_table(pa.Table.from_pylist([r for r, _ in lote], schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+SERIALIZADORES = {"csv": _csv, "jsonl": _jsonl, "parquet": _parquet}
+
+
+def stream(formato: str, condicoes: list):
+    """Bytes do export no `formato` pedido."""
+    if not disponivel(formato):
+        raise FormatoIndisponivel(formato)
+    return SERIALIZADORES[formato](condicoes, False)
+
+
+def stream_zip(formato: str, condicoes: list):
+    """ZIP com manifesto.<formato> + arquivos/<protocolo>/<file_id>-<nome>.
+
+    Duas passagens pela consulta (manifesto, depois anexos): o zipfile não
+    intercala entradas, e guardar as linhas para depois custaria memória.
+    """
+    if not disponivel(formato):
+        raise FormatoIndisponivel(formato)
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        with zf.open(f"manifesto.{formato}", "w", force_zip64=True) as dest:
+            for parte in SERIALIZADORES[formato](condicoes, True):
+                dest.write(parte)
+                yield sink.drain()
+
+        ausentes = []
+        for lote in lotes(condicoes):
+            for r, caminho in lote:
+                if not r["file_id"]:
+                    continue
+                try:
+                    # Quente ou frio (gzip): sempre os bytes originais
+                    origem = storage.open_original(caminho)
+                except (ValueError, PermissionError, OSError):
+                    ausentes.append(r["arquivo_zip"])
+                    continue
+                info = zipfile.ZipInfo(r["arquivo_zip"], _zip_data(r["arquivo_enviado_em"]))
+                info.compress_type = zipfile.ZIP_STORED
+                with origem, zf.open(info, "w", force_zip64=True) as dest:
+                    while True:
+                        bloco = origem.read(BLOCO)
+                        if not bloco:
+                            break
+                        dest.write(bloco)
+                        yield sink.drain()
+        if ausentes:
+            zf.writestr("ARQUIVOS_AUSENTES.txt", "\n".join(ausentes) + "\n")
+    yield sink.drain()
+
+
+def _zip_data(iso):
+    try:
+        d = datetime.datetime.fromisoformat(iso)
+    except (TypeError, ValueError):
+        d = datetime.datetime.now()
+    return (max(d.year, 1980), d.month, d.day, d.hour, d.minute, d.second)
+
+
+def nome_arquivo(formato: str, com_zip: bool) -> str:
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    return f"export-{stamp}.{'zip' if com_zip else formato}"
+
+
+MIMETYPES = {
+    "csv": "text/csv",  # o Werkzeug acrescenta o charset
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "zip": "application/zip",
+}
@@ -0,0 +1,36 @@
+# gunicorn.conf.py — produção:  gunicorn -c gunicorn.conf.py
+#
+# preload_app: o master importa os módulos, monta o app (create_app), importa
+# o SDK do LLM e compila os templates UMA vez; cada worker nasce por fork já
+# com tudo isso na memória (copy-on-write) e atende a primeira requisição sem
+# esse custo. No fork, o worker descarta as conexões de banco herdadas; o
+# cliente do LLM e a thread da auditoria são criados por processo.
+#
+# Variáveis: GUNICORN_WORKERS (2), GUNICORN_WORKER_CLASS (gevent), GUNICORN_BIND.
+
+import os
+
+wsgi_app = "app:create_app()"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+# Chat em stream (SSE): cada conversa aberta é um greenlet, não um worker
+worker_connections = 500
+preload_app = True
+
+if worker_class == "gevent":
+    # Com preload, o app é importado no master: o monkey patch tem de vir antes
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def when_ready(server):
+    # Ainda no master, antes do primeiro fork
+    import app as modulo
+    modulo.warmup(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    import db_engine
+    from models import db
+    db_engine.dispose_after_fork(server.app.wsgi(), db)
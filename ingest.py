@@ -0,0 +1,176 @@
+# ingest.py — recebimento de arquivos em passada única (stream -> hash -> disco)
+#
+# O upload é lido direto do corpo da requisição, em blocos. Para cada arquivo:
+#   - o SHA-256 e o tamanho são calculados enquanto os bytes chegam;
+#   - o limite do tipo é verificado a cada bloco (aborta cedo, sem gravar o resto);
+#   - os bytes vão para um arquivo temporário no próprio diretório de destino,
+#     que depois é renomeado de forma atômica (os.replace).
+# Assim cada arquivo aceito custa uma única escrita em disco e nenhuma releitura.
+
+import os
+import hashlib
+import tempfile
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+
+CHUNK_SIZE = 1024 * 1024  # 1MB
+MAX_FIELD_BYTES = 1024 * 1024  # campos de texto do formulário
+
+
+class UploadTooLarge(Exception):
+    """Arquivo ultrapassou o limite permitido durante a leitura."""
+
+    def __init__(self, filename: str, limit: int):
+        super().__init__(filename)
+        self.filename = filename
+        self.limit = limit
+        self.form = MultiDict()  # campos lidos antes do aborto (ex.: protocolo)
+
+
+class IngestedFile:
+    """Arquivo já gravado em disco (temporário), com hash e tamanho conhecidos."""
+
+    def __init__(self, field: str, filename: str, mimetype: str, tmp_path: str, size: int, sha256: str):
+        self.field = field
+        self.filename = filename
+        self.mimetype = mimetype
+        self.tmp_path = tmp_path
+        self.size = size
+        self.sha256 = sha256
+
+    def commit(self, dest_path: str) -> str:
+        """Move o temporário para o destino final (rename atômico)."""
+        os.replace(self.tmp_path, dest_path)
+        self.tmp_path = None
+        return dest_path
+
+    def discard(self) -> None:
+        if self.tmp_path:
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+            self.tmp_path = None
+
+
+class _HashingSink:
+    """Grava num temporário enquanto calcula hash/tamanho e confere o limite."""
+
+    def __init__(self, dest_dir: str, filename: str, limit: int):
+        os.makedirs(dest_dir, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=dest_dir, prefix=".upload-", suffix=".part")
+        self.fp = os.fdopen(fd, "wb")
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.filename = filename
+        self.limit = limit
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.limit and self.size > self.limit:
+            raise UploadTooLarge(self.filename, self.limit)
+        self.hash.update(data)
+        self.fp.write(data)
+
+    def close(self) -> None:
+        # fsync antes do rename: o arquivo só "existe" quando os bytes estão duráveis
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.fp.close()
+
+    def abort(self) -> None:
+        try:
+            self.fp.close()
+        finally:
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+
+
+def ingest_stream(stream, dest_dir: str, filename: str, limit: int) -> IngestedFile:
+    """Consome um stream binário qualquer (ex.: FileStorage.stream) em passada única."""
+    sink = _HashingSink(dest_dir, filename, limit)
+    try:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            sink.write(chunk)
+        sink.close()
+    except BaseException:
+        sink.abort()
+        raise
+    return IngestedFile(None, filename, None, sink.tmp_path, sink.size, sink.hash.hexdigest())
+
+
+def parse_multipart(request, dest_dir: str, limit_for):
+    """Lê um multipart/form-data diretamente do corpo da requisição.
+
+    `limit_for(form)` recebe os campos já lidos (ex.: `tipo`, que no formulário
+    vem antes dos arquivos) e devolve o limite em bytes do próximo arquivo.
+
+    Retorna (form, files). Em caso de erro, os temporários já gravados são
+    removidos antes de propagar a exceção. Quem chama deve `commit()` ou
+    `discard()` cada IngestedFile.
+    """
+    _, options = parse_options_header(request.headers.get("Content-Type", ""))
+    boundary = options.get("boundary", "").encode("latin-1")
+    if not boundary:
+        return MultiDict(request.form), []
+
+    decoder = MultipartDecoder(boundary, max_form_memory_size=MAX_FIELD_BYTES)
+    fields = []
+    files = []
+    part = None
+    container = None
+    sink = None
+
+    try:
+        stream = request.stream
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            decoder.receive_data(data or None)
+
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, Field):
+                    part, container, sink = event, [], None
+                elif isinstance(event, File):
+                    part, container = event, None
+                    # input file vazio (nenhum arquivo escolhido) não gera temporário
+                    sink = (_HashingSink(dest_dir, event.filename, limit_for(MultiDict(fields)))
+                            if event.filename else None)
+                elif isinstance(event, Data):
+                    if container is not None:
+                        container.append(event.data)
+                    elif sink is not None:
+                        sink.write(event.data)
+
+                    if not event.more_data:
+                        if isinstance(part, Field):
+                            fields.append((part.name, b"".join(container).decode("utf-8", "replace")))
+                        elif sink is not None:
+                            sink.close()
+                            files.append(IngestedFile(
+                                part.name,
+                                part.filename,
+                                part.headers.get("Content-Type", "application/octet-stream"),
+                                sink.tmp_path,
+                                sink.size,
+                                sink.hash.hexdigest(),
+                            ))
+                            sink = None
+                event = decoder.next_event()
+
+            if not data or isinstance(event, Epilogue):
+                break
+    except BaseException as exc:
+        if sink is not None:
+            sink.abort()
+        for f in files:
+            f.discard()
+        if isinstance(exc, UploadTooLarge):
+            exc.form = MultiDict(fields)
+        raise
+
+    return MultiDict(fields), files
@@ -0,0 +1,320 @@
+# jobs.py — fila de tarefas persistente (tabela job) + worker com pool de processos
+#
+# O upload só grava os bytes (fsync) e enfileira; miniaturas, prévias, duração,
+# quadros pôster e versões de reprodução (transcode.py) saem da requisição e
+# rodam aqui:
+#
+#   flask --app app jobs-worker --processes 4
+#
+# O processo principal do worker reivindica tarefas no banco (UPDATE condicional:
+# vários workers/máquinas podem rodar juntos), manda o trabalho pesado para um
+# ProcessPoolExecutor (media.py, sem acesso ao banco) e grava o resultado.
+# Falhas voltam para a fila com espera crescente até max_attempts — inclusive
+# as que derrubam o worker (a tarefa fica travada e conta como tentativa).
+
+import os
+import json
+import time
+import socket
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select, update
+
+from models import db, Job, File
+import storage
+import media
+import transcode
+
+# Tarefa "executando" há mais que isso é de um worker que morreu: volta à fila
+LOCK_TIMEOUT = int(os.getenv("JOBS_LOCK_TIMEOUT", "900"))
+RETRY_BASE_SECONDS = 30
+
+
+def enqueue(kind: str, payload: dict, max_attempts: int = 3) -> Job:
+    """Enfileira na transação de quem chama (não faz commit)."""
+    job = Job(kind=kind, payload=json.dumps(payload), max_attempts=max_attempts)
+    db.session.add(job)
+    return job
+
+
+def enqueue_media(file: File) -> None:
+    """Pós-processamento de um File recém-criado (precisa de file.id: faça flush antes)."""
+    file.processing_status = "pendente"
+    enqueue("media", {"file_id": file.id})
+    if (file.mime_type or "").lower().startswith(("audio/", "video/")):
+        enqueue_transcode(file)
+
+
+def enqueue_transcode(file: File) -> None:
+    """Versão de reprodução (H.264/Opus) de um áudio/vídeo; o original fica intacto."""
+    enqueue("transcode", {"file_id": file.id}, max_attempts=2)
+
+
+# ----------------------------------------------------------
+# Handlers: montar(payload) -> (fn, args) | None ; aplicar(payload, resultado)
+# `fn` roda em outro processo; montar/aplicar rodam no worker, com o banco.
+# ----------------------------------------------------------
+def _montar_media(payload):
+    f = db.session.get(File, payload["file_id"])
+    if f is None or not f.sha256:
+        return None
+    if storage.is_cold(storage.path_of(f)):
+        # Reenvio de um conteúdo que já foi para o frio: foi processado antes
+        _copiar_derivados(f)
+        return None
+    f.processing_status = "processando"
+    db.session.commit()
+    src = storage.resolve(storage.path_of(f))
+    return media.processar, (src, storage.derived_dir(f.sha256), f.sha256, f.mime_type or "")
+
+
+DERIVADOS = ("thumb_path", "preview_path", "poster_path", "duration_seconds", "media_info",
+             "playback_path", "playback_mime", "playback_size_bytes")
+
+
+def _copiar_derivados(f: File) -> None:
+    """Derivados são por conteúdo: copia os de outro File com o mesmo sha256."""
+    irmao = db.session.execute(
+        select(File).where(File.sha256 == f.sha256, File.id != f.id, File.processing_status == "pronto").limit(1)
+    ).scalar()
+    if irmao is not None:
+        for campo in DERIVADOS:
+            setattr(f, campo, getattr(irmao, campo))
+    f.processing_status = "pronto" if irmao is not None else "erro"
+    db.session.commit()
+
+
+def _aplicar_media(payload, resultado):
+    f = db.session.get(File, payload["file_id"])
+    if f is None:
+        return
+    rel = lambda p: storage.relative(p) if p else None
+    f.thumb_path = rel(resultado["thumb"])
+    f.preview_path = rel(resultado["preview"])
+    f.poster_path = rel(resultado["poster"])
+    f.duration_seconds = resultado["duration"]
+    info = dict(resultado["info"])
+    if resultado["avisos"]:
+        info["avisos"] = resultado["avisos"]
+    f.media_info = json.dumps(info, ensure_ascii=False)
+    f.processing_status = "pronto"
+
+
+def _falhar_media(payload, erro):
+    f = db.session.get(File, payload["file_id"])
+    if f is not None:
+        f.processing_status = "erro"
+
+
+def _montar_transcode(payload):
+    f = db.session.get(File, payload["file_id"])
+    if f is None or not f.sha256:
+        return None
+    if storage.is_cold(storage.path_of(f)):
+        return None  # original já no armazenamento frio: não vale descomprimir para isso
+    src = storage.resolve(storage.path_of(f))
+    return transcode.transcodificar, (src, storage.derived_dir(f.sha256), f.sha256, f.mime_type or "")
+
+
+def _aplicar_transcode(payload, resultado):
+    f = db.session.get(File, payload["file_id"])
+    if f is None or not resultado["path"]:
+        return
+    f.playback_path = storage.relative(resultado["path"])
+    f.playback_mime = resultado["mime"]
+    f.playback_size_bytes = resultado["size"]
+
+
+def _falhar_transcode(payload, erro):
+    # Sem versão de reprodução o painel entrega o original: nada a marcar
+    pass
+
+
+HANDLERS = {
+    "media": (_montar_media, _aplicar_media, _falhar_media),
+    "transcode": (_montar_transcode, _aplicar_transcode, _falhar_transcode),
+}
+
+
+# ----------------------------------------------------------
+# Worker
+# ----------------------------------------------------------
+def _agora():
+    return datetime.datetime.utcnow()
+
+
+def _reivindicar(worker_id: str):
+    """Pega a próxima tarefa pendente (ou None). Seguro entre vários workers."""
+    agora = _agora()
+    job_id = db.session.execute(
+        select(Job.id)
+        .where(Job.status == "pendente", Job.run_after <= agora)
+        .order_by(Job.id)
+        .limit(1)
+    ).scalar()
+    if job_id is None:
+        return None
+    res = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == "pendente")
+        .values(status="executando", locked_at=agora, locked_by=worker_id, attempts=Job.attempts + 1)
+    )
+    db.session.commit()
+    if res.rowcount != 1:
+        return None  # outro worker levou
+    return db.session.get(Job, job_id)
+
+
+def _renovar(job_ids, worker_id: str) -> None:
+    """Heartbeat: tarefas ainda rodando no pool não contam como travadas."""
+    if not job_ids:
+        return
+    db.session.execute(
+        update(Job)
+        .where(Job.id.in_(job_ids), Job.status == "executando", Job.locked_by == worker_id)
+        .values(locked_at=_agora())
+    )
+    db.session.commit()
+
+
+def _liberar_travadas() -> int:
+    """Devolve à fila as tarefas de workers que morreram. As que já gastaram
+    max_attempts (ex.: arquivo que derruba o processo toda vez) viram erro."""
+    limite = _agora() - datetime.timedelta(seconds=LOCK_TIMEOUT)
+    travadas = (Job.status == "executando", Job.locked_at < limite)
+    esgotadas = db.session.execute(
+        select(Job).where(*travadas, Job.attempts >= Job.max_attempts)
+    ).scalars().all()
+    for job in esgotadas:
+        _falhar(job, RuntimeError("o worker morreu durante a execução"))
+
+    res = db.session.execute(
+        update(Job)
+        .where(*travadas, Job.attempts < Job.max_attempts)
+        .values(status="pendente", locked_at=None, locked_by=None)
+    )
+    db.session.commit()
+    return res.rowcount
+
+
+def _concluir(job: Job, resultado) -> None:
+    if resultado is not None:
+        HANDLERS[job.kind][1](json.loads(job.payload), resultado)
+    job.status = "feito"
+    job.finished_at = _agora()
+    job.last_error = None
+    db.session.commit()
+
+
+def _falhar(job: Job, erro: BaseException) -> None:
+    db.session.rollback()
+    job = db.session.get(Job, job.id)
+    job.last_error = f"{type(erro).__name__}: {erro}"[:2000]
+    job.locked_at = None
+    job.locked_by = None
+    if job.attempts < job.max_attempts:
+        job.status = "pendente"
+        job.run_after = _agora() + datetime.timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+    else:
+        job.status = "erro"
+        job.finished_at = _agora()
+        handler = HANDLERS.get(job.kind)
+        if handler:
+            handler[2](json.loads(job.payload), erro)
+    db.session.commit()
+
+
+def run_worker(processes: int = 2, poll_interval: float = 1.0, once: bool = False, echo=None) -> dict:
+    """Loop do worker. `once=True` processa o que houver na fila e retorna."""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stats = {"feitos": 0, "falhas": 0}
+    # spawn: os filhos importam só media.py, sem herdar conexões do banco
+    pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+    em_andamento = {}
+    ultima_limpeza = 0.0
+
+    try:
+        while True:
+            if time.monotonic() - ultima_limpeza > 60:
+                # Transcodificação pode passar do LOCK_TIMEOUT: renova as próprias antes
+                _renovar(list(em_andamento.values()), worker_id)
+                _liberar_travadas()
+                ultima_limpeza = time.monotonic()
+
+            while len(em_andamento) < processes:
+                job = _reivindicar(worker_id)
+                if job is None:
+                    break
+                handler = HANDLERS.get(job.kind)
+                try:
+                    if handler is None:
+                        raise LookupError(f"tipo de tarefa desconhecido: {job.kind}")
+                    tarefa = handler[0](json.loads(job.payload))
+                except Exception as exc:
+                    _falhar(job, exc)
+                    stats["falhas"] += 1
+                    continue
+                if tarefa is None:  # nada a fazer (ex.: arquivo apagado)
+                    _concluir(job, None)
+                    continue
+                fn, args = tarefa
+                em_andamento[pool.submit(fn, *args)] = job.id
+
+            if not em_andamento:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            prontos, _ = wait(list(em_andamento), timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for fut in prontos:
+                job = db.session.get(Job, em_andamento.pop(fut))
+                try:
+                    _concluir(job, fut.result())
+                    stats["feitos"] += 1
+                    if echo:
+                        echo(f"job {job.id} ({job.kind}) feito")
+                except Exception as exc:
+                    _falhar(job, exc)
+                    stats["falhas"] += 1
+                    if echo:
+                        echo(f"job {job.id} ({job.kind}) falhou: {exc}")
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return stats
+
+
+@click.command("media-transcode")
+@click.option("--limit", default=0, help="No máximo N arquivos (0 = todos).")
+@with_appcontext
+def media_transcode_command(limit: int):
+    """Enfileira versões de reprodução para áudios/vídeos antigos que ainda não têm."""
+    q = (
+        select(File)
+        .where(File.playback_path.is_(None), File.sha256.isnot(None),
+               File.mime_type.like("audio/%") | File.mime_type.like("video/%"))
+        .order_by(File.id)
+    )
+    if limit:
+        q = q.limit(limit)
+    n = 0
+    for f in db.session.execute(q).scalars():
+        enqueue_transcode(f)
+        n += 1
+    db.session.commit()
+    click.echo(f"enfileirados={n} (rode o jobs-worker)")
+
+
+@click.command("jobs-worker")
+@click.option("--processes", default=max(1, (os.cpu_count() or 2) - 1), show_default=True)
+@click.option("--poll-interval", default=1.0, show_default=True)
+@click.option("--once", is_flag=True, help="Esvazia a fila e sai (cron / testes).")
+@with_appcontext
+def jobs_worker_command(processes: int, poll_interval: float, once: bool):
+    """Processa a fila de tarefas (miniaturas, prévias, metadados, transcodificação)."""
+    stats = run_worker(processes, poll_interval, once, echo=click.echo)
+    click.echo(f"feitos={stats['feitos']} falhas={stats['falhas']}")
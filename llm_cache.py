@@ -0,0 +1,253 @@
+# llm_cache.py — cache de respostas da Capivara + coalescência de chamadas iguais
+#
+# Muitas conversas começam com a mesma pergunta ("como registro um protocolo?",
+# "quais arquivos posso enviar?"). A chave do cache é o SHA-256 do prompt
+# normalizado: modelo/parâmetros + mensagens de sistema + últimas N mensagens.
+# Só entram no cache prompts cujo histórico inteiro cabe nessas N mensagens —
+# assim a resposta nunca depende de contexto que ficou fora da chave.
+#
+# Backends:
+#   LLM_CACHE_BACKEND=memory  (padrão) LRU com TTL, por processo
+#   LLM_CACHE_BACKEND=sqlite  arquivo compartilhado entre workers (LLM_CACHE_PATH)
+#   LLM_CACHE_BACKEND=off     desliga
+#
+# Pedidos idênticos simultâneos viram uma só chamada ao Groq: o primeiro
+# ("líder") chama; os demais esperam o resultado dele.
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory").lower()
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAX = int(os.getenv("LLM_CACHE_MAX", "1000"))
+LLM_CACHE_TURNS = int(os.getenv("LLM_CACHE_TURNS", "4"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(BASE_DIR, "llm_cache.db"))
+
+# Quanto um pedido "seguidor" espera pelo líder antes de desistir
+COALESCE_TIMEOUT = 120
+
+
+def _normalizar(texto: str) -> str:
+    texto = " ".join((texto or "").lower().split())
+    return texto.rstrip(" ?!.")
+
+
+def chave(params: dict, max_turns: int = None):
+    """Chave do cache para os parâmetros da chamada, ou None se não cacheável."""
+    max_turns = LLM_CACHE_TURNS if max_turns is None else max_turns
+    messages = params.get("messages") or []
+
+    sistema = [m["content"] for m in messages if m["role"] == "system"]
+    turnos = [(m["role"], _normalizar(m["content"])) for m in messages if m["role"] != "system"]
+    if not turnos or len(turnos) > max_turns:
+        return None
+
+    material = json.dumps({
+        "model": params.get("model"),
+        "temperature": params.get("temperature"),
+        "max_tokens": params.get("max_tokens"),
+        "system": sistema,
+        "turns": turnos,
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """LRU com TTL em memória (por processo)."""
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteBackend:
+    """Arquivo SQLite compartilhado entre workers; despejo por último acesso."""
+
+    EVICT_EVERY = 50  # confere o tamanho a cada N gravações
+
+    def __init__(self, path: str, maxsize: int, ttl: int):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+
+    def _conn(self):
+        # Aberta no primeiro uso de cada processo/thread: nada de arquivo nem DDL
+        # no import (o master do gunicorn com preload não toca no banco)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed ON llm_cache (accessed_at)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, value) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, "
+            "expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+            (key, value, now + self.ttl, now),
+        )
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self._evict(conn, now)
+
+    def _evict(self, conn, now) -> None:
+        conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            " SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,),
+        )
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+class LLMCache:
+    """Cache + coalescência. `backend` None = desligado (só coalescência)."""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypass = 0
+
+    def begin(self, key):
+        """Decide o papel do pedido:
+        ("hit", resposta) | ("follower", Future) | ("leader", None) | ("bypass", None)
+        """
+        if key is None:
+            with self._lock:
+                self.bypass += 1
+            return "bypass", None
+
+        if self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                return "hit", value
+
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self.coalesced += 1
+                return "follower", fut
+            self._inflight[key] = Future()
+            self.misses += 1
+            return "leader", None
+
+    def finish(self, key, value: str) -> None:
+        if self.backend is not None and value:
+            self.backend.set(key, value)
+        with self._lock:
+            fut = self._inflight.pop(key, None)
+        if fut is not None:
+            fut.set_result(value)
+
+    def fail(self, key, exc: BaseException) -> None:
+        with self._lock:
+            fut = self._inflight.pop(key, None)
+        if fut is not None:
+            fut.set_exception(exc)
+
+    def get_or_compute(self, key, compute):
+        """Resposta do cache, de um pedido idêntico em andamento, ou de compute()."""
+        papel, valor = self.begin(key)
+        if papel == "hit":
+            return valor
+        if papel == "follower":
+            return valor.result(timeout=COALESCE_TIMEOUT)
+        if papel == "bypass":
+            return compute()
+
+        try:
+            value = compute()
+        except BaseException as exc:
+            self.fail(key, exc)
+            raise
+        self.finish(key, value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            consultas = self.hits + self.misses + self.coalesced
+            return {
+                "backend": type(self.backend).__name__ if self.backend is not None else "off",
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "bypass": self.bypass,
+                "inflight": len(self._inflight),
+                "entries": len(self.backend) if self.backend is not None else 0,
+                "hit_rate": round((self.hits + self.coalesced) / consultas, 4) if consultas else 0.0,
+            }
+
+
+def from_env() -> LLMCache:
+    if LLM_CACHE_BACKEND == "off":
+        return LLMCache(None)
+    if LLM_CACHE_BACKEND == "sqlite":
+        return LLMCache(SQLiteBackend(LLM_CACHE_PATH, LLM_CACHE_MAX, LLM_CACHE_TTL))
+    return LLMCache(MemoryBackend(LLM_CACHE_MAX, LLM_CACHE_TTL))
+
+
+cache = from_env()
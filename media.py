@@ -0,0 +1,149 @@
+# media.py — pós-processamento de mídia (roda nos processos do worker, jobs.py)
+#
+# Funções puras sobre caminhos de arquivo: não tocam no banco nem no Flask,
+# para poderem rodar num ProcessPoolExecutor.
+#
+#   imagem -> miniatura e prévia em WebP (orientação EXIF aplicada)
+#   áudio  -> duração e metadados (ffprobe)
+#   vídeo  -> duração/metadados (ffprobe) + quadro pôster (ffmpeg) + miniatura/prévia
+#
+# Dependências opcionais: Pillow (imagens) e ffmpeg/ffprobe no PATH (áudio/vídeo).
+# Sem elas, o job termina com o que for possível e registra o aviso.
+
+import os
+import json
+import shutil
+import tempfile
+import threading
+import subprocess
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow não instalado: sem miniaturas de imagem
+    Image = None
+
+THUMB_PX = 320
+PREVIEW_PX = 1280
+WEBP_QUALITY = 80
+
+FFPROBE = shutil.which("ffprobe")
+FFMPEG = shutil.which("ffmpeg")
+FF_TIMEOUT = 120
+
+
+def _webp(img, dest: str, lado: int) -> None:
+    copia = img.copy()
+    copia.thumbnail((lado, lado))
+    tmp = f"{dest}.{os.getpid()}-{threading.get_ident()}.tmp"  # geração concorrente do mesmo arquivo
+    copia.save(tmp, "WEBP", quality=WEBP_QUALITY, method=4)
+    os.replace(tmp, dest)
+
+
+def _derivados_imagem(src: str, out_dir: str, sha256: str, info: dict) -> dict:
+    thumb = os.path.join(out_dir, f"{sha256}-thumb.webp")
+    preview = os.path.join(out_dir, f"{sha256}-preview.webp")
+    # Mesmo conteúdo já processado (reenvio): reaproveita
+    if not (os.path.exists(thumb) and os.path.exists(preview)):
+        with Image.open(src) as img:
+            img = ImageOps.exif_transpose(img)
+            info.setdefault("width", img.width)
+            info.setdefault("height", img.height)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+            _webp(img, thumb, THUMB_PX)
+            _webp(img, preview, PREVIEW_PX)
+    return {"thumb": thumb, "preview": preview}
+
+
+def redimensionar(src: str, dest: str, lado: int) -> None:
+    """Versão WebP de `src` com o maior lado <= `lado` (gravação atômica)."""
+    with Image.open(src) as img:
+        # JPEG: decodifica já reduzido (1/2, 1/4, 1/8) — bem mais barato que abrir inteiro
+        img.draft("RGB", (lado, lado))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        _webp(img, dest, lado)
+
+
+def probe(src: str) -> dict:
+    """Metadados via ffprobe: duração, formato, codecs e dimensões."""
+    out = subprocess.run(
+        [FFPROBE, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", src],
+        capture_output=True, timeout=FF_TIMEOUT, check=True,
+    ).stdout
+    data = json.loads(out or b"{}")
+    fmt = data.get("format") or {}
+    info = {
+        "format": fmt.get("format_name"),
+        "bit_rate": int(fmt["bit_rate"]) if fmt.get("bit_rate") else None,
+        "duration": float(fmt["duration"]) if fmt.get("duration") else None,
+    }
+    for stream in data.get("streams") or []:
+        kind = stream.get("codec_type")
+        if kind == "video" and "video_codec" not in info:
+            info["video_codec"] = stream.get("codec_name")
+            info["width"] = stream.get("width")
+            info["height"] = stream.get("height")
+        elif kind == "audio" and "audio_codec" not in info:
+            info["audio_codec"] = stream.get("codec_name")
+            info["sample_rate"] = int(stream["sample_rate"]) if stream.get("sample_rate") else None
+            info["channels"] = stream.get("channels")
+    return info
+
+
+def poster(src: str, out_dir: str, sha256: str, duration=None) -> str:
+    """Extrai um quadro do vídeo (JPEG) em out_dir/<sha256>-poster.jpg."""
+    dest = os.path.join(out_dir, f"{sha256}-poster.jpg")
+    if os.path.exists(dest):
+        return dest
+    os.makedirs(out_dir, exist_ok=True)
+    # 1s para dentro (evita quadro preto inicial), ou o meio de vídeos curtos
+    ss = 1.0 if not duration or duration > 2 else duration / 2
+    # Temporário exclusivo: a prévia do painel e o worker podem gerar o mesmo pôster juntos
+    fd, tmp = tempfile.mkstemp(dir=out_dir, prefix=f"{sha256}-poster.", suffix=".tmp.jpg")
+    os.close(fd)
+    try:
+        subprocess.run(
+            [FFMPEG, "-v", "error", "-y", "-ss", f"{ss:.2f}", "-i", src,
+             "-frames:v", "1", "-vf", f"scale='min({PREVIEW_PX},iw)':-2", "-q:v", "4", tmp],
+            capture_output=True, timeout=FF_TIMEOUT, check=True,
+        )
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return dest
+
+
+def processar(src: str, out_dir: str, sha256: str, mime: str) -> dict:
+    """Gera os derivados de um arquivo. Retorna caminhos absolutos e metadados:
+
+    {"thumb", "preview", "poster", "duration", "info", "avisos"}
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    mime = (mime or "").lower()
+    result = {"thumb": None, "preview": None, "poster": None, "duration": None, "info": {}, "avisos": []}
+    info = result["info"]
+
+    if mime.startswith(("audio/", "video/")):
+        if FFPROBE:
+            info.update(probe(src))
+            result["duration"] = info.get("duration")
+        else:
+            result["avisos"].append("ffprobe indisponível: sem duração/metadados")
+
+    if mime.startswith("video/"):
+        if FFMPEG:
+            result["poster"] = poster(src, out_dir, sha256, result["duration"])
+        else:
+            result["avisos"].append("ffmpeg indisponível: sem quadro pôster")
+
+    quadro = src if mime.startswith("image/") else result["poster"]
+    if quadro:
+        if Image is not None:
+            result.update(_derivados_imagem(quadro, out_dir, sha256, info))
+        else:
+            result["avisos"].append("Pillow indisponível: sem miniatura/prévia")
+
+    return result
@@ -0,0 +1,406 @@
+# migrations.py — migrações versionadas do schema (tabela schema_version)
+#
+# Antes, todo processo (cada worker do gunicorn) rodava _ensure_sqlite_columns
+# e db.create_all() no import, e os workers disputavam os ALTER TABLE. Agora:
+#
+#   flask --app app db-upgrade     -> aplica as migrações pendentes (uma vez, no deploy)
+#   flask --app app db-version     -> mostra a versão atual / a esperada
+#
+# No start, o app só confere a versão (uma consulta) e avisa se estiver atrasada.
+#
+# Cada migração roda na sua própria transação, junto com o registro em
+# schema_version, e é idempotente (confere o inspector antes de alterar), então
+# pode ser aplicada sobre bancos criados pelo esquema antigo.
+#
+# Migrações não leem os modelos (models.py) nem chamam código do app que lê:
+# tabelas, tipos, índices e o SQL de carga ficam congelados aqui, como eram
+# quando a migração foi publicada. Um banco antigo sobe passo a passo pelo
+# schema de cada versão, e não pelo de hoje.
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import (
+    MetaData, Table, Column, Index, ForeignKey, Integer, BigInteger, String, Text, Boolean,
+    Date, DateTime, Float, func, inspect, select, text
+)
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from models import db
+import crypto
+import search
+
+_meta = MetaData()
+schema_version = Table(
+    "schema_version", _meta,
+    Column("version", Integer, primary_key=True),
+    Column("descricao", String(200), nullable=False),
+    Column("aplicado_em", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+# ----------------------------------------------------------
+# Helpers (idempotentes)
+# ----------------------------------------------------------
+def _add_column(conn, table: str, column: str, tipo) -> None:
+    """ADD COLUMN `tipo` (tipo SQLAlchemy fixado na migração), se a coluna ainda não existir."""
+    insp = inspect(conn)
+    if not insp.has_table(table):
+        return
+    if column in {c["name"] for c in insp.get_columns(table)}:
+        return
+    q = conn.dialect.identifier_preparer
+    ddl = tipo.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {q.quote(table)} ADD COLUMN {q.quote(column)} {ddl}"))
+
+
+def _create_index(conn, table: str, name: str, *columns: str, unique: bool = False) -> None:
+    """CREATE INDEX IF NOT EXISTS (SQLite e Postgres)."""
+    q = conn.dialect.identifier_preparer
+    cols = ", ".join(q.quote(c) for c in columns)
+    conn.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {q.quote(name)} ON {q.quote(table)} ({cols})"
+    ))
+
+
+# ----------------------------------------------------------
+# Schema congelado das migrações que criam tabelas
+# ----------------------------------------------------------
+# 001: as tabelas como o create_all() do import criava (antes das migrações)
+_v001 = MetaData()
+Table(
+    "user", _v001,
+    Column("id", Integer, primary_key=True),
+    Column("protocolo", String(36), unique=True),
+    Column("is_public", Boolean, nullable=False),
+    Column("nome", String(150)),
+    Column("cpf", String(14)),
+    Column("rg", String(20)),
+    Column("telefone", String(20)),
+    Column("email", String(150)),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+Table(
+    "submission", _v001,
+    Column("id", Integer, primary_key=True),
+    Column("tipo", String(20), nullable=False),
+    Column("texto", Text),
+    Column("status", String(30), nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("user_id", Integer, ForeignKey("user.id"), nullable=False),
+    Index("ix_submission_user_created", "user_id", "created_at"),
+    Index("ix_submission_tipo_status", "tipo", "status"),
+)
+Table(
+    "file", _v001,
+    Column("id", Integer, primary_key=True),
+    Column("file_type", String(20)),
+    Column("file_path", String(255)),
+    Column("original_name", String(255)),
+    Column("mime_type", String(120)),
+    Column("size_bytes", Integer),
+    Column("sha256", String(64)),
+    Column("uploaded_at", DateTime(timezone=True), server_default=func.now()),
+    Column("submission_id", Integer, ForeignKey("submission.id"), nullable=False),
+    Index("ix_file_submission_id", "submission_id"),
+    Index("ix_file_sha256", "sha256"),
+)
+Table(
+    "chat_conversas", _v001,
+    Column("id", Integer, primary_key=True),
+    Column("usuario_id", Integer, ForeignKey("user.id"), nullable=True),
+    Column("titulo", String(120)),
+    Column("criado_em", DateTime(timezone=True), server_default=func.now()),
+)
+Table(
+    "chat_mensagens", _v001,
+    Column("id", Integer, primary_key=True),
+    Column("conversa_id", Integer, ForeignKey("chat_conversas.id"), nullable=False),
+    Column("autor", String(20), nullable=False),
+    Column("conteudo_texto", Text),
+    Column("criado_em", DateTime(timezone=True), server_default=func.now()),
+    Index("ix_chat_mensagens_conversa_id", "conversa_id", "id"),
+)
+Table(
+    "chat_anexos", _v001,
+    Column("id", Integer, primary_key=True),
+    Column("mensagem_id", Integer, ForeignKey("chat_mensagens.id"), nullable=False),
+    Column("tipo", String(10), nullable=False),
+    Column("nome_arquivo", String(255)),
+    Column("mime_type", String(120)),
+    Column("tamanho_bytes", Integer),
+    Column("url_arquivo", Text),
+    Column("sha256", String(64)),
+    Column("criado_em", DateTime(timezone=True), server_default=func.now()),
+    Index("ix_chat_anexos_mensagem_id", "mensagem_id"),
+    Index("ix_chat_anexos_sha256", "sha256"),
+)
+Table(
+    "upload_session", _v001,
+    Column("id", String(32), primary_key=True),
+    Column("user_id", Integer, ForeignKey("user.id"), nullable=False),
+    Column("tipo", String(20), nullable=False),
+    Column("original_name", String(255)),
+    Column("mime_type", String(120)),
+    Column("total_bytes", Integer, nullable=False),
+    Column("offset_bytes", Integer, nullable=False),
+    Column("sha256", String(64)),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+    Index("ix_upload_session_updated_at", "updated_at"),
+)
+Table(
+    "blob", _v001,
+    Column("sha256", String(64), primary_key=True),
+    Column("path", String(255), nullable=False),
+    Column("size_bytes", Integer),
+    Column("ref_count", Integer, nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+# 004: fila de tarefas
+_v004 = MetaData()
+_v004_job = Table(
+    "job", _v004,
+    Column("id", Integer, primary_key=True),
+    Column("kind", String(40), nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("status", String(20), nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("max_attempts", Integer, nullable=False),
+    Column("last_error", Text),
+    Column("run_after", DateTime, nullable=False),
+    Column("locked_at", DateTime),
+    Column("locked_by", String(80)),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("finished_at", DateTime),
+    Index("ix_job_status_run_after", "status", "run_after"),
+)
+
+# 007: totais do painel
+_v007 = MetaData()
+_v007_dia = Table(
+    "stat_submissao_dia", _v007,
+    Column("dia", Date, primary_key=True),
+    Column("tipo", String(20), primary_key=True),
+    Column("status", String(30), primary_key=True),
+    Column("modo", String(12), primary_key=True),
+    Column("total", Integer, nullable=False),
+)
+_v007_midia = Table(
+    "stat_midia", _v007,
+    Column("grupo", String(20), primary_key=True),
+    Column("arquivos", Integer, nullable=False),
+    Column("bytes", BigInteger, nullable=False),
+)
+
+
+def _recalcular_estatisticas(conn, com_originais: bool) -> None:
+    """Carga das tabelas stat_* por GROUP BY (o stats.rebuild da época, em SQL fixo)."""
+    conn.execute(text("DELETE FROM stat_submissao_dia"))
+    conn.execute(text("DELETE FROM stat_midia"))
+    conn.execute(text(
+        "INSERT INTO stat_submissao_dia (dia, tipo, status, modo, total) "
+        "SELECT date(s.created_at), coalesce(s.tipo, ''), coalesce(s.status, ''), "
+        "       CASE WHEN u.is_public THEN 'identificado' ELSE 'anonimo' END, count(*) "
+        'FROM submission s JOIN "user" u ON u.id = s.user_id '
+        "GROUP BY 1, 2, 3, 4"
+    ))
+    # Grupo = parte antes da "/" do mime (image, video, audio), senão "outro"
+    grupo = " ".join(
+        f"WHEN lower(mime_type) = '{g}' OR lower(mime_type) LIKE '{g}/%' THEN '{g}'"
+        for g in ("image", "video", "audio")
+    )
+    colunas, somas = "grupo, arquivos, bytes", "count(*), coalesce(sum(size_bytes), 0)"
+    if com_originais:
+        colunas += ", bytes_originais"
+        somas += ", coalesce(sum(coalesce(original_size_bytes, size_bytes, 0)), 0)"
+    conn.execute(text(
+        f"INSERT INTO stat_midia ({colunas}) "
+        f"SELECT g, {somas} FROM (SELECT *, CASE {grupo} ELSE 'outro' END AS g FROM file) f "
+        "GROUP BY g"
+    ))
+
+
+# ----------------------------------------------------------
+# Migrações (nunca edite uma já publicada; acrescente uma nova)
+# ----------------------------------------------------------
+def _m001_tabelas(conn):
+    # Tabelas ausentes, como o create_all() fazia no import
+    _v001.create_all(conn, checkfirst=True)
+
+
+def _m002_colunas_legadas(conn):
+    # O que _ensure_sqlite_columns adicionava em bancos antigos
+    for table, column, tipo in [
+        ("user", "created_at", DateTime(timezone=True)),
+        ("submission", "status", String(30)),
+        ("submission", "created_at", DateTime(timezone=True)),
+        ("file", "original_name", String(255)),
+        ("file", "mime_type", String(120)),
+        ("file", "size_bytes", Integer()),
+        ("file", "sha256", String(64)),
+        ("file", "uploaded_at", DateTime(timezone=True)),
+        ("chat_anexos", "sha256", String(64)),
+    ]:
+        _add_column(conn, table, column, tipo)
+    conn.execute(text("UPDATE submission SET status = 'recebido' WHERE status IS NULL"))
+
+
+def _m003_indices(conn):
+    # Índices dos caminhos de consulta: painel, histórico do chat, storage, purge
+    for table, name, columns in [
+        ("submission", "ix_submission_user_created", ("user_id", "created_at")),
+        ("submission", "ix_submission_tipo_status", ("tipo", "status")),
+        ("file", "ix_file_submission_id", ("submission_id",)),
+        ("file", "ix_file_sha256", ("sha256",)),
+        ("chat_mensagens", "ix_chat_mensagens_conversa_id", ("conversa_id", "id")),
+        ("chat_anexos", "ix_chat_anexos_mensagem_id", ("mensagem_id",)),
+        ("chat_anexos", "ix_chat_anexos_sha256", ("sha256",)),
+        ("upload_session", "ix_upload_session_updated_at", ("updated_at",)),
+    ]:
+        _create_index(conn, table, name, *columns)
+
+
+def _m004_fila_midia(conn):
+    # Fila de tarefas + colunas do pós-processamento de mídia em File
+    _v004_job.create(conn, checkfirst=True)
+    _create_index(conn, "job", "ix_job_status_run_after", "status", "run_after")
+    for column, tipo in [
+        ("processing_status", String(20)),
+        ("thumb_path", String(255)),
+        ("preview_path", String(255)),
+        ("poster_path", String(255)),
+        ("duration_seconds", Float()),
+        ("media_info", Text()),
+    ]:
+        _add_column(conn, "file", column, tipo)
+
+
+def _m005_busca_textual(conn):
+    # FTS5 + triggers sobre submission.texto e chat_mensagens.conteudo_texto (só SQLite)
+    search.create_index(conn)
+
+
+def _m006_cpf_cifrado(conn):
+    # Índice cego do CPF + cifragem do CPF/RG que estavam em texto puro
+    _add_column(conn, "user", "cpf_hash", String(64))
+    _create_index(conn, "user", "ix_user_cpf_hash", "cpf_hash")
+    if conn.dialect.name == "postgresql":
+        # Tokens Fernet não cabem em VARCHAR(14)/(20)
+        conn.execute(text('ALTER TABLE "user" ALTER COLUMN cpf TYPE TEXT, ALTER COLUMN rg TYPE TEXT'))
+    legado = conn.execute(text('SELECT COUNT(*) FROM "user" WHERE cpf IS NOT NULL OR rg IS NOT NULL')).scalar()
+    if legado and not crypto.configurado():
+        # Cifrar com chave temporária perderia os dados
+        raise RuntimeError(f"{legado} usuário(s) com CPF/RG em texto puro: defina FERNET_KEYS e rode de novo")
+    ultimo = 0
+    while ultimo is not None:
+        ultimo, _ = crypto.recifrar_lote(conn, ultimo)
+
+
+def _m007_estatisticas(conn):
+    # Tabelas de totais do painel, já preenchidas com o histórico
+    _v007_dia.create(conn, checkfirst=True)
+    _v007_midia.create(conn, checkfirst=True)
+    _recalcular_estatisticas(conn, com_originais=False)
+
+
+def _m008_idempotencia(conn):
+    # Chave de idempotência dos envios (reenvio da fila offline do PWA)
+    _add_column(conn, "submission", "idempotency_key", String(64))
+    _create_index(conn, "submission", "ux_submission_user_idempotency", "user_id", "idempotency_key",
+                  unique=True)
+
+
+def _m009_tamanho_original(conn):
+    # Tamanho antes da compressão no navegador (arquivo, sessão retomável e totais)
+    _add_column(conn, "file", "original_size_bytes", Integer())
+    _add_column(conn, "upload_session", "original_size_bytes", Integer())
+    _add_column(conn, "stat_midia", "bytes_originais", BigInteger())
+    _recalcular_estatisticas(conn, com_originais=True)
+
+
+def _m010_renditions_e_frio(conn):
+    # Versões de reprodução (transcode.py) e armazenamento frio dos originais
+    for column, tipo in [
+        ("playback_path", String(255)),
+        ("playback_mime", String(120)),
+        ("playback_size_bytes", Integer()),
+    ]:
+        _add_column(conn, "file", column, tipo)
+    _add_column(conn, "blob", "tier", String(10))
+    _add_column(conn, "blob", "stored_size_bytes", Integer())
+    conn.execute(text("UPDATE blob SET tier = 'hot' WHERE tier IS NULL"))
+    _create_index(conn, "blob", "ix_blob_tier_created", "tier", "created_at")
+
+
+MIGRATIONS = [
+    (1, "tabelas iniciais", _m001_tabelas),
+    (2, "colunas adicionadas sem migração (created_at, status, metadados de arquivo, sha256)", _m002_colunas_legadas),
+    (3, "índices do painel, chat, storage e uploads", _m003_indices),
+    (4, "fila de tarefas (job) e colunas de mídia em file", _m004_fila_midia),
+    (5, "busca textual (FTS5) em manifestações e chat", _m005_busca_textual),
+    (6, "CPF/RG cifrados e índice cego user.cpf_hash", _m006_cpf_cifrado),
+    (7, "estatísticas pré-agregadas (stat_submissao_dia, stat_midia)", _m007_estatisticas),
+    (8, "chave de idempotência em submission", _m008_idempotencia),
+    (9, "tamanho original dos anexos (compressão no navegador)", _m009_tamanho_original),
+    (10, "versões de reprodução (file.playback_*) e armazenamento frio (blob.tier)", _m010_renditions_e_frio),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+# ----------------------------------------------------------
+# Runner
+# ----------------------------------------------------------
+def current_version(engine) -> int:
+    """Versão aplicada (0 se o banco ainda não tem schema_version)."""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        return 0
+
+
+def upgrade(engine, echo=None) -> list:
+    """Aplica as migrações pendentes, em ordem. Retorna as versões aplicadas."""
+    _meta.create_all(engine, checkfirst=True)
+    aplicadas = []
+    for version, descricao, fn in MIGRATIONS:
+        with engine.begin() as conn:
+            # Relido dentro da transação: outro processo pode ter aplicado antes
+            atual = conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+            if version <= atual:
+                continue
+            fn(conn)
+            conn.execute(schema_version.insert().values(version=version, descricao=descricao))
+        aplicadas.append(version)
+        if echo:
+            echo(f"aplicada {version:03d}: {descricao}")
+    return aplicadas
+
+
+def check(app) -> int:
+    """Conferência do start: uma consulta; avisa se o schema estiver atrasado."""
+    with app.app_context():
+        versao = current_version(db.engine)
+    if versao < LATEST:
+        app.logger.warning(
+            "Schema do banco na versão %s (esperada %s). Rode: flask --app app db-upgrade",
+            versao, LATEST,
+        )
+    return versao
+
+
+@click.command("db-upgrade")
+@with_appcontext
+def db_upgrade_command():
+    """Aplica as migrações pendentes do banco."""
+    aplicadas = upgrade(db.engine, echo=click.echo)
+    click.echo(f"schema na versão {current_version(db.engine)} ({len(aplicadas)} migração(ões) aplicada(s))")
+
+
+@click.command("db-version")
+@with_appcontext
+def db_version_command():
+    """Mostra a versão do schema aplicada e a esperada pelo código."""
+    click.echo(f"atual={current_version(db.engine)} esperada={LATEST}")
@@ -1,29 +1,16 @@
 from __future__ import annotations
 
-import os
 import uuid
 from datetime import datetime
 
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.sql import func
-from cryptography.fernet import Fernet
 
 # ==========================================================
-# CRIPTOGRAFIA (FERNET)
-# Em produção, DEFINA FERNET_KEY no ambiente (.env / VPS).
-# Se não definir, uma chave temporária será gerada (pode impedir descriptografar depois).
+# CRIPTOGRAFIA (FERNET) — chaves em FERNET_KEYS, rotação e índice cego em crypto.py
 # ==========================================================
-_key = os.environ.get("FERNET_KEY")
-if _key is None:
-    _key = Fernet.generate_key()
-
-cipher = Fernet(_key)
-
-def encrypt(value: str) -> str:
-    return cipher.encrypt(value.encode("utf-8")).decode("utf-8")
-
-def decrypt(value: str) -> str:
-    return cipher.decrypt(value.encode("utf-8")).decode("utf-8")
+import crypto
+from crypto import encrypt, decrypt  # compatibilidade: antes viviam aqui
 
 # ==========================================================
 # SQLALCHEMY
@@ -43,8 +30,14 @@ class User(db.Model):
     is_public = db.Column(db.Boolean, nullable=False)
 
     nome = db.Column(db.String(150))
-    cpf = db.Column(db.String(14))
-    rg = db.Column(db.String(20))
+    # CPF/RG cifrados (Fernet, ver crypto.py). Colunas adiadas: a listagem do
+    # painel nem lê os tokens; o texto só é decifrado ao acessar user.cpf/.rg
+    cpf_cifrado = db.deferred(db.Column("cpf", db.Text))
+    rg_cifrado = db.deferred(db.Column("rg", db.Text))
+    # Índice cego para localizar por CPF sem decifrar (User.por_cpf)
+    cpf_hash = db.Column(db.String(64), index=True)
+    cpf = crypto.EncryptedField("cpf_cifrado", hash_col="cpf_hash")
+    rg = crypto.EncryptedField("rg_cifrado")
     telefone = db.Column(db.String(20))
     email = db.Column(db.String(150))
 
@@ -65,9 +58,21 @@ class User(db.Model):
         cascade="all, delete-orphan"
     )
 
+    @classmethod
+    def por_cpf(cls, cpf: str):
+        """Consulta pelos usuários com este CPF (pontuação ignorada), via cpf_hash."""
+        return cls.query.filter(cls.cpf_hash == crypto.blind_index(cpf))
+
 
 class Submission(db.Model):
     __tablename__ = "submission"
+    __table_args__ = (
+        # painel admin: protocolos por período / por tipo e status
+        db.Index("ix_submission_user_created", "user_id", "created_at"),
+        db.Index("ix_submission_tipo_status", "tipo", "status"),
+        # reenvio da fila offline (sw.js) não duplica a manifestação
+        db.Index("ux_submission_user_idempotency", "user_id", "idempotency_key", unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     tipo = db.Column(db.String(20), nullable=False)  # texto, imagem, audio, video
@@ -78,6 +83,9 @@ class Submission(db.Model):
 
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
 
+    # Idempotency-Key do envio (uuid gerado no navegador); NULL em envios antigos
+    idempotency_key = db.Column(db.String(64))
+
     files = db.relationship(
         "File",
         backref="submission",
@@ -88,6 +96,11 @@ class Submission(db.Model):
 
 class File(db.Model):
     __tablename__ = "file"
+    __table_args__ = (
+        db.Index("ix_file_submission_id", "submission_id"),
+        # storage: contagem de referências por hash
+        db.Index("ix_file_sha256", "sha256"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -97,11 +110,35 @@ class File(db.Model):
     original_name = db.Column(db.String(255))
     mime_type = db.Column(db.String(120))
     size_bytes = db.Column(db.Integer)
+    # tamanho antes da compressão no navegador (NULL: enviado como estava)
+    original_size_bytes = db.Column(db.Integer)
     sha256 = db.Column(db.String(64))
     uploaded_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
 
     submission_id = db.Column(db.Integer, db.ForeignKey("submission.id"), nullable=False)
 
+    # Pós-processamento em segundo plano (jobs.py): pendente, processando, pronto, erro
+    processing_status = db.Column(db.String(20))
+    thumb_path = db.Column(db.String(255))     # miniatura WebP (imagem ou quadro do vídeo)
+    preview_path = db.Column(db.String(255))   # prévia WebP reduzida (imagem ou quadro do vídeo)
+    poster_path = db.Column(db.String(255))    # quadro do vídeo em JPEG (atributo poster)
+    duration_seconds = db.Column(db.Float)     # áudio / vídeo
+    media_info = db.Column(db.Text)            # JSON: dimensões, codecs, bitrate...
+
+    # Versão para reprodução no painel (transcode.py): H.264 (vídeo) / Opus (áudio).
+    # O original continua intacto no blob (sha256); NULL = original já é eficiente
+    playback_path = db.Column(db.String(255))
+    playback_mime = db.Column(db.String(120))
+    playback_size_bytes = db.Column(db.Integer)
+
+    # Conteúdo físico (deduplicado) no repositório de blobs — ver storage.py
+    blob = db.relationship(
+        "Blob",
+        primaryjoin="foreign(File.sha256) == Blob.sha256",
+        viewonly=True,
+        lazy=True,
+    )
+
 # ==========================================================
 # NOVOS MODELOS (CHAT CAPIVARA)
 # Mesmo banco SQLite + SQLAlchemy
@@ -128,6 +165,10 @@ class ChatConversa(db.Model):
 
 class ChatMensagem(db.Model):
     __tablename__ = "chat_mensagens"
+    __table_args__ = (
+        # contexto do LLM / histórico: WHERE conversa_id = ? ORDER BY id
+        db.Index("ix_chat_mensagens_conversa_id", "conversa_id", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     conversa_id = db.Column(db.Integer, db.ForeignKey("chat_conversas.id"), nullable=False)
@@ -148,6 +189,10 @@ class ChatMensagem(db.Model):
 
 class ChatAnexo(db.Model):
     __tablename__ = "chat_anexos"
+    __table_args__ = (
+        db.Index("ix_chat_anexos_mensagem_id", "mensagem_id"),
+        db.Index("ix_chat_anexos_sha256", "sha256"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     mensagem_id = db.Column(db.Integer, db.ForeignKey("chat_mensagens.id"), nullable=False)
@@ -161,5 +206,115 @@ class ChatAnexo(db.Model):
 
     # Recomendado: salvar caminho/URL pública do arquivo, não o binário no banco
     url_arquivo = db.Column(db.Text)
+    sha256 = db.Column(db.String(64))
 
     criado_em = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+    blob = db.relationship(
+        "Blob",
+        primaryjoin="foreign(ChatAnexo.sha256) == Blob.sha256",
+        viewonly=True,
+        lazy=True,
+    )
+
+
+# ==========================================================
+# UPLOAD RETOMÁVEL (estilo tus) — ver routes/resumable.py
+# Bytes parciais ficam em static/uploads/partial/<id>.part até o finalize.
+# ==========================================================
+class UploadSession(db.Model):
+    __tablename__ = "upload_session"
+    __table_args__ = (
+        # uploads-purge: sessões abandonadas
+        db.Index("ix_upload_session_updated_at", "updated_at"),
+    )
+
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+
+    tipo = db.Column(db.String(20), nullable=False)
+    original_name = db.Column(db.String(255))
+    mime_type = db.Column(db.String(120))
+
+    total_bytes = db.Column(db.Integer, nullable=False)   # Upload-Length declarado
+    offset_bytes = db.Column(db.Integer, nullable=False, default=0)
+    original_size_bytes = db.Column(db.Integer)  # antes da compressão no navegador
+    sha256 = db.Column(db.String(64))  # opcional: hash esperado informado pelo cliente
+
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+# ==========================================================
+# ARMAZENAMENTO ENDEREÇADO POR CONTEÚDO
+# Um blob por SHA-256; File/ChatAnexo referenciam pelo hash.
+# ==========================================================
+class Blob(db.Model):
+    __tablename__ = "blob"
+    __table_args__ = (
+        # storage-tier: blobs quentes mais antigos que o corte
+        db.Index("ix_blob_tier_created", "tier", "created_at"),
+    )
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(255), nullable=False)  # ex: static/uploads/blobs/ab/cd/<sha>.jpg
+    size_bytes = db.Column(db.Integer)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+    # hot: blobs/ ; cold: COLD_STORAGE_FOLDER, em gzip (path termina em .gz) se compensar
+    tier = db.Column(db.String(10), nullable=False, default="hot", server_default="hot")
+    stored_size_bytes = db.Column(db.Integer)  # bytes em disco no frio
+
+
+# ==========================================================
+# FILA DE TAREFAS (jobs.py)
+# Persistida no próprio banco; o worker (flask jobs-worker) reivindica
+# tarefas com um UPDATE condicional, então vários workers podem rodar juntos.
+# ==========================================================
+class Job(db.Model):
+    __tablename__ = "job"
+    __table_args__ = (
+        db.Index("ix_job_status_run_after", "status", "run_after"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)      # ex: 'media'
+    payload = db.Column(db.Text, nullable=False, default="{}")  # JSON
+
+    # pendente -> executando -> feito | erro
+    status = db.Column(db.String(20), nullable=False, default="pendente")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    last_error = db.Column(db.Text)
+
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(80))
+
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    finished_at = db.Column(db.DateTime)
+
+
+# ==========================================================
+# ESTATÍSTICAS (stats.py)
+# Totais pré-agregados, atualizados a cada gravação de Submission/File
+# (eventos do mapper) e recalculáveis com `flask stats-rebuild`.
+# ==========================================================
+class StatSubmissaoDia(db.Model):
+    __tablename__ = "stat_submissao_dia"
+
+    dia = db.Column(db.Date, primary_key=True)
+    tipo = db.Column(db.String(20), primary_key=True)
+    status = db.Column(db.String(30), primary_key=True)
+    modo = db.Column(db.String(12), primary_key=True)  # identificado | anonimo
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+
+class StatMidia(db.Model):
+    __tablename__ = "stat_midia"
+
+    grupo = db.Column(db.String(20), primary_key=True)  # image, video, audio, outro
+    arquivos = db.Column(db.Integer, nullable=False, default=0)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    bytes_originais = db.Column(db.BigInteger, nullable=False, default=0)  # antes da compressão no navegador
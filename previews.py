@@ -0,0 +1,156 @@
+# previews.py — cache em disco de prévias redimensionadas (painel admin)
+#
+# /admin/preview/<file_id>?w=320 devolve uma versão WebP do anexo:
+#   imagem -> o próprio original reduzido
+#   vídeo  -> o quadro pôster (do worker, ou extraído na hora com ffmpeg)
+#   (original no armazenamento frio -> a partir da prévia/pôster já gerados)
+#
+# Os arquivos ficam em PREVIEW_CACHE_FOLDER/<aa>/<sha256>-w<largura>.webp.
+# A chave é o conteúdo (sha256) + parâmetros, então reenvios compartilham a
+# prévia. O cache é um LRU limitado em bytes (PREVIEW_CACHE_MAX_BYTES): cada
+# acerto atualiza o mtime; ao passar do limite, os menos usados saem.
+
+import os
+import threading
+
+from flask import current_app
+
+import media
+import storage
+
+# Larguras servidas (outras são arredondadas para cima): limita as variações no cache
+LARGURAS = (160, 320, 640, 1280)
+LARGURA_PADRAO = 320
+
+# Conteúdo de uma URL nunca muda (sha256 fixo): o navegador pode guardar por 1 ano
+MAX_AGE = 365 * 24 * 3600
+
+# Ao despejar, desce até esta fração do limite (evita despejar a cada gravação)
+_ALVO_DESPEJO = 0.9
+
+
+class SemPrevia(Exception):
+    """O anexo não tem prévia possível (tipo sem imagem, dependência ausente...)."""
+
+
+def largura(valor) -> int:
+    try:
+        w = int(valor)
+    except (TypeError, ValueError):
+        return LARGURA_PADRAO
+    for opcao in LARGURAS:
+        if w <= opcao:
+            return opcao
+    return LARGURAS[-1]
+
+
+class DiskLRU:
+    """Diretório com limite de bytes; o mtime marca o último uso."""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None  # estimativa por processo; recalculada no despejo
+
+    def path(self, nome: str) -> str:
+        return os.path.join(self.root, nome[:2], nome)
+
+    def get(self, nome: str):
+        path = self.path(nome)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def added(self, path: str) -> None:
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan()[1]
+            else:
+                self._total += os.path.getsize(path)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        arquivos, total = [], 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                p = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                arquivos.append((st.st_mtime, st.st_size, p))
+                total += st.st_size
+        return arquivos, total
+
+    def _evict(self) -> None:
+        arquivos, total = self._scan()
+        arquivos.sort()
+        alvo = self.max_bytes * _ALVO_DESPEJO
+        for _, size, p in arquivos:
+            if total <= alvo:
+                break
+            if p.endswith(".tmp"):
+                continue  # sendo gerado agora
+            try:
+                os.remove(p)
+                total -= size
+            except OSError:
+                pass
+        self._total = total
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def cache() -> DiskLRU:
+    root = current_app.config["PREVIEW_CACHE_FOLDER"]
+    with _caches_lock:
+        c = _caches.get(root)
+        if c is None:
+            c = _caches[root] = DiskLRU(root, current_app.config["PREVIEW_CACHE_MAX_BYTES"])
+        return c
+
+
+def _fonte(f) -> str:
+    """Imagem a partir da qual a prévia é gerada."""
+    mime = (f.mime_type or "").lower()
+    frio = storage.is_cold(storage.path_of(f))
+    if mime.startswith("image/"):
+        if not frio:
+            return storage.resolve(storage.path_of(f))
+        # Original no armazenamento frio: parte da prévia grande (derived/)
+        if f.preview_path:
+            return storage.resolve(f.preview_path)
+        raise SemPrevia("original no armazenamento frio")
+    if mime.startswith("video/"):
+        if f.poster_path:
+            return storage.resolve(f.poster_path)
+        if media.FFMPEG and not frio:
+            return media.poster(storage.resolve(storage.path_of(f)), storage.derived_dir(f.sha256), f.sha256)
+    raise SemPrevia(f.mime_type)
+
+
+def obter(f, w: int) -> str:
+    """Caminho da prévia WebP de largura `w` para o File `f` (gera se preciso)."""
+    if not f.sha256:
+        raise SemPrevia("arquivo sem sha256")
+    c = cache()
+    nome = f"{f.sha256}-w{w}.webp"
+
+    path = c.get(nome)
+    if path:
+        return path
+
+    if media.Image is None:
+        raise SemPrevia("Pillow indisponível")
+    src = _fonte(f)
+    path = c.path(nome)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    media.redimensionar(src, path, w)
+    c.added(path)
+    return path
@@ -0,0 +1,255 @@
+# ratelimit.py — limites por cliente (token bucket) e teto de chamadas simultâneas ao LLM
+#
+# Cada cliente tem um balde por orçamento, chaveado pelo IP e, quando se sabe,
+# pelo protocolo (ou pela conversa do chat):
+#
+#   requisicoes  envios em /upload, /create_user, /api/chat/*, upload retomável
+#   usuarios     protocolos novos (/create_user)
+#   bytes        bytes enviados (Content-Length no /upload; tamanho declarado no retomável)
+#   llm          mensagens para a Capivara
+#
+# O balde enche `capacidade` fichas ao longo de `periodo` segundos (rajada =
+# capacidade). Os baldes ficam num SQLite local (RATELIMIT_PATH), então valem
+# para todos os workers do gunicorn da máquina. Faltou ficha: LimiteExcedido
+# -> 429 com Retry-After (ver init_app).
+#
+# Teto global de chamadas ao LLM em andamento: LLM_MAX_CONCORRENTES "vagas",
+# cada uma um arquivo travado com flock (liberado pelo SO se o worker morrer).
+#
+#   RATELIMIT_BACKEND=sqlite (padrão) | off
+#   Atrás de proxy (nginx): RATELIMIT_PROXIES=1 — o IP vem do X-Forwarded-For
+
+import os
+import time
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from flask import current_app, request, jsonify, render_template
+
+try:
+    import fcntl
+except ImportError:  # Windows: vagas só por processo
+    fcntl = None
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+RATELIMIT_BACKEND = os.getenv("RATELIMIT_BACKEND", "sqlite").lower()
+RATELIMIT_PATH = os.getenv("RATELIMIT_PATH", os.path.join(BASE_DIR, "ratelimit.db"))
+RATELIMIT_PROXIES = int(os.getenv("RATELIMIT_PROXIES", "0"))
+
+MB = 1024 * 1024
+
+Orcamento = namedtuple("Orcamento", "capacidade periodo")
+
+ORCAMENTOS = {
+    "requisicoes": Orcamento(int(os.getenv("RATELIMIT_REQUISICOES", "60")), 60),
+    "usuarios": Orcamento(int(os.getenv("RATELIMIT_USUARIOS", "10")), 3600),
+    "bytes": Orcamento(int(os.getenv("RATELIMIT_MB", "1024")) * MB, 3600),
+    "llm": Orcamento(int(os.getenv("RATELIMIT_LLM", "30")), 3600),
+}
+
+LLM_MAX_CONCORRENTES = int(os.getenv("LLM_MAX_CONCORRENTES", "4"))
+# Quanto um pedido espera por uma vaga antes de desistir (429)
+LLM_ESPERA_VAGA = float(os.getenv("LLM_ESPERA_VAGA", "10"))
+
+
+class LimiteExcedido(Exception):
+    def __init__(self, orcamento: str, espera: float):
+        super().__init__(f"limite de {orcamento} excedido (tente em {espera:.0f}s)")
+        self.orcamento = orcamento
+        self.espera = espera
+
+
+# ----------------------------------------------------------
+# Baldes (token bucket)
+# ----------------------------------------------------------
+class SQLiteBaldes:
+    """Baldes num arquivo SQLite compartilhado entre workers.
+
+    Uma consulta de vários baldes é tudo ou nada, numa transação IMMEDIATE:
+    dois workers nunca gastam a mesma ficha.
+    """
+
+    LIMPAR_A_CADA = 500                        # gravações entre limpezas
+    OCIOSO = max(o.periodo for o in ORCAMENTOS.values())  # balde parado há mais que isso está cheio
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS balde ("
+                " chave TEXT PRIMARY KEY, fichas REAL NOT NULL, atualizado REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def consumir(self, pedidos) -> tuple:
+        """pedidos: [(chave, orcamento, custo)].
+
+        Retorna (None, 0) se gastou as fichas de todos, ou (orcamento, segundos)
+        do balde que mais demora a ter saldo — nesse caso nada é gasto.
+        """
+        agora = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            saldos = []
+            pior = (None, 0)
+            for chave, nome, custo in pedidos:
+                orc = ORCAMENTOS[nome]
+                taxa = orc.capacidade / orc.periodo
+                row = conn.execute("SELECT fichas, atualizado FROM balde WHERE chave = ?", (chave,)).fetchone()
+                fichas = orc.capacidade if row is None else min(orc.capacidade, row[0] + (agora - row[1]) * taxa)
+                # Custo acima da capacidade nunca caberia: o limite de tamanho do envio cuida do resto
+                custo = min(custo, orc.capacidade)
+                if fichas < custo:
+                    espera = (custo - fichas) / taxa
+                    if espera > pior[1]:
+                        pior = (nome, espera)
+                saldos.append((chave, fichas - custo, agora))
+
+            if pior[0] is None:
+                conn.executemany(
+                    "INSERT INTO balde (chave, fichas, atualizado) VALUES (?, ?, ?) "
+                    "ON CONFLICT(chave) DO UPDATE SET fichas = excluded.fichas, atualizado = excluded.atualizado",
+                    saldos,
+                )
+                self._writes += 1
+                if self._writes % self.LIMPAR_A_CADA == 0:
+                    conn.execute("DELETE FROM balde WHERE atualizado < ?", (agora - self.OCIOSO,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return pior
+
+
+def from_env():
+    if RATELIMIT_BACKEND == "off":
+        return None
+    return SQLiteBaldes(RATELIMIT_PATH)
+
+
+baldes = from_env()
+
+
+def cliente_ip() -> str:
+    if RATELIMIT_PROXIES:
+        rota = request.access_route
+        return rota[-RATELIMIT_PROXIES] if len(rota) >= RATELIMIT_PROXIES else rota[0]
+    return request.remote_addr or "?"
+
+
+def exigir(*identidades, ip: bool = True, **custos) -> None:
+    """Gasta `custos` (orcamento=fichas) do balde do IP e de cada identidade
+    (ex.: "protocolo:ABC"); sem saldo em algum, levanta LimiteExcedido e não
+    gasta nada.
+    """
+    if baldes is None:
+        return
+    chaves = ([f"ip:{cliente_ip()}"] if ip else []) + list(identidades)
+    pedidos = [(f"{nome}:{chave}", nome, custo) for chave in chaves for nome, custo in custos.items() if custo]
+    if not pedidos:
+        return
+    try:
+        nome, espera = baldes.consumir(pedidos)
+    except sqlite3.Error:
+        # Armazenamento dos limites com problema: melhor atender do que derrubar o envio
+        current_app.logger.exception("rate limit indisponível")
+        return
+    if nome is not None:
+        raise LimiteExcedido(nome, espera)
+
+
+# ----------------------------------------------------------
+# Vagas para chamadas ao LLM
+# ----------------------------------------------------------
+_vagas_processo = threading.BoundedSemaphore(LLM_MAX_CONCORRENTES)
+
+
+def _tentar_vaga():
+    """Trava uma vaga livre (arquivo aberto) ou None."""
+    for i in range(LLM_MAX_CONCORRENTES):
+        fp = open(f"{RATELIMIT_PATH}.vaga-{i}", "a+b")
+        try:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fp.close()
+            continue
+        return fp
+    return None
+
+
+@contextmanager
+def vaga_llm():
+    """Segura uma das LLM_MAX_CONCORRENTES vagas durante a chamada ao LLM.
+
+    Espera até LLM_ESPERA_VAGA segundos; sem vaga, LimiteExcedido("llm_concorrencia").
+    """
+    limite = time.monotonic() + LLM_ESPERA_VAGA
+    if fcntl is None:
+        if not _vagas_processo.acquire(timeout=LLM_ESPERA_VAGA):
+            raise LimiteExcedido("llm_concorrencia", LLM_ESPERA_VAGA)
+        try:
+            yield
+        finally:
+            _vagas_processo.release()
+        return
+
+    pausa = 0.05
+    while True:
+        fp = _tentar_vaga()
+        if fp is not None:
+            break
+        if time.monotonic() >= limite:
+            raise LimiteExcedido("llm_concorrencia", LLM_ESPERA_VAGA)
+        time.sleep(pausa)
+        pausa = min(pausa * 2, 1.0)
+    try:
+        yield
+    finally:
+        fp.close()  # fechar libera o flock
+
+
+# ----------------------------------------------------------
+# Resposta 429
+# ----------------------------------------------------------
+MENSAGENS = {
+    "requisicoes": "Muitas requisições em pouco tempo.",
+    "usuarios": "Muitos protocolos criados a partir desta conexão.",
+    "bytes": "Limite de envio de arquivos atingido.",
+    "llm": "Limite de mensagens para a Capivara atingido.",
+    "llm_concorrencia": "A Capivara está ocupada no momento.",
+}
+
+
+def retry_after(exc: LimiteExcedido) -> int:
+    return max(1, int(exc.espera + 0.999))
+
+
+def _resposta(exc: LimiteExcedido):
+    segundos = retry_after(exc)
+    msg = f"{MENSAGENS.get(exc.orcamento, 'Limite atingido.')} Tente novamente em {segundos} s."
+    # Formulário (navegação) recebe a página; fetch/XHR/sw.js, JSON
+    if "text/html" in (request.headers.get("Accept") or ""):
+        resp = current_app.make_response((render_template("limite.html", mensagem=msg), 429))
+    else:
+        resp = jsonify({"ok": False, "erro": msg, "retry_after": segundos})
+        resp.status_code = 429
+    resp.headers["Retry-After"] = str(segundos)
+    return resp
+
+
+def init_app(app) -> None:
+    app.register_error_handler(LimiteExcedido, _resposta)
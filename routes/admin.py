@@ -1,34 +1,31 @@
-import os
 import datetime
 from functools import wraps
 
 from flask import (
     Blueprint, render_template, request, redirect, url_for, session,
-    current_app, abort
+    current_app, abort, Response, stream_with_context
 )
-from flask import send_file
+from flask import send_file, jsonify
+from sqlalchemy.orm import selectinload
 
-from models import User, Submission, File
+from models import db, User, Submission, File
+import llm_cache
+import db_engine
+import previews
+import delivery
+import audit
+import crypto
+import search
+import export
+import stats
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
-# MVP: admin fixo via env. (produção: hash + tabela de admins)
-ADMIN_USER = os.environ.get('ADMIN_USER', 'admin')
-ADMIN_PASS = os.environ.get('ADMIN_PASS', 'admin123')
 
 
-def _audit(action: str, details: str = "") -> None:
-    """Auditoria simples em arquivo (MVP)."""
-    try:
-        log_path = os.path.join(current_app.root_path, 'admin_audit.log')
-        ip = request.headers.get('X-Forwarded-For', request.remote_addr) or "-"
-        ua = request.headers.get('User-Agent', '-') or "-"
-        line = f"[{datetime.datetime.now().isoformat()}] {action} ip={ip} ua={ua} {details}\n"
-        with open(log_path, 'a', encoding='utf-8') as fp:
-            fp.write(line)
-    except Exception:
-        # Em MVP, auditoria não pode derrubar o sistema
-        pass
+def _audit(action: str, **fields) -> None:
+    """Auditoria estruturada (audit.py): enfileira e volta, sem I/O na requisição."""
+    audit.record(action, **fields)
 
 
 def login_required(fn):
@@ -50,13 +47,14 @@ def login():
         user = (request.form.get('user') or '').strip()
         password = (request.form.get('password') or '').strip()
 
-        if user == ADMIN_USER and password == ADMIN_PASS:
+        # MVP: admin fixo via env/config (produção: hash + tabela de admins)
+        if user == current_app.config['ADMIN_USER'] and password == current_app.config['ADMIN_PASS']:
             session['admin_logged'] = True
             session['admin_user'] = user
-            _audit("LOGIN_OK", f"admin_user={user}")
+            _audit("LOGIN_OK", admin=user)
             return redirect(url_for('admin.dashboard'))
 
-        _audit("LOGIN_FAIL", f"admin_user={user}")
+        _audit("LOGIN_FAIL", admin=user)
         return render_template('admin_login.html', error='Credenciais inválidas.')
 
     return render_template('admin_login.html')
@@ -64,55 +62,286 @@ def login():
 
 @admin_bp.get('/logout')
 def logout():
-    admin_user = session.get('admin_user', '-')
+    admin_user = session.get('admin_user')
     session.pop('admin_logged', None)
     session.pop('admin_user', None)
-    _audit("LOGOUT", f"admin_user={admin_user}")
+    _audit("LOGOUT", admin=admin_user)
     return redirect(url_for('admin.login'))
 
 
+PAGE_SIZE = 50
+PAGE_SIZE_MAX = 200
+
+TIPOS = ('texto', 'imagem', 'audio', 'video')
+
+
+def _parse_date(value: str):
+    try:
+        return datetime.datetime.strptime((value or '').strip(), '%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def _filtros(args) -> dict:
+    """Normaliza os filtros do painel (query string). Valores inválidos são ignorados."""
+    modo = (args.get('modo') or '').strip().lower()
+    tipo = (args.get('tipo') or '').strip().lower()
+    de = _parse_date(args.get('de'))
+    ate = _parse_date(args.get('ate'))
+    return {
+        'modo': modo if modo in ('publico', 'anonimo') else '',
+        'tipo': tipo if tipo in TIPOS else '',
+        'status': (args.get('status') or '').strip()[:30],
+        'de': de.strftime('%Y-%m-%d') if de else '',
+        'ate': ate.strftime('%Y-%m-%d') if ate else '',
+        'cpf': crypto.somente_digitos(args.get('cpf'))[:11],
+    }
+
+
+def submission_conditions(filtros: dict) -> list:
+    """Condições sobre Submission (tipo, status, período de envio).
+
+    Cobertas pelos índices submission(tipo, status) e submission(user_id, created_at).
+    """
+    conds = []
+    if filtros.get('tipo'):
+        conds.append(Submission.tipo == filtros['tipo'])
+    if filtros.get('status'):
+        conds.append(Submission.status == filtros['status'])
+    if filtros.get('de'):
+        conds.append(Submission.created_at >= _parse_date(filtros['de']))
+    if filtros.get('ate'):
+        conds.append(Submission.created_at < _parse_date(filtros['ate']) + datetime.timedelta(days=1))
+    return conds
+
+
+def user_conditions(filtros: dict) -> list:
+    """Condições sobre User (modo de envio, CPF)."""
+    conds = []
+    if filtros.get('cpf'):
+        # Índice cego: compara hashes, nenhum CPF é decifrado
+        conds.append(User.cpf_hash == crypto.blind_index(filtros['cpf']))
+    if filtros.get('modo'):
+        conds.append(User.is_public.is_(filtros['modo'] == 'publico'))
+    return conds
+
+
+def protocolos_query(filtros: dict):
+    """Protocolos (User) filtrados, do mais novo para o mais antigo."""
+    query = User.query.filter(*user_conditions(filtros))
+
+    conds = submission_conditions(filtros)
+    if conds:
+        # EXISTS correlacionado: usa submission(user_id, created_at) por protocolo
+        query = query.filter(
+            db.session.query(Submission.id)
+            .filter(Submission.user_id == User.id, *conds)
+            .exists()
+        )
+    return query.order_by(User.id.desc())
+
+
 @admin_bp.get('/')
 @login_required
 def dashboard():
-    users = User.query.order_by(User.id.desc()).limit(50).all()
-    _audit("VIEW_DASHBOARD", f"count={len(users)}")
-    return render_template('admin_dashboard.html', users=users)
+    """Lista paginada por cursor (keyset): `antes=<id>` traz os protocolos com id
+    menor que o último exibido — custo constante em qualquer página."""
+    filtros = _filtros(request.args)
+    try:
+        por_pagina = min(max(int(request.args.get('por_pagina', PAGE_SIZE)), 1), PAGE_SIZE_MAX)
+    except ValueError:
+        por_pagina = PAGE_SIZE
+    try:
+        antes = int(request.args.get('antes') or 0)
+    except ValueError:
+        antes = 0
+
+    query = protocolos_query(filtros)
+    if antes:
+        query = query.filter(User.id < antes)
+
+    # Engine só de leitura: o painel não disputa o lock com uploads e chat
+    with db_engine.read_session() as rs:
+        users = query.with_session(rs).limit(por_pagina + 1).all()
+    has_more = len(users) > por_pagina
+    users = users[:por_pagina]
+
+    ativos = {k: v for k, v in filtros.items() if v}
+    next_url = None
+    if has_more:
+        next_url = url_for('admin.dashboard', antes=users[-1].id, por_pagina=por_pagina, **ativos)
+
+    # CPF não vai em claro para a trilha de auditoria
+    filtros_log = {**ativos, 'cpf': '***'} if ativos.get('cpf') else ativos
+    _audit("VIEW_DASHBOARD", count=len(users), antes=antes or None, filtros=filtros_log)
+    return render_template(
+        'admin_dashboard.html',
+        users=users,
+        filtros=filtros,
+        tipos=TIPOS,
+        first_url=url_for('admin.dashboard', por_pagina=por_pagina, **ativos) if antes else None,
+        next_url=next_url,
+        ativos=ativos,
+        formatos_export=[f for f in export.FORMATOS if export.disponivel(f)],
+    )
+
+
+@admin_bp.get('/stats.json')
+@login_required
+def stats_json():
+    """Totais por tipo/status/modo, série diária (?dias=30) e bytes por mídia — só dos rollups."""
+    try:
+        dias = min(max(int(request.args.get('dias', stats.DIAS_PADRAO)), 1), stats.DIAS_MAX)
+    except ValueError:
+        dias = stats.DIAS_PADRAO
+    with db_engine.read_session() as rs:
+        dados = stats.resumo(rs, dias)
+    resp = jsonify({'ok': True, 'dias': dias, **dados})
+    resp.cache_control.private = True
+    resp.cache_control.max_age = 30
+    return resp
+
+
+@admin_bp.get('/busca')
+@login_required
+def busca():
+    """Busca textual ranqueada: ?q=...&fonte=todos|manifestacoes|chat&pagina=1&por_pagina=20"""
+    q = (request.args.get('q') or '').strip()[:200]
+    fonte = request.args.get('fonte', 'todos')
+    try:
+        pagina = max(int(request.args.get('pagina', 1)), 1)
+        por_pagina = min(max(int(request.args.get('por_pagina', search.POR_PAGINA)), 1), search.POR_PAGINA_MAX)
+    except ValueError:
+        pagina, por_pagina = 1, search.POR_PAGINA
+
+    res = search.buscar(q, fonte, pagina, por_pagina)
+    for r in res['resultados']:
+        if r.get('protocolo'):
+            r['url'] = url_for('admin.view_protocolo', protocolo=r['protocolo'])
+
+    next_url = None
+    if res['has_more']:
+        next_url = url_for('admin.busca', q=q, fonte=fonte, pagina=pagina + 1, por_pagina=por_pagina)
+
+    _audit("SEARCH", q=q, fonte=fonte, pagina=pagina, count=len(res['resultados']))
+    return jsonify({'ok': True, 'q': q, 'pagina': pagina, 'next_url': next_url, **res})
+
+
+@admin_bp.get('/export')
+@login_required
+def export_dados():
+    """Export em stream para auditoria: ?formato=csv|jsonl|parquet&arquivos=1 + filtros do painel."""
+    filtros = _filtros(request.args)
+    formato = (request.args.get('formato') or 'csv').lower()
+    com_zip = request.args.get('arquivos') == '1'
+    if not export.disponivel(formato):
+        return jsonify({'ok': False, 'erro': f'formato indisponível: {formato}'}), 400
+
+    # Manifestações via join (não EXISTS): uma linha por anexo
+    condicoes = user_conditions(filtros) + submission_conditions(filtros)
+    gerador = (export.stream_zip if com_zip else export.stream)(formato, condicoes)
+    nome = export.nome_arquivo(formato, com_zip)
+
+    ativos = {k: v for k, v in filtros.items() if v}
+    if ativos.get('cpf'):
+        ativos['cpf'] = '***'
+    _audit("EXPORT", formato=formato, arquivos=com_zip, filtros=ativos)
+    return Response(
+        stream_with_context(gerador),
+        mimetype=export.MIMETYPES['zip' if com_zip else formato],
+        headers={
+            'Content-Disposition': f'attachment; filename="{nome}"',
+            'Cache-Control': 'private, no-store',
+            'X-Accel-Buffering': 'no',  # nginx: repassa os blocos sem acumular
+        },
+    )
 
 
 @admin_bp.get('/protocolo/<protocolo>')
 @login_required
 def view_protocolo(protocolo: str):
     user = User.query.filter_by(protocolo=protocolo).first_or_404()
-    submissions = Submission.query.filter_by(user_id=user.id).order_by(Submission.id.desc()).all()
-    _audit("VIEW_PROTOCOL", f"protocolo={protocolo} submissions={len(submissions)}")
+    # Anexos de todas as submissões numa só consulta (IN), em vez de 1 por submissão
+    submissions = (Submission.query
+                   .options(selectinload(Submission.files))
+                   .filter_by(user_id=user.id)
+                   .order_by(Submission.id.desc())
+                   .all())
+    _audit("VIEW_PROTOCOL", protocolo=protocolo, submissions=len(submissions))
     return render_template('admin_protocolo.html', user=user, submissions=submissions)
 
 
-@admin_bp.get('/download/<int:file_id>')
+@admin_bp.get('/preview/<int:file_id>')
 @login_required
-def download_file(file_id: int):
+def preview_file(file_id: int):
+    """Prévia WebP redimensionada (?w=160|320|640|1280), do cache em disco."""
     f = File.query.get_or_404(file_id)
-
-    # file_path salva algo como: "static/uploads/uuid.ext"
-    safe_rel = (f.file_path or "").replace('\\', '/').lstrip('/')
-    if not safe_rel:
+    w = previews.largura(request.args.get('w'))
+    try:
+        path = previews.obter(f, w)
+    except (previews.SemPrevia, ValueError, PermissionError, OSError):
         abort(404)
 
-    abs_path = os.path.abspath(os.path.join(current_app.root_path, safe_rel))
+    # ETag pelo conteúdo (o mtime do arquivo muda a cada acerto do LRU)
+    resp = send_file(path, mimetype='image/webp', conditional=True, max_age=previews.MAX_AGE,
+                     etag=f"{f.sha256}-w{w}")
+    # Só o admin logado vê: cache do navegador, nunca de proxies
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    resp.cache_control.immutable = True
+    return resp
 
-    # Proteção contra path traversal: arquivo deve estar dentro de static/uploads
-    uploads_dir = os.path.abspath(os.path.join(current_app.root_path, 'static', 'uploads'))
-    if not abs_path.startswith(uploads_dir + os.sep) and abs_path != uploads_dir:
-        abort(403)
 
-    if not os.path.exists(abs_path):
+def _deliver(f: File, as_attachment: bool, action: str):
+    try:
+        resp = delivery.send_record(f, as_attachment=as_attachment, download_name=f.original_name)
+    except (ValueError, FileNotFoundError):
         abort(404)
+    except PermissionError:
+        # Proteção contra path traversal: arquivo deve estar dentro de static/uploads
+        abort(403)
+
+    # O player pede vários Range ao navegar no vídeo: audita só a abertura
+    if resp.status_code != 304 and delivery.is_first_range():
+        _audit(
+            action,
+            protocolo=f.submission.user.protocolo,
+            file_id=f.id,
+            original_name=f.original_name,
+            path=f.file_path,
+            sha256=f.sha256,
+        )
+    return resp
 
-    admin_user = session.get('admin_user', '-')
-    _audit(
-        "DOWNLOAD_FILE",
-        f"admin_user={admin_user} file_id={f.id} original_name={f.original_name} path={f.file_path} sha256={f.sha256}"
-    )
 
-    download_name = f.original_name or os.path.basename(abs_path)
-    return send_file(abs_path, as_attachment=True, download_name=download_name)
+@admin_bp.get('/download/<int:file_id>')
+@login_required
+def download_file(file_id: int):
+    f = File.query.get_or_404(file_id)
+    return _deliver(f, as_attachment=True, action="DOWNLOAD_FILE")
+
+
+@admin_bp.get('/media/<int:file_id>')
+@login_required
+def media_file(file_id: int):
+    """Inline (src do <video>/<audio>), com Range: a versão de reprodução, se houver
+    (transcode.py); ?original=1 força o conteúdo enviado."""
+    f = File.query.get_or_404(file_id)
+    if f.playback_path and not request.args.get('original'):
+        try:
+            resp = delivery.send_playback(f, download_name=f.original_name)
+        except (ValueError, FileNotFoundError, PermissionError):
+            pass  # versão de reprodução sumiu (GC/limpeza): cai no original
+        else:
+            if resp.status_code != 304 and delivery.is_first_range():
+                _audit("STREAM_FILE", protocolo=f.submission.user.protocolo, file_id=f.id,
+                       original_name=f.original_name, path=f.playback_path, sha256=f.sha256)
+            return resp
+    return _deliver(f, as_attachment=False, action="STREAM_FILE")
+
+
+@admin_bp.get('/metrics/llm-cache')
+@login_required
+def llm_cache_metrics():
+    """Acertos/erros do cache de respostas da Capivara (por processo)."""
+    return jsonify(llm_cache.cache.stats())
@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from models import db, User
+import ratelimit
 
 public_bp = Blueprint('public', __name__)
 
@@ -9,6 +10,8 @@ def home():
 
 @public_bp.post('/create_user')
 def create_user():
+    ratelimit.exigir(requisicoes=1, usuarios=1)
+
     # Checkbox: se marcado, usuário se identifica
     is_public = bool(request.form.get('is_public'))
 
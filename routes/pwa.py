@@ -0,0 +1,81 @@
+# routes/pwa.py — service worker servido na raiz, com o manifesto de precache
+#
+# GET /sw.js devolve static/sw.js precedido de
+#
+#   self.__PRECACHE = {"versao": "...", "arquivos": {"/static/outbox.js": "<hash>", "/": "<hash>"}}
+#
+# O hash é do conteúdo (arquivos de static/ e o template de cada página
+# pré-cacheada). Quando algo muda, muda o sw.js; o navegador instala a nova
+# versão e ela baixa só as URLs cujo hash mudou (ver install em sw.js).
+#
+# Servido em /sw.js (e não em /static/sw.js) para que o escopo seja "/": o
+# worker precisa ver as páginas e o POST /upload, não só /static/.
+
+import os
+import json
+import hashlib
+from threading import Lock
+
+from flask import Blueprint, current_app, Response
+
+pwa_bp = Blueprint('pwa', __name__)
+
+# Páginas pré-cacheadas -> template que as gera
+PAGINAS = {
+    "/": "index.html",
+    "/admin/login": "admin_login.html",
+}
+# Fora do precache: mídia enviada e o próprio worker
+IGNORAR = {"uploads", "sw.js"}
+
+_hashes = {}  # caminho -> (mtime, tamanho, hash)
+_lock = Lock()
+
+
+def _hash_arquivo(caminho: str) -> str:
+    st = os.stat(caminho)
+    with _lock:
+        item = _hashes.get(caminho)
+    if item and item[:2] == (st.st_mtime_ns, st.st_size):
+        return item[2]
+    h = hashlib.sha256()
+    with open(caminho, "rb") as fp:
+        for bloco in iter(lambda: fp.read(64 * 1024), b""):
+            h.update(bloco)
+    valor = h.hexdigest()[:16]
+    with _lock:
+        _hashes[caminho] = (st.st_mtime_ns, st.st_size, valor)
+    return valor
+
+
+def manifesto() -> dict:
+    """URL -> hash do conteúdo, mais a versão (hash de tudo)."""
+    arquivos = {}
+    static = current_app.static_folder
+    for raiz, dirs, nomes in os.walk(static):
+        dirs[:] = sorted(d for d in dirs if d not in IGNORAR)
+        for nome in sorted(nomes):
+            if nome in IGNORAR or nome.startswith("."):
+                continue
+            caminho = os.path.join(raiz, nome)
+            rel = os.path.relpath(caminho, static).replace(os.sep, "/")
+            arquivos[f"{current_app.static_url_path}/{rel}"] = _hash_arquivo(caminho)
+
+    templates = os.path.join(current_app.root_path, current_app.template_folder)
+    for url, template in PAGINAS.items():
+        arquivos[url] = _hash_arquivo(os.path.join(templates, template))
+
+    versao = hashlib.sha256(json.dumps(arquivos, sort_keys=True).encode()).hexdigest()[:16]
+    return {"versao": versao, "arquivos": arquivos}
+
+
+@pwa_bp.get('/sw.js')
+def service_worker():
+    with open(os.path.join(current_app.static_folder, "sw.js"), "rb") as fp:
+        codigo = fp.read()
+    cabecalho = f"self.__PRECACHE = {json.dumps(manifesto(), sort_keys=True)};\n".encode()
+    resp = Response(cabecalho + codigo, mimetype="application/javascript")
+    # O navegador já revalida o worker; sem cache intermediário segurando versão velha
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["Service-Worker-Allowed"] = "/"
+    return resp
@@ -0,0 +1,403 @@
+# routes/resumable.py — upload retomável em partes (protocolo no estilo tus)
+#
+# Fluxo:
+#   POST  /upload/resumable               -> cria a sessão (tamanho total, tipo, nome)
+#   HEAD  /upload/resumable/<id>          -> consulta o offset atual (Upload-Offset)
+#   PATCH /upload/resumable/<id>          -> anexa bytes a partir de Upload-Offset
+#   DELETE /upload/resumable/<id>         -> cancela a sessão
+#   POST  /upload/resumable/finalize      -> cria Submission/File com as sessões completas
+#                                            (idempotency_key: repetir devolve a mesma)
+#
+# O SHA-256 é atualizado a cada PATCH (o estado do hash fica em memória no
+# processo; se outro worker receber a próxima parte, o hash é reconstruído
+# relendo apenas a parte já gravada). Cada parte pode trazer
+# `Upload-Checksum: sha256 <base64>` para verificação imediata.
+
+import os
+import base64
+import hashlib
+import datetime
+from collections import OrderedDict
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+import click
+from flask import Blueprint, current_app, request, jsonify, url_for, flash
+from flask.cli import with_appcontext
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.utils import secure_filename
+
+from models import db, User, Submission, File, UploadSession
+from ingest import IngestedFile, CHUNK_SIZE
+from routes.upload import (ALLOWED, MAX_BYTES, _ext, idempotency_key, ja_registrada, gravar_submission,
+                           ChaveInvalida, tamanho_original)
+import storage
+import jobs
+import ratelimit
+
+resumable_bp = Blueprint('resumable', __name__)
+
+TUS_VERSION = '1.0.0'
+
+# Estado incremental do hash: upload_id -> (offset, hashlib.sha256)
+_HASHERS = OrderedDict()
+_HASHERS_MAX = 256
+_hashers_lock = Lock()
+
+
+def _part_dir() -> str:
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'partial')
+
+
+def _part_path(upload_id: str) -> str:
+    return os.path.join(_part_dir(), f"{upload_id}.part")
+
+
+def _headers(sess: UploadSession) -> dict:
+    return {
+        'Tus-Resumable': TUS_VERSION,
+        'Upload-Offset': str(sess.offset_bytes),
+        'Upload-Length': str(sess.total_bytes),
+        'Cache-Control': 'no-store',
+    }
+
+
+def _error(msg: str, status: int, sess: UploadSession = None):
+    resp = jsonify({'ok': False, 'erro': msg})
+    if sess is not None:
+        resp.headers.update(_headers(sess))
+    return resp, status
+
+
+def _hasher_at(upload_id: str, offset: int):
+    """Devolve o hash dos primeiros `offset` bytes (do cache ou relendo o .part)."""
+    with _hashers_lock:
+        cached = _HASHERS.pop(upload_id, None)
+    if cached and cached[0] == offset:
+        return cached[1]
+
+    h = hashlib.sha256()
+    remaining = offset
+    with open(_part_path(upload_id), 'rb') as fp:
+        while remaining > 0:
+            chunk = fp.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            h.update(chunk)
+            remaining -= len(chunk)
+    return h
+
+
+def _remember(upload_id: str, offset: int, h) -> None:
+    with _hashers_lock:
+        _HASHERS[upload_id] = (offset, h)
+        while len(_HASHERS) > _HASHERS_MAX:
+            _HASHERS.popitem(last=False)
+
+
+def _forget(upload_id: str) -> None:
+    with _hashers_lock:
+        _HASHERS.pop(upload_id, None)
+
+
+def _descartar_sessao(sess: UploadSession) -> None:
+    upload_id = sess.id
+    db.session.delete(sess)
+    db.session.commit()
+    _forget(upload_id)
+
+
+def _parse_checksum(value: str):
+    """`Upload-Checksum: sha256 <base64>` -> digest em bytes (ou None)."""
+    if not value:
+        return None
+    algo, _, b64 = value.strip().partition(' ')
+    if algo.lower() != 'sha256':
+        return None
+    try:
+        return base64.b64decode(b64)
+    except ValueError:
+        return None
+
+
+@resumable_bp.post('/upload/resumable')
+def resumable_create():
+    data = request.get_json(silent=True) or request.form
+
+    protocolo = (data.get('protocolo') or '').strip()
+    tipo = (data.get('tipo') or '').strip().lower()
+    filename = (data.get('filename') or '').strip()
+    mime = (data.get('mime') or '').strip() or 'application/octet-stream'
+    sha256 = (data.get('sha256') or '').strip().lower() or None
+    try:
+        size = int(data.get('size') or request.headers.get('Upload-Length') or -1)
+    except (TypeError, ValueError):
+        size = -1
+
+    user = User.query.filter_by(protocolo=protocolo).first()
+    if not user:
+        return _error('Protocolo não encontrado.', 404)
+
+    if tipo not in ALLOWED or tipo == 'texto':
+        return _error('Tipo de manifestação inválido para envio de arquivo.', 400)
+
+    if _ext(secure_filename(filename)) not in ALLOWED[tipo]:
+        return _error(f'Arquivo não permitido para {tipo}: {filename}', 400)
+
+    if size < 0:
+        return _error('Informe o tamanho total do arquivo.', 400)
+
+    limit = MAX_BYTES.get(tipo, 0)
+    if limit and size > limit:
+        return _error(f'Arquivo muito grande ({filename}). Limite para {tipo}: {limit // (1024*1024)}MB.', 413)
+
+    # Os bytes contam aqui, pelo tamanho declarado; os PATCH não passam pelo limite
+    ratelimit.exigir(f'protocolo:{protocolo}', requisicoes=1, bytes=size)
+
+    sess = UploadSession(
+        user_id=user.id,
+        tipo=tipo,
+        original_name=filename,
+        mime_type=mime,
+        total_bytes=size,
+        offset_bytes=0,
+        sha256=sha256,
+        original_size_bytes=tamanho_original(data.get('original_size')),
+    )
+    db.session.add(sess)
+    db.session.flush()  # garante sess.id
+
+    os.makedirs(_part_dir(), exist_ok=True)
+    open(_part_path(sess.id), 'wb').close()
+    db.session.commit()
+
+    location = url_for('resumable.resumable_patch', upload_id=sess.id)
+    resp = jsonify({'ok': True, 'id': sess.id, 'offset': 0, 'url': location})
+    resp.headers.update(_headers(sess))
+    resp.headers['Location'] = location
+    return resp, 201
+
+
+@resumable_bp.route('/upload/resumable/<upload_id>', methods=['HEAD'])
+def resumable_head(upload_id: str):
+    sess = db.session.get(UploadSession, upload_id)
+    if not sess or not os.path.exists(_part_path(upload_id)):
+        return '', 404, {'Cache-Control': 'no-store'}
+    return '', 200, _headers(sess)
+
+
+@resumable_bp.route('/upload/resumable/<upload_id>', methods=['PATCH'])
+def resumable_patch(upload_id: str):
+    sess = db.session.get(UploadSession, upload_id)
+    if not sess:
+        return _error('Upload não encontrado ou expirado.', 404)
+
+    try:
+        client_offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return _error('Cabeçalho Upload-Offset ausente ou inválido.', 400, sess)
+
+    expected_digest = _parse_checksum(request.headers.get('Upload-Checksum'))
+
+    try:
+        fp = open(_part_path(upload_id), 'r+b')
+    except FileNotFoundError:
+        # .part removido (DELETE/uploads-purge em paralelo, limpeza do disco):
+        # a sessão não tem mais como continuar; o cliente abre outra
+        _descartar_sessao(sess)
+        return _error('Upload não existe mais; recomece o envio.', 410)
+
+    with fp:
+        # Uma parte por vez por upload, mesmo entre workers. Sem esperar: o flock
+        # bloqueante pararia o worker gevent inteiro; o cliente consulta o HEAD e retoma
+        if fcntl:
+            try:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                resp, status = _error('Outra parte deste upload está em andamento.', 423, sess)
+                resp.headers['Retry-After'] = '1'
+                return resp, status
+
+        db.session.refresh(sess)
+        offset = sess.offset_bytes
+        if client_offset != offset:
+            return _error('Offset divergente; consulte com HEAD e retome.', 409, sess)
+
+        # Bytes além do offset confirmado (de uma parte interrompida) são descartados
+        fp.seek(offset)
+        fp.truncate()
+
+        h = _hasher_at(upload_id, offset)
+        chunk_hash = hashlib.sha256() if expected_digest else None
+        written = 0
+        disconnected = False
+
+        try:
+            for chunk in iter(lambda: request.stream.read(CHUNK_SIZE), b''):
+                if offset + written + len(chunk) > sess.total_bytes:
+                    fp.truncate(offset)
+                    _forget(upload_id)
+                    return _error('Parte ultrapassa o tamanho declarado.', 413, sess)
+                fp.write(chunk)
+                h.update(chunk)
+                if chunk_hash:
+                    chunk_hash.update(chunk)
+                written += len(chunk)
+        except ClientDisconnected:
+            # Conexão caiu no meio: o que chegou fica salvo (o cliente retoma via HEAD)
+            disconnected = True
+
+        if chunk_hash and (disconnected or chunk_hash.digest() != expected_digest):
+            fp.truncate(offset)
+            _forget(upload_id)
+            return _error('Checksum da parte não confere.', 460, sess)
+
+        fp.flush()
+        os.fsync(fp.fileno())
+
+        sess.offset_bytes = offset + written
+        db.session.commit()
+        _remember(upload_id, sess.offset_bytes, h)
+
+    if disconnected:
+        return _error('Conexão interrompida; retome a partir do offset.', 400, sess)
+    return '', 204, _headers(sess)
+
+
+@resumable_bp.route('/upload/resumable/<upload_id>', methods=['DELETE'])
+def resumable_delete(upload_id: str):
+    sess = db.session.get(UploadSession, upload_id)
+    if sess:
+        db.session.delete(sess)
+        db.session.commit()
+    _forget(upload_id)
+    try:
+        os.remove(_part_path(upload_id))
+    except OSError:
+        pass
+    return '', 204, {'Tus-Resumable': TUS_VERSION}
+
+
+@resumable_bp.post('/upload/resumable/finalize')
+def resumable_finalize():
+    ratelimit.exigir(requisicoes=1)
+    data = request.get_json(silent=True) or request.form
+
+    protocolo = (data.get('protocolo') or '').strip()
+    tipo = (data.get('tipo') or '').strip().lower()
+    texto = (data.get('texto') or '').strip() or None
+    upload_ids = data.getlist('uploads') if hasattr(data, 'getlist') else data.get('uploads')
+    upload_ids = [u for u in (upload_ids or []) if u]
+
+    user = User.query.filter_by(protocolo=protocolo).first()
+    if not user:
+        return _error('Protocolo não encontrado.', 404)
+
+    try:
+        chave = idempotency_key(data)
+    except ChaveInvalida:
+        return _error('Idempotency-Key inválida.', 400)
+
+    # Finalize repetido (resposta perdida): as sessões já viraram arquivos
+    existente = ja_registrada(user.id, chave)
+    if existente:
+        return _finalizado(protocolo, existente, repetida=True)
+
+    if tipo not in ALLOWED or tipo == 'texto':
+        return _error('Tipo de manifestação inválido.', 400)
+
+    if not upload_ids:
+        return _error('Para este tipo, envie ao menos 1 arquivo.', 400)
+
+    sessions = UploadSession.query.filter(
+        UploadSession.id.in_(upload_ids),
+        UploadSession.user_id == user.id,
+    ).all()
+    by_id = {s.id: s for s in sessions}
+    if len(by_id) != len(set(upload_ids)):
+        return _error('Upload não encontrado ou expirado.', 404)
+
+    for sess in sessions:
+        if sess.tipo != tipo:
+            return _error(f'Arquivo enviado para outro tipo: {sess.original_name}', 400)
+        if sess.offset_bytes != sess.total_bytes:
+            return _error(f'Upload incompleto: {sess.original_name}', 409, sess)
+
+    submission, repetida = gravar_submission(
+        Submission(tipo=tipo, texto=texto, user_id=user.id, idempotency_key=chave)
+    )
+    if repetida:
+        return _finalizado(protocolo, submission, repetida=True)
+
+    # Confere todos os hashes antes de mover qualquer .part para o repositório:
+    # uma falha no meio deixaria as sessões já movidas sem arquivo para o retry
+    hashes = {}
+    for upload_id in dict.fromkeys(upload_ids):
+        sess = by_id[upload_id]
+        hashes[upload_id] = _hasher_at(sess.id, sess.total_bytes).hexdigest()
+        if sess.sha256 and sess.sha256 != hashes[upload_id]:
+            db.session.rollback()
+            return _error(f'Integridade não confere (SHA-256): {sess.original_name}', 422)
+
+    for upload_id, sha256 in hashes.items():
+        sess = by_id[upload_id]
+        ext = _ext(secure_filename(sess.original_name or ''))
+        ingested = IngestedFile(None, sess.original_name, sess.mime_type, _part_path(sess.id),
+                                sess.total_bytes, sha256)
+        blob_path = storage.store(ingested, ext)
+
+        db_file = File(
+            file_type=tipo,
+            file_path=blob_path,
+            original_name=sess.original_name,
+            mime_type=sess.mime_type,
+            size_bytes=sess.total_bytes,
+            original_size_bytes=sess.original_size_bytes,
+            sha256=sha256,
+            submission_id=submission.id,
+        )
+        db.session.add(db_file)
+        db.session.flush()  # garante db_file.id
+        jobs.enqueue_media(db_file)
+        db.session.delete(sess)
+        _forget(sess.id)
+
+    db.session.commit()
+    return _finalizado(protocolo, submission)
+
+
+def _finalizado(protocolo: str, submission: Submission, repetida: bool = False):
+    flash('Manifestação registrada com sucesso.', 'success')
+    return jsonify({
+        'ok': True,
+        'submission_id': submission.id,
+        'repetida': repetida,
+        'redirect': url_for('public.protocolo_page', protocolo=protocolo),
+    })
+
+
+def purge_stale_sessions(max_age_hours: int) -> int:
+    """Remove sessões abandonadas (e seus .part) mais antigas que max_age_hours."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=max_age_hours)
+    stale = UploadSession.query.filter(UploadSession.updated_at < cutoff).all()
+    for sess in stale:
+        try:
+            os.remove(_part_path(sess.id))
+        except OSError:
+            pass
+        db.session.delete(sess)
+    db.session.commit()
+    return len(stale)
+
+
+@click.command("uploads-purge")
+@click.option("--max-age-hours", default=48, show_default=True)
+@with_appcontext
+def uploads_purge_command(max_age_hours: int):
+    """Apaga uploads retomáveis abandonados."""
+    n = purge_stale_sessions(max_age_hours)
+    click.echo(f"sessões removidas={n}")
@@ -1,9 +1,13 @@
 import os
-import uuid
-import hashlib
-from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash
+import re
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, jsonify
+from sqlalchemy.exc import IntegrityError
 from werkzeug.utils import secure_filename
 from models import db, User, Submission, File
+from ingest import parse_multipart, UploadTooLarge
+import storage
+import jobs
+import ratelimit
 
 upload_bp = Blueprint('upload', __name__)
 
@@ -21,103 +25,206 @@ MAX_BYTES = {
     'texto': 0,
 }
 
-def _sha256_of_file(filepath: str) -> str:
-    h = hashlib.sha256()
-    with open(filepath, 'rb') as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b''):
-            h.update(chunk)
-    return h.hexdigest()
+def _limit_for(form) -> int:
+    # 'tipo' chega antes dos arquivos no formulário; se não vier, vale o maior limite
+    tipo = (form.get('tipo') or '').strip().lower()
+    return MAX_BYTES.get(tipo) or max(MAX_BYTES.values())
+
+def _discard(ingested) -> None:
+    for f in ingested:
+        f.discard()
 
 def _ext(filename: str) -> str:
     return os.path.splitext(filename)[1].lower()
 
+def tamanho_original(valor):
+    """Tamanho do arquivo antes da compressão no navegador (upload.html); None se não veio."""
+    try:
+        n = int(valor)
+    except (TypeError, ValueError):
+        return None
+    return n if 0 < n < 2 ** 31 else None
+
+# Idempotency-Key: uuid gerado no navegador por manifestação. O mesmo envio
+# repetido (fila offline do sw.js, duplo clique, resposta perdida) devolve a
+# manifestação já gravada em vez de criar outra.
+_CHAVE_VALIDA = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+class ChaveInvalida(ValueError):
+    pass
+
+def idempotency_key(data):
+    chave = (request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '').strip()
+    if not chave:
+        return None
+    if not _CHAVE_VALIDA.match(chave):
+        raise ChaveInvalida(chave)
+    return chave
+
+def ja_registrada(user_id: int, chave):
+    if not chave:
+        return None
+    return Submission.query.filter_by(user_id=user_id, idempotency_key=chave).first()
+
+def gravar_submission(submission: Submission):
+    """add + flush -> (submission, repetida).
+
+    Se outra requisição com a mesma chave gravou entre a consulta e o flush,
+    o índice único recusa esta e a já gravada é devolvida.
+    """
+    db.session.add(submission)
+    try:
+        db.session.flush()  # garante submission.id
+    except IntegrityError:
+        db.session.rollback()
+        existente = ja_registrada(submission.user_id, submission.idempotency_key)
+        if existente is None:
+            raise
+        return existente, True
+    return submission, False
+
+def _quer_json() -> bool:
+    # Reenvio da fila offline (sw.js) pede JSON; o formulário segue com redirect + flash
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+def _falha(msg: str, protocolo: str = '', status: int = 400):
+    if _quer_json():
+        return jsonify({'ok': False, 'erro': msg}), status
+    flash(msg, 'error')
+    if protocolo and status != 404:
+        return redirect(url_for('upload.upload_page', protocolo=protocolo))
+    return redirect(url_for('public.home'))
+
+def _sucesso(protocolo: str, submission: Submission, repetida: bool = False):
+    destino = url_for('public.protocolo_page', protocolo=protocolo)
+    if _quer_json():
+        return jsonify({'ok': True, 'submission_id': submission.id, 'repetida': repetida, 'redirect': destino})
+    flash('Manifestação registrada com sucesso.', 'success')
+    return redirect(destino)
+
 @upload_bp.get('/upload/<protocolo>')
 def upload_page(protocolo: str):
     user = User.query.filter_by(protocolo=protocolo).first_or_404()
-    return render_template('upload.html', protocolo=user.protocolo)
+    compressao = {
+        'max_px': current_app.config['UPLOAD_IMAGE_MAX_PX'],
+        'qualidade': current_app.config['UPLOAD_IMAGE_QUALITY'],
+        'taxa_audio': current_app.config['UPLOAD_AUDIO_SAMPLE_RATE'],
+    }
+    return render_template('upload.html', protocolo=user.protocolo, compressao=compressao)
 
 @upload_bp.post('/upload')
 def upload_submit():
-    protocolo = (request.form.get('protocolo') or '').strip()
-    tipo = (request.form.get('tipo') or '').strip().lower()
-    texto = (request.form.get('texto') or '').strip() or None
+    # Limite por IP antes de ler o corpo (o tamanho vem do Content-Length)
+    declarado = request.content_length
+    ratelimit.exigir(requisicoes=1, bytes=declarado or 0)
+
+    # Lê o corpo em passada única: hash + tamanho + escrita, abortando no limite
+    try:
+        form, ingested = parse_multipart(request, current_app.config['UPLOAD_FOLDER'], _limit_for)
+    except UploadTooLarge as e:
+        protocolo = (e.form.get('protocolo') or '').strip()
+        return _falha(f'Arquivo muito grande ({e.filename}). Limite: {e.limit // (1024*1024)}MB.', protocolo, 413)
+
+    if declarado is None:
+        # Corpo chunked (sem Content-Length): o IP paga os bytes que de fato chegaram
+        try:
+            ratelimit.exigir(bytes=sum(f.size for f in ingested))
+        except ratelimit.LimiteExcedido:
+            _discard(ingested)
+            raise
+
+    protocolo = (form.get('protocolo') or '').strip()
+    tipo = (form.get('tipo') or '').strip().lower()
+    texto = (form.get('texto') or '').strip() or None
 
     user = User.query.filter_by(protocolo=protocolo).first()
     if not user:
-        flash('Protocolo não encontrado. Verifique e tente novamente.', 'error')
-        return redirect(url_for('public.home'))
+        _discard(ingested)
+        return _falha('Protocolo não encontrado. Verifique e tente novamente.', status=404)
+
+    try:
+        chave = idempotency_key(form)
+    except ChaveInvalida:
+        _discard(ingested)
+        return _falha('Idempotency-Key inválida.', protocolo)
+
+    existente = ja_registrada(user.id, chave)
+    if existente:
+        # Reenvio de algo já gravado: os bytes recebidos de novo são descartados
+        _discard(ingested)
+        return _sucesso(protocolo, existente, repetida=True)
+
+    try:
+        ratelimit.exigir(f'protocolo:{protocolo}', ip=False, requisicoes=1, bytes=sum(f.size for f in ingested))
+    except ratelimit.LimiteExcedido:
+        _discard(ingested)
+        raise
 
     if tipo not in ALLOWED:
-        flash('Tipo de manifestação inválido.', 'error')
-        return redirect(url_for('upload.upload_page', protocolo=protocolo))
+        _discard(ingested)
+        return _falha('Tipo de manifestação inválido.', protocolo)
 
-    files = request.files.getlist('files')
+    files = [f for f in ingested if f.field == 'files']
+    _discard([f for f in ingested if f.field != 'files'])
+    # Um `tamanho_original` por arquivo, na mesma ordem (vazio: não foi comprimido)
+    originais = form.getlist('tamanho_original')
 
     # Regras mínimas:
     # - texto: pode ir só com texto, sem arquivo
     # - demais: precisa de pelo menos 1 arquivo
-    if tipo != 'texto' and (not files or all((f is None) or (f.filename == '') for f in files)):
-        flash('Para este tipo, envie ao menos 1 arquivo.', 'error')
-        return redirect(url_for('upload.upload_page', protocolo=protocolo))
-
-    submission = Submission(tipo=tipo, texto=texto, user_id=user.id)
-    db.session.add(submission)
-    db.session.flush()  # garante submission.id
-
+    if tipo != 'texto' and not files:
+        return _falha('Para este tipo, envie ao menos 1 arquivo.', protocolo)
+
+    submission, repetida = gravar_submission(
+        Submission(tipo=tipo, texto=texto, user_id=user.id, idempotency_key=chave)
+    )
+    if repetida:
+        _discard(files)
+        return _sucesso(protocolo, submission, repetida=True)
     saved_any = False
 
-    for f in files:
-        if not f or not f.filename:
-            continue
-
+    for i, f in enumerate(files):
         original_name = f.filename
         safe_name = secure_filename(original_name)
         ext = _ext(safe_name)
 
         if tipo != 'texto':
             if ext not in ALLOWED[tipo]:
-                flash(f'Arquivo não permitido para {tipo}: {original_name}', 'error')
                 db.session.rollback()
-                return redirect(url_for('upload.upload_page', protocolo=protocolo))
-
-        internal_name = f"{uuid.uuid4().hex}{ext}" if ext else uuid.uuid4().hex
-        dest_dir = current_app.config['UPLOAD_FOLDER']
-        os.makedirs(dest_dir, exist_ok=True)
-        dest_path = os.path.join(dest_dir, internal_name)
-
-        f.save(dest_path)
-        size_bytes = os.path.getsize(dest_path)
+                _discard(files[i:])
+                return _falha(f'Arquivo não permitido para {tipo}: {original_name}', protocolo)
 
+        # Limite por tipo (o stream pode ter usado o limite geral se 'tipo' veio depois)
         limit = MAX_BYTES.get(tipo, 0)
-        if limit and size_bytes > limit:
-            try:
-                os.remove(dest_path)
-            except Exception:
-                pass
-            flash(f'Arquivo muito grande ({original_name}). Limite para {tipo}: {limit // (1024*1024)}MB.', 'error')
+        if limit and f.size > limit:
             db.session.rollback()
-            return redirect(url_for('upload.upload_page', protocolo=protocolo))
+            _discard(files[i:])
+            return _falha(f'Arquivo muito grande ({original_name}). Limite para {tipo}: {limit // (1024*1024)}MB.',
+                          protocolo, 413)
 
-        sha256 = _sha256_of_file(dest_path)
+        # Conteúdo deduplicado por SHA-256 (reenvio do mesmo arquivo não ocupa disco)
+        blob_path = storage.store(f, ext)
 
         db_file = File(
             file_type=tipo,
-            file_path=f"static/uploads/{internal_name}",
+            file_path=blob_path,
             original_name=original_name,
             mime_type=f.mimetype,
-            size_bytes=size_bytes,
-            sha256=sha256,
+            size_bytes=f.size,
+            original_size_bytes=tamanho_original(originais[i]) if i < len(originais) else None,
+            sha256=f.sha256,
             submission_id=submission.id,
         )
         db.session.add(db_file)
+        db.session.flush()  # garante db_file.id
+        # Miniaturas/metadados ficam para o worker (jobs.py), no mesmo commit
+        jobs.enqueue_media(db_file)
         saved_any = True
 
     # texto pode ser só texto
     if tipo == 'texto' or saved_any:
         db.session.commit()
-        flash('Manifestação registrada com sucesso.', 'success')
-        return redirect(url_for('public.protocolo_page', protocolo=protocolo))
+        return _sucesso(protocolo, submission)
 
     db.session.rollback()
-    flash('Nenhum arquivo válido foi enviado.', 'error')
-    return redirect(url_for('upload.upload_page', protocolo=protocolo))
+    return _falha('Nenhum arquivo válido foi enviado.', protocolo)
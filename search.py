@@ -0,0 +1,197 @@
+# search.py — busca textual nas manifestações e nas conversas do chat (SQLite FTS5)
+#
+# Duas tabelas FTS5 de conteúdo externo (o texto não é duplicado):
+#   submission_fts      <- submission.texto
+#   chat_mensagens_fts  <- chat_mensagens.conteudo_texto
+# mantidas por triggers no próprio banco (qualquer escrita, ORM ou SQL, entra
+# no índice na mesma transação). Criadas pela migração 005.
+#
+# Tokenização unicode61 com remove_diacritics 2: "calçada" casa com "calcada",
+# "São João" com "sao joao". Não há stemmer de português no FTS5; o último
+# termo vira busca por prefixo ("reclam" acha reclamação/reclamações), acelerada
+# pelo índice de prefixos (prefix='2 3') quando curto.
+#
+# Ranking bm25 sobre as correspondências mais recentes (SEARCH_RANK_WINDOW por
+# fonte), o que mantém termos muito frequentes em tempo constante. Quando
+# alguma fonte tem mais correspondências que isso, a resposta vem com
+# "truncado": o painel avisa que as mais antigas ficaram de fora.
+#
+# Fora do SQLite (PostgreSQL) a busca cai num ILIKE, sem ranking.
+
+import re
+import unicodedata
+
+from flask import current_app
+from sqlalchemy import text, select
+
+from models import db, Submission, User, ChatMensagem
+
+TOKENIZER = "unicode61 remove_diacritics 2"
+PREFIXOS = "2 3"
+
+FONTES = ("todos", "manifestacoes", "chat")
+POR_PAGINA = 20
+POR_PAGINA_MAX = 100
+
+# (tabela fts, tabela de conteúdo, coluna)
+_INDICES = (
+    ("submission_fts", "submission", "texto"),
+    ("chat_mensagens_fts", "chat_mensagens", "conteudo_texto"),
+)
+
+
+def create_index(conn) -> None:
+    """DDL das tabelas FTS5 + triggers, e carga do que já existe (migração 005)."""
+    if conn.dialect.name != "sqlite":
+        return
+    for fts, tabela, coluna in _INDICES:
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{coluna}, content='{tabela}', content_rowid='id', "
+            f"tokenize='{TOKENIZER}', prefix='{PREFIXOS}')"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabela} BEGIN "
+            f"INSERT INTO {fts}(rowid, {coluna}) VALUES (new.id, new.{coluna}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabela} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {coluna}) VALUES ('delete', old.id, old.{coluna}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {coluna} ON {tabela} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {coluna}) VALUES ('delete', old.id, old.{coluna}); "
+            f"INSERT INTO {fts}(rowid, {coluna}) VALUES (new.id, new.{coluna}); END"
+        ))
+        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+def termos(q: str) -> list:
+    return [_dobrar(t) for t in re.findall(r"\w+", q or "")][:12]
+
+
+def _dobrar(s: str) -> str:
+    # Mesma normalização do tokenizer: minúsculas, sem acentos
+    s = unicodedata.normalize("NFKD", s.lower())
+    return "".join(c for c in s if not unicodedata.combining(c))
+
+
+def fts_query(q: str) -> str:
+    """Texto livre -> expressão FTS5 segura: todos os termos, o último como prefixo.
+
+    Só o último vira prefixo (quem digita ainda não terminou a palavra): o FTS5
+    materializa a lista inteira de um termo com prefixo antes de percorrer, e
+    termos exatos são lidos sob demanda, parando na janela de ranking.
+    """
+    ts = termos(q)
+    return " AND ".join([f'"{t}"' for t in ts[:-1]] + [f'"{t}"*' for t in ts[-1:]])
+
+
+def trecho(texto: str, ts: list, palavras: int = 16) -> str:
+    """Janela do texto em torno do primeiro termo encontrado, termos entre [ ]."""
+    tokens = re.findall(r"\w+|[^\w\s]+", texto or "")
+    marca = [bool(re.match(r"\w", tk)) and any(_dobrar(tk).startswith(t) for t in ts) for tk in tokens]
+    primeiro = marca.index(True) if True in marca else 0
+    ini = max(0, primeiro - palavras // 3)
+    fim = min(len(tokens), ini + palavras)
+    partes = [f"[{tk}]" if m else tk for tk, m in zip(tokens[ini:fim], marca[ini:fim])]
+    s = re.sub(r" ([^\w\s\[])", r"\1", " ".join(partes))
+    return ("…" if ini > 0 else "") + s + ("…" if fim < len(tokens) else "")
+
+
+def _fontes_fts(fonte: str) -> list:
+    return [(rotulo, fts) for nome, rotulo, fts in (("manifestacoes", "manifestacao", "submission_fts"),
+                                                    ("chat", "chat", "chat_mensagens_fts"))
+            if fonte in ("todos", nome)]
+
+
+def _fts(expr: str, fonte: str, limit: int, offset: int) -> list:
+    # bm25 só sobre as SEARCH_RANK_WINDOW correspondências mais recentes de cada
+    # fonte: o FTS5 percorre em ordem de rowid e para cedo, então termos muito
+    # comuns não obrigam a pontuar a tabela inteira.
+    partes = [
+        f"SELECT * FROM (SELECT '{rotulo}' AS fonte, rowid AS id, bm25({fts}) AS score "
+        f"FROM {fts} WHERE {fts} MATCH :q ORDER BY rowid DESC LIMIT :janela)"
+        for rotulo, fts in _fontes_fts(fonte)
+    ]
+    sql = " UNION ALL ".join(partes) + " ORDER BY score LIMIT :limit OFFSET :offset"
+    rows = db.session.execute(
+        text(sql), {"q": expr, "janela": current_app.config.get("SEARCH_RANK_WINDOW", 2000), "limit": limit, "offset": offset}
+    )
+    return [dict(r._mapping) for r in rows]
+
+
+def _fts_truncado(expr: str, fonte: str) -> bool:
+    """Alguma fonte tem correspondências além da janela de ranking?"""
+    janela = current_app.config.get("SEARCH_RANK_WINDOW", 2000)
+    for _, fts in _fontes_fts(fonte):
+        passou = db.session.execute(
+            text(f"SELECT 1 FROM {fts} WHERE {fts} MATCH :q ORDER BY rowid DESC LIMIT 1 OFFSET :janela"),
+            {"q": expr, "janela": janela},
+        ).first()
+        if passou:
+            return True
+    return False
+
+
+def _like(ts: list, fonte: str, limit: int, offset: int) -> list:
+    # Sem FTS (PostgreSQL): todos os termos, sem ranking, mais recentes primeiro
+    res = []
+    if fonte in ("todos", "manifestacoes"):
+        conds = [Submission.texto.ilike(f"%{t}%") for t in ts]
+        for (sid,) in db.session.execute(
+            select(Submission.id).where(*conds).order_by(Submission.id.desc()).limit(limit + offset)
+        ):
+            res.append({"fonte": "manifestacao", "id": sid, "score": None})
+    if fonte in ("todos", "chat"):
+        conds = [ChatMensagem.conteudo_texto.ilike(f"%{t}%") for t in ts]
+        for (mid,) in db.session.execute(
+            select(ChatMensagem.id).where(*conds).order_by(ChatMensagem.id.desc()).limit(limit + offset)
+        ):
+            res.append({"fonte": "chat", "id": mid, "score": None})
+    return res[offset:offset + limit]
+
+
+def buscar(q: str, fonte: str = "todos", pagina: int = 1, por_pagina: int = POR_PAGINA) -> dict:
+    """Busca ranqueada (bm25), paginada. Retorna {"resultados", "has_more", "truncado"}."""
+    ts = termos(q)
+    if not ts:
+        return {"resultados": [], "has_more": False, "truncado": False}
+    fonte = fonte if fonte in FONTES else "todos"
+    offset = (pagina - 1) * por_pagina
+
+    if db.session.get_bind().dialect.name == "sqlite":
+        expr = fts_query(q)
+        hits = _fts(expr, fonte, por_pagina + 1, offset)
+        truncado = _fts_truncado(expr, fonte)
+    else:
+        hits = _like(ts, fonte, por_pagina + 1, offset)
+        truncado = False
+    has_more = len(hits) > por_pagina
+    hits = hits[:por_pagina]
+
+    # Contexto e trecho de cada resultado em uma consulta por fonte. O trecho é
+    # montado aqui (snippet() do FTS5 reavalia o MATCH inteiro por linha).
+    sub_ids = [h["id"] for h in hits if h["fonte"] == "manifestacao"]
+    msg_ids = [h["id"] for h in hits if h["fonte"] == "chat"]
+    subs, msgs = {}, {}
+    if sub_ids:
+        for sid, texto, tipo, criado, protocolo in db.session.execute(
+            select(Submission.id, Submission.texto, Submission.tipo, Submission.created_at, User.protocolo)
+            .join(User, User.id == Submission.user_id)
+            .where(Submission.id.in_(sub_ids))
+        ):
+            subs[sid] = {"trecho": trecho(texto, ts), "tipo": tipo,
+                         "criado_em": criado.isoformat() if criado else None, "protocolo": protocolo}
+    if msg_ids:
+        for mid, texto, conversa_id, autor, criado in db.session.execute(
+            select(ChatMensagem.id, ChatMensagem.conteudo_texto, ChatMensagem.conversa_id,
+                   ChatMensagem.autor, ChatMensagem.criado_em)
+            .where(ChatMensagem.id.in_(msg_ids))
+        ):
+            msgs[mid] = {"trecho": trecho(texto, ts), "conversa_id": conversa_id, "autor": autor,
+                         "criado_em": criado.isoformat() if criado else None}
+
+    for h in hits:
+        h.update((subs if h["fonte"] == "manifestacao" else msgs).get(h["id"], {}))
+    return {"resultados": hits, "has_more": has_more, "truncado": truncado}
@@ -0,0 +1,90 @@
+/* Compressão no navegador antes do envio - Participa DF (templates/upload.html)
+ *
+ * Imagem: aplica a orientação EXIF, reduz o maior lado para maxPx e recodifica
+ * em WebP (JPEG se o navegador não gerar WebP). A recodificação descarta os
+ * metadados (GPS, aparelho, data) — ganho de privacidade além do tamanho.
+ * Áudio WAV (opcional, taxa > 0): reamostra para `taxa` Hz mono, WAV 16 bits.
+ * Áudio já comprimido e vídeo vão como estão: recodificar no navegador seria
+ * lento e, para MP3/M4A/OGG, nem diminuiria.
+ *
+ * processar(file, opcoes) -> File novo, ou null para enviar o original
+ * (formato que o navegador não decodifica, como HEIC, ou resultado maior).
+ */
+(function (global) {
+  function trocarExtensao(nome, ext) {
+    const i = nome.lastIndexOf(".");
+    return (i > 0 ? nome.slice(0, i) : nome) + ext;
+  }
+
+  function paraBlob(canvas, tipo, qualidade) {
+    return new Promise((ok) => canvas.toBlob(ok, tipo, qualidade));
+  }
+
+  async function imagem(file, opcoes) {
+    const bmp = await createImageBitmap(file, { imageOrientation: "from-image" });
+    const escala = Math.min(1, opcoes.maxPx / Math.max(bmp.width, bmp.height));
+    const w = Math.max(1, Math.round(bmp.width * escala));
+    const h = Math.max(1, Math.round(bmp.height * escala));
+    const canvas = document.createElement("canvas");
+    canvas.width = w;
+    canvas.height = h;
+    canvas.getContext("2d").drawImage(bmp, 0, 0, w, h);
+    if (bmp.close) bmp.close();
+
+    let blob = await paraBlob(canvas, "image/webp", opcoes.qualidade);
+    // Sem codificador WebP o navegador devolve PNG
+    if (!blob || blob.type !== "image/webp") blob = await paraBlob(canvas, "image/jpeg", opcoes.qualidade);
+    if (!blob) return null;
+    const ext = blob.type === "image/webp" ? ".webp" : ".jpg";
+    return new File([blob], trocarExtensao(file.name, ext), { type: blob.type, lastModified: file.lastModified });
+  }
+
+  function wav(amostras, taxa) {
+    const buf = new ArrayBuffer(44 + amostras.length * 2);
+    const v = new DataView(buf);
+    const txt = (o, s) => { for (let i = 0; i < s.length; i++) v.setUint8(o + i, s.charCodeAt(i)); };
+    txt(0, "RIFF"); v.setUint32(4, 36 + amostras.length * 2, true); txt(8, "WAVE");
+    txt(12, "fmt "); v.setUint32(16, 16, true); v.setUint16(20, 1, true); v.setUint16(22, 1, true);
+    v.setUint32(24, taxa, true); v.setUint32(28, taxa * 2, true); v.setUint16(32, 2, true); v.setUint16(34, 16, true);
+    txt(36, "data"); v.setUint32(40, amostras.length * 2, true);
+    for (let i = 0; i < amostras.length; i++) {
+      const s = Math.max(-1, Math.min(1, amostras[i]));
+      v.setInt16(44 + i * 2, s < 0 ? s * 0x8000 : s * 0x7fff, true);
+    }
+    return buf;
+  }
+
+  async function audio(file, opcoes) {
+    const Ctx = global.OfflineAudioContext || global.webkitOfflineAudioContext;
+    if (!opcoes.taxa || !Ctx) return null;
+    const decodificado = await new Ctx(1, 1, opcoes.taxa).decodeAudioData(await file.arrayBuffer());
+    // Renderizar num contexto mono na taxa menor faz a mixagem e a reamostragem
+    const ctx = new Ctx(1, Math.max(1, Math.ceil(decodificado.duration * opcoes.taxa)), opcoes.taxa);
+    const fonte = ctx.createBufferSource();
+    fonte.buffer = decodificado;
+    fonte.connect(ctx.destination);
+    fonte.start();
+    const saida = await ctx.startRendering();
+    return new File([wav(saida.getChannelData(0), opcoes.taxa)], trocarExtensao(file.name, ".wav"),
+                    { type: "audio/wav", lastModified: file.lastModified });
+  }
+
+  async function processar(file, opcoes) {
+    let novo = null;
+    try {
+      if (file.type.startsWith("image/") && opcoes.maxPx && global.createImageBitmap) {
+        novo = await imagem(file, opcoes);
+        // Imagem sempre recodificada (sem EXIF), mesmo que não encolha
+        return novo;
+      }
+      if (/^audio\/(x-|vnd\.)?wave?$/.test(file.type) || /\.wav$/i.test(file.name)) {
+        novo = await audio(file, opcoes);
+      }
+    } catch (e) {
+      return null;
+    }
+    return novo && novo.size < file.size ? novo : null;
+  }
+
+  global.Compressao = { processar };
+})(self);
@@ -0,0 +1,117 @@
+/* Fila offline de manifestações (IndexedDB) - Participa DF
+ *
+ * Usada pela página de envio (templates/upload.html) e pelo service worker
+ * (static/sw.js, via importScripts). Cada entrada guarda o formulário e os
+ * arquivos (Blob) de uma manifestação feita sem conexão; `id` é também a
+ * Idempotency-Key do envio, então reenviar a mesma entrada (pelo worker e pela
+ * página ao mesmo tempo, ou depois de uma resposta perdida) nunca duplica a
+ * manifestação no servidor (routes/upload.py).
+ *
+ * Entrada: {id, protocolo, tipo, texto, arquivos: [{nome, blob, tamanho_original}],
+ *           criada_em, tentativas, proxima, erro}
+ */
+(function (global) {
+  const DB_NOME = "participa-df";
+  const LOJA = "outbox";
+  const TAG_SYNC = "participa-outbox";
+  const ENDPOINT = "/upload";
+
+  // Backoff entre tentativas (sem Background Sync): 5s, 10s, 20s... até 1h
+  const ESPERA_MIN = 5 * 1000;
+  const ESPERA_MAX = 60 * 60 * 1000;
+
+  function abrir() {
+    return new Promise((ok, falha) => {
+      const r = indexedDB.open(DB_NOME, 1);
+      r.onupgradeneeded = () => r.result.createObjectStore(LOJA, { keyPath: "id" });
+      r.onsuccess = () => ok(r.result);
+      r.onerror = () => falha(r.error);
+    });
+  }
+
+  async function transacao(modo, fn) {
+    const db = await abrir();
+    return new Promise((ok, falha) => {
+      const t = db.transaction(LOJA, modo);
+      const pedido = fn(t.objectStore(LOJA));
+      t.oncomplete = () => { db.close(); ok(pedido ? pedido.result : undefined); };
+      t.onerror = t.onabort = () => { db.close(); falha(t.error); };
+    });
+  }
+
+  function novaChave() {
+    if (global.crypto && crypto.randomUUID) return crypto.randomUUID();
+    const b = crypto.getRandomValues(new Uint8Array(16));
+    return Array.from(b, x => x.toString(16).padStart(2, "0")).join("");
+  }
+
+  async function adicionar(dados) {
+    const entrada = Object.assign(
+      { id: novaChave(), texto: "", arquivos: [], criada_em: Date.now(), tentativas: 0, proxima: 0, erro: null },
+      dados
+    );
+    await transacao("readwrite", s => s.put(entrada));
+    return entrada;
+  }
+
+  const listar = () => transacao("readonly", s => s.getAll());
+  const gravar = (e) => transacao("readwrite", s => s.put(e));
+  const remover = (id) => transacao("readwrite", s => s.delete(id));
+
+  function espera(tentativas) {
+    const teto = Math.min(ESPERA_MAX, ESPERA_MIN * 2 ** (tentativas - 1));
+    return teto / 2 + Math.random() * teto / 2;  // jitter: aparelhos não voltam todos juntos
+  }
+
+  function enviar(e) {
+    const fd = new FormData();
+    fd.append("protocolo", e.protocolo);
+    fd.append("tipo", e.tipo);
+    fd.append("texto", e.texto || "");
+    fd.append("idempotency_key", e.id);
+    (e.arquivos || []).forEach(a => {
+      fd.append("files", a.blob, a.nome);
+      fd.append("tamanho_original", a.tamanho_original || "");
+    });
+    return fetch(ENDPOINT, {
+      method: "POST",
+      body: fd,
+      credentials: "same-origin",
+      headers: { "Idempotency-Key": e.id, "Accept": "application/json" }
+    });
+  }
+
+  // Reenvia as entradas vencidas (todas, com forcar). Sem rede ou com erro do
+  // servidor (5xx, 408, 429) a entrada fica para depois; outros 4xx são
+  // definitivos e ficam marcados com o erro para a página mostrar.
+  async function reenviar(opcoes) {
+    const forcar = !!(opcoes && opcoes.forcar);
+    const res = { enviadas: [], pendentes: 0, rejeitadas: [] };
+    for (const e of await listar()) {
+      if (e.erro) continue;
+      if (!forcar && e.proxima > Date.now()) { res.pendentes++; continue; }
+
+      let r = null;
+      try { r = await enviar(e); } catch (err) { r = null; }
+
+      if (r && r.ok) {
+        const j = await r.json().catch(() => ({}));
+        await remover(e.id);
+        res.enviadas.push({ id: e.id, protocolo: e.protocolo, redirect: j.redirect });
+      } else if (r && r.status >= 400 && r.status < 500 && r.status !== 408 && r.status !== 429) {
+        const j = await r.json().catch(() => ({}));
+        e.erro = j.erro || ("Erro " + r.status);
+        await gravar(e);
+        res.rejeitadas.push({ id: e.id, protocolo: e.protocolo, erro: e.erro });
+      } else {
+        e.tentativas += 1;
+        e.proxima = Date.now() + espera(e.tentativas);
+        await gravar(e);
+        res.pendentes++;
+      }
+    }
+    return res;
+  }
+
+  global.Outbox = { TAG_SYNC, novaChave, adicionar, listar, remover, reenviar };
+})(self);
@@ -1,77 +1,156 @@
-/* PWA Offline-first - Participa DF (MVP) */
+/* PWA Offline-first - Participa DF (MVP)
+ *
+ * Servido por routes/pwa.py em /sw.js (escopo "/"), com self.__PRECACHE
+ * definido antes deste código: {versao, arquivos: {url: hash do conteúdo}}.
+ */
 
-const CACHE_NAME = "participa-df-v1";
+importScripts("/static/outbox.js");
 
-// Rotas/páginas que você quer garantir offline (ajuste conforme suas rotas)
-const CORE_ASSETS = [
-  "/",                 // home
-  "/admin/login",      // admin login (opcional)
-  "/static/manifest.json",
-  "/static/sw.js"
-  // inclua aqui seus CSS/JS se forem arquivos separados
-];
+const MANIFESTO = self.__PRECACHE || { versao: "dev", arquivos: {} };
+const PRECACHE = "participa-df-precache";
+const RUNTIME = "participa-df-runtime";
+// Entrada interna do PRECACHE com os hashes do que está guardado
+const HASHES = "/__precache-hashes";
+
+// Páginas guardadas para uso offline (painel e chat ficam de fora: dados pessoais)
+const PAGINAS_OFFLINE = [/^\/$/, /^\/protocolo\//, /^\/upload\/[^/]+$/];
 
 self.addEventListener("install", (event) => {
-  event.waitUntil(
-    caches.open(CACHE_NAME).then((cache) => cache.addAll(CORE_ASSETS))
-  );
+  event.waitUntil(precache());
   self.skipWaiting();
 });
 
+// Baixa só as URLs cujo hash mudou desde a versão instalada e apaga as que saíram
+async function precache() {
+  const cache = await caches.open(PRECACHE);
+  const salvo = await cache.match(HASHES);
+  const anterior = salvo ? await salvo.json() : {};
+  const novos = MANIFESTO.arquivos;
+
+  await Promise.all(Object.keys(novos).map(async (url) => {
+    if (anterior[url] === novos[url] && (await cache.match(url))) return;
+    const resp = await fetch(new Request(url, { cache: "no-cache", credentials: "same-origin" }));
+    if (!resp.ok) throw new Error(`precache ${url}: ${resp.status}`);
+    await cache.put(url, resp);
+  }));
+  await Promise.all(Object.keys(anterior)
+    .filter((url) => !(url in novos))
+    .map((url) => cache.delete(url)));
+  await cache.put(HASHES, new Response(JSON.stringify(novos), { headers: { "Content-Type": "application/json" } }));
+}
+
 self.addEventListener("activate", (event) => {
   event.waitUntil(
     caches.keys().then((keys) =>
-      Promise.all(keys.map((k) => (k !== CACHE_NAME ? caches.delete(k) : null)))
+      // inclui o antigo participa-df-v1
+      Promise.all(keys.filter((k) => k !== PRECACHE && k !== RUNTIME).map((k) => caches.delete(k)))
     )
   );
   self.clients.claim();
 });
 
+// Background Sync:
+// - participa-resumable: upload retomável (templates/upload.html) — acorda as
+//   páginas abertas para continuarem o envio do último offset;
+// - participa-outbox: fila offline (static/outbox.js) — reenvia daqui mesmo,
+//   com a página fechada. Falha pendente rejeita o waitUntil e o navegador
+//   agenda nova tentativa (com backoff próprio).
+self.addEventListener("sync", (event) => {
+  if (event.tag === "participa-resumable") {
+    event.waitUntil(avisar({ type: "resumable-resume" }));
+  } else if (event.tag === Outbox.TAG_SYNC) {
+    event.waitUntil(esvaziarFila(event.lastChance));
+  }
+});
+
+async function avisar(msg) {
+  const clients = await self.clients.matchAll({ type: "window" });
+  clients.forEach((c) => c.postMessage(msg));
+}
+
+async function esvaziarFila(ultimaChance) {
+  const r = await Outbox.reenviar({ forcar: true });
+  await avisar({ type: "outbox", enviadas: r.enviadas, rejeitadas: r.rejeitadas, pendentes: r.pendentes });
+  if (r.pendentes && !ultimaChance) throw new Error(`fila offline: ${r.pendentes} envio(s) pendente(s)`);
+}
+
+async function pedirSync() {
+  if (self.registration.sync) {
+    try { await self.registration.sync.register(Outbox.TAG_SYNC); } catch (e) { /* a página tenta ao voltar */ }
+  }
+}
+
 // Estratégia:
+// - POST /upload do formulário: rede; sem rede, vai para a fila offline
 // - Navegação (HTML): network-first (garante versão atual quando há internet)
-// - Assets (css/js/images): cache-first
+// - /static: cache-first (o precache é renovado pelo hash a cada versão)
+// - Demais (API, painel, chat em stream, upload retomável): direto para a rede
 self.addEventListener("fetch", (event) => {
   const req = event.request;
-
-  // Não interferir em POST (upload)
-  if (req.method !== "GET") return;
-
   const url = new URL(req.url);
 
   // Somente para o mesmo domínio
   if (url.origin !== self.location.origin) return;
 
-  // Navegação (páginas)
-  const isNavigation = req.mode === "navigate" || (req.headers.get("accept") || "").includes("text/html");
-  if (isNavigation) {
-    event.respondWith(networkFirst(req));
+  if (req.method === "POST" && req.mode === "navigate" && url.pathname === "/upload") {
+    event.respondWith(enviarOuEnfileirar(req));
     return;
   }
 
-  // Assets
-  event.respondWith(cacheFirst(req));
+  if (req.method !== "GET") return;
+
+  if (req.mode === "navigate") {
+    event.respondWith(networkFirst(req, PAGINAS_OFFLINE.some((re) => re.test(url.pathname))));
+    return;
+  }
+
+  if (url.pathname.startsWith("/static/") && !url.pathname.startsWith("/static/uploads/")) {
+    event.respondWith(cacheFirst(req));
+  }
 });
 
+async function enviarOuEnfileirar(req) {
+  const copia = req.clone();
+  try {
+    return await fetch(req);
+  } catch (err) {
+    // Sem rede: guarda o formulário (com os arquivos) e volta à página de envio
+    const form = await copia.formData();
+    const protocolo = String(form.get("protocolo") || "");
+    const originais = form.getAll("tamanho_original").map(String);
+    await Outbox.adicionar({
+      id: String(form.get("idempotency_key") || "") || Outbox.novaChave(),
+      protocolo,
+      tipo: String(form.get("tipo") || ""),
+      texto: String(form.get("texto") || ""),
+      arquivos: form.getAll("files")
+        .map((f, i) => ({ nome: f.name, blob: f, tamanho_original: originais[i] || "" }))
+        .filter((a) => a.blob instanceof Blob && a.blob.size)
+    });
+    await pedirSync();
+    return Response.redirect(`/upload/${encodeURIComponent(protocolo)}?fila=1`, 303);
+  }
+}
+
 async function cacheFirst(req) {
-  const cache = await caches.open(CACHE_NAME);
-  const cached = await cache.match(req);
+  const cached = await caches.match(req, { ignoreSearch: true });
   if (cached) return cached;
 
   const fresh = await fetch(req);
   // Cacheia somente respostas ok
-  if (fresh && fresh.ok) cache.put(req, fresh.clone());
+  if (fresh && fresh.ok) (await caches.open(RUNTIME)).put(req, fresh.clone());
   return fresh;
 }
 
-async function networkFirst(req) {
-  const cache = await caches.open(CACHE_NAME);
+async function networkFirst(req, guardar) {
   try {
     const fresh = await fetch(req);
-    if (fresh && fresh.ok) cache.put(req, fresh.clone());
+    if (guardar && fresh && fresh.ok) (await caches.open(RUNTIME)).put(req, fresh.clone());
     return fresh;
   } catch (err) {
-    const cached = await cache.match(req);
-    // fallback: home cacheada
-    return cached || (await cache.match("/"));
+    // ignoreSearch: /upload/<protocolo>?fila=1 usa a página guardada sem query
+    const cached = await caches.match(req, { ignoreSearch: true });
+    // fallback: home pré-cacheada
+    return cached || (await caches.match("/"));
   }
 }
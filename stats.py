@@ -0,0 +1,233 @@
+# stats.py — estatísticas do painel a partir de tabelas de totais (rollups)
+#
+#   stat_submissao_dia (dia, tipo, status, modo) -> total de manifestações
+#   stat_midia         (grupo do mime)           -> arquivos, bytes enviados e bytes
+#                                                   originais (antes da compressão no navegador)
+#
+# Mantidas de forma incremental pelos eventos do mapper (insert/update/delete
+# de Submission e File), na mesma transação da gravação: um UPSERT somando ±1
+# (ou ±bytes) na linha da chave. O painel lê só os totais, sem GROUP BY sobre
+# submission/file.
+#
+# UPDATE/DELETE em massa via Core (fora do ORM) não disparam os eventos; depois
+# deles, ou para conferir, recalcule tudo:
+#   flask --app app stats-rebuild
+#
+# Bytes = tamanho enviado (File.size_bytes); reenvios do mesmo conteúdo contam
+# de novo, mesmo deduplicados no disco (storage.py).
+
+import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, select, func, case, inspect, delete, insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, User, Submission, File, StatSubmissaoDia, StatMidia
+
+GRUPOS = ("image", "video", "audio")
+DIAS_PADRAO = 30
+DIAS_MAX = 366
+
+_dia_t = StatSubmissaoDia.__table__
+_midia_t = StatMidia.__table__
+
+
+def grupo(mime) -> str:
+    g = (mime or "").split("/", 1)[0].lower()
+    return g if g in GRUPOS else "outro"
+
+
+def _modo(is_public) -> str:
+    return "identificado" if is_public else "anonimo"
+
+
+def _somar(connection, tabela, chave: dict, **deltas) -> None:
+    """UPSERT: soma `deltas` na linha `chave` (cria com os próprios deltas)."""
+    dialeto = connection.dialect.name
+    if dialeto in ("sqlite", "postgresql"):
+        mod = sqlite if dialeto == "sqlite" else postgresql
+        ins = mod.insert(tabela).values(**chave, **deltas)
+        ins = ins.on_conflict_do_update(
+            index_elements=list(chave),
+            set_={k: tabela.c[k] + ins.excluded[k] for k in deltas},
+        )
+        connection.execute(ins)
+        return
+    # Outros bancos: UPDATE e, se não havia linha, INSERT
+    cond = [tabela.c[k] == v for k, v in chave.items()]
+    res = connection.execute(
+        tabela.update().where(*cond).values({k: tabela.c[k] + v for k, v in deltas.items()})
+    )
+    if not res.rowcount:
+        connection.execute(tabela.insert().values(**chave, **deltas))
+
+
+# ----------------------------------------------------------
+# Manutenção incremental (eventos do mapper)
+# ----------------------------------------------------------
+def _hoje() -> datetime.date:
+    # created_at vem do server_default (CURRENT_TIMESTAMP, UTC) e ainda não foi lido
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+
+def _como_data(valor):
+    if isinstance(valor, datetime.datetime):
+        return valor.date()
+    if isinstance(valor, str):  # SQLite sem conversão
+        return datetime.date.fromisoformat(valor[:10])
+    return valor
+
+
+def _is_public(connection, user_id) -> bool:
+    return bool(connection.execute(select(User.is_public).where(User.id == user_id)).scalar())
+
+
+def _chave_gravada(connection, submission_id):
+    """Chave da manifestação como está no banco (antes do UPDATE/DELETE).
+
+    Lida do banco porque o ORM não guarda o valor antigo de um atributo expirado.
+    """
+    row = connection.execute(
+        select(Submission.created_at, Submission.tipo, Submission.status, User.is_public)
+        .join(User, User.id == Submission.user_id)
+        .where(Submission.id == submission_id)
+    ).first()
+    if row is None:
+        return None
+    criado, tipo, status, is_public = row
+    return {"dia": _como_data(criado) or _hoje(), "tipo": tipo or "", "status": status or "",
+            "modo": _modo(is_public)}
+
+
+@event.listens_for(Submission, "after_insert")
+def _submissao_inserida(mapper, connection, target):
+    chave = {"dia": _hoje(), "tipo": target.tipo or "", "status": target.status or "",
+             "modo": _modo(_is_public(connection, target.user_id))}
+    _somar(connection, _dia_t, chave, total=1)
+
+
+@event.listens_for(Submission, "before_update")
+def _submissao_alterada(mapper, connection, target):
+    estado = inspect(target)
+    if not (estado.attrs.status.history.has_changes() or estado.attrs.tipo.history.has_changes()):
+        return
+    antes = _chave_gravada(connection, target.id)
+    if antes is None:
+        return
+    depois = dict(antes, tipo=target.tipo or "", status=target.status or "")
+    if depois != antes:
+        _somar(connection, _dia_t, antes, total=-1)
+        _somar(connection, _dia_t, depois, total=1)
+
+
+@event.listens_for(Submission, "before_delete")
+def _submissao_removida(mapper, connection, target):
+    antes = _chave_gravada(connection, target.id)
+    if antes is not None:
+        _somar(connection, _dia_t, antes, total=-1)
+
+
+def _original(arquivo) -> int:
+    return arquivo.original_size_bytes or arquivo.size_bytes or 0
+
+
+@event.listens_for(File, "after_insert")
+def _arquivo_inserido(mapper, connection, target):
+    _somar(connection, _midia_t, {"grupo": grupo(target.mime_type)},
+           arquivos=1, bytes=target.size_bytes or 0, bytes_originais=_original(target))
+
+
+@event.listens_for(File, "after_delete")
+def _arquivo_removido(mapper, connection, target):
+    _somar(connection, _midia_t, {"grupo": grupo(target.mime_type)},
+           arquivos=-1, bytes=-(target.size_bytes or 0), bytes_originais=-_original(target))
+
+
+# ----------------------------------------------------------
+# Recalcular do zero
+# ----------------------------------------------------------
+def rebuild(connection) -> dict:
+    """Apaga e recalcula os totais com GROUP BY (INSERT ... SELECT, no banco)."""
+    connection.execute(delete(_dia_t))
+    connection.execute(delete(_midia_t))
+
+    modo = case((User.is_public.is_(True), "identificado"), else_="anonimo")
+    dia = func.date(Submission.created_at)
+    tipo = func.coalesce(Submission.tipo, "")
+    status = func.coalesce(Submission.status, "")
+    por_dia = (
+        select(dia, tipo, status, modo, func.count())
+        .select_from(Submission).join(User, User.id == Submission.user_id)
+        .group_by(dia, tipo, status, modo)
+    )
+    connection.execute(insert(_dia_t).from_select(["dia", "tipo", "status", "modo", "total"], por_dia))
+
+    # Poucos mime types distintos: agrupa no banco por mime e junta os grupos aqui
+    por_grupo = {}
+    original = func.coalesce(File.original_size_bytes, File.size_bytes, 0)
+    for mime, n, total, total_orig in connection.execute(
+        select(File.mime_type, func.count(), func.coalesce(func.sum(File.size_bytes), 0),
+               func.coalesce(func.sum(original), 0))
+        .group_by(File.mime_type)
+    ):
+        a, b, o = por_grupo.get(grupo(mime), (0, 0, 0))
+        por_grupo[grupo(mime)] = (a + n, b + int(total), o + int(total_orig))
+    if por_grupo:
+        connection.execute(insert(_midia_t), [
+            {"grupo": g, "arquivos": a, "bytes": b, "bytes_originais": o}
+            for g, (a, b, o) in por_grupo.items()
+        ])
+
+    return {
+        "linhas_dia": connection.execute(select(func.count()).select_from(_dia_t)).scalar(),
+        "grupos_midia": connection.execute(select(func.count()).select_from(_midia_t)).scalar(),
+    }
+
+
+@click.command("stats-rebuild")
+@with_appcontext
+def stats_rebuild_command():
+    """Recalcula as tabelas de estatísticas a partir de submission/file."""
+    with db.engine.begin() as conn:
+        res = rebuild(conn)
+    click.echo(f"linhas por dia={res['linhas_dia']} grupos de mídia={res['grupos_midia']}")
+
+
+# ----------------------------------------------------------
+# Leitura (painel)
+# ----------------------------------------------------------
+def resumo(session, dias: int = DIAS_PADRAO) -> dict:
+    """Totais gerais + série diária dos últimos `dias`. Lê só os rollups."""
+    por = {"tipo": {}, "status": {}, "modo": {}}
+    for coluna in por:
+        c = _dia_t.c[coluna]
+        for chave, total in session.execute(select(c, func.sum(_dia_t.c.total)).group_by(c)):
+            if total:
+                por[coluna][chave] = int(total)
+
+    desde = _hoje() - datetime.timedelta(days=dias - 1)
+    serie = {
+        str(d): int(t) for d, t in session.execute(
+            select(_dia_t.c.dia, func.sum(_dia_t.c.total))
+            .where(_dia_t.c.dia >= desde)
+            .group_by(_dia_t.c.dia).order_by(_dia_t.c.dia)
+        )
+    }
+    midia = {
+        g: {"arquivos": int(a), "bytes": int(b), "bytes_originais": int(o or b)}
+        for g, a, b, o in session.execute(
+            select(_midia_t.c.grupo, _midia_t.c.arquivos, _midia_t.c.bytes, _midia_t.c.bytes_originais)
+        )
+        if a
+    }
+    return {
+        "total": sum(por["modo"].values()),
+        "por_tipo": por["tipo"],
+        "por_status": por["status"],
+        "por_modo": por["modo"],
+        "por_dia": [{"dia": str(desde + datetime.timedelta(days=i)),
+                     "total": serie.get(str(desde + datetime.timedelta(days=i)), 0)}
+                    for i in range(dias)],
+        "midia": midia,
+    }
@@ -0,0 +1,411 @@
+# storage.py — armazenamento endereçado por conteúdo (SHA-256)
+#
+# Cada conteúdo distinto é gravado uma única vez em:
+#   static/uploads/blobs/<aa>/<bb>/<sha256><ext>
+# e registrado na tabela `blob` com um contador de referências.
+# File e ChatAnexo apontam para o blob pelo sha256; reenvios do mesmo arquivo
+# (mesma foto em várias manifestações) não ocupam disco de novo.
+#
+# Armazenamento frio (storage-tier): blobs mais antigos que COLD_AFTER_DAYS vão
+# para COLD_STORAGE_FOLDER (um disco mais barato), em gzip quando compensa.
+# O conteúdo é conferido contra o sha256 antes de apagar o original quente;
+# leituras (download, export) descomprimem no caminho — open_original().
+
+import os
+import gzip
+import time
+import shutil
+import hashlib
+import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.dialects import postgresql as pg_dialect
+
+from models import db, Blob, File, ChatAnexo
+
+BLOB_DIRNAME = "blobs"
+# Derivados (miniaturas, prévias, pôsteres) por SHA-256: derived/<aa>/<bb>/<sha256>-<nome>
+DERIVED_DIRNAME = "derived"
+
+# Arquivos soltos mais novos que isso podem ser uploads em andamento: o GC não mexe
+GC_GRACE_SECONDS = 60 * 60
+
+# Frio: gzip só fica se economizar ao menos isso (mídia já comprimida quase não encolhe)
+COLD_MIN_ECONOMIA = 0.05
+COPIA_BLOCO = 1024 * 1024
+
+
+def blob_root() -> str:
+    return current_app.config.get("BLOB_FOLDER") or os.path.join(
+        current_app.config["UPLOAD_FOLDER"], BLOB_DIRNAME
+    )
+
+
+def relative(abs_path: str) -> str:
+    """Caminho relativo à raiz do app (o formato gravado no banco)."""
+    return os.path.relpath(abs_path, current_app.root_path).replace("\\", "/")
+
+
+def derived_root() -> str:
+    return os.path.join(current_app.config["UPLOAD_FOLDER"], DERIVED_DIRNAME)
+
+
+def derived_dir(sha256: str) -> str:
+    """Pasta dos arquivos derivados de um conteúdo (compartilhada entre reenvios)."""
+    return os.path.join(derived_root(), sha256[:2], sha256[2:4])
+
+
+def _blob_abs_path(sha256: str, ext: str) -> str:
+    return os.path.join(blob_root(), sha256[:2], sha256[2:4], f"{sha256}{ext or ''}")
+
+
+def cold_root() -> str:
+    return current_app.config.get("COLD_STORAGE_FOLDER") or os.path.join(current_app.root_path, "cold")
+
+
+def _dentro(abs_path: str, raiz: str) -> bool:
+    return abs_path.startswith(os.path.abspath(raiz) + os.sep)
+
+
+def resolve(rel_path: str) -> str:
+    """Converte um caminho relativo salvo no banco em absoluto, dentro de
+    static/uploads, do BLOB_FOLDER (se estiver fora de uploads) ou do
+    armazenamento frio.
+
+    Levanta PermissionError em tentativa de path traversal e ValueError se vazio.
+    """
+    safe_rel = (rel_path or "").replace("\\", "/").lstrip("/")
+    if not safe_rel:
+        raise ValueError("caminho vazio")
+
+    abs_path = os.path.abspath(os.path.join(current_app.root_path, safe_rel))
+    if not any(_dentro(abs_path, raiz) for raiz in (current_app.config["UPLOAD_FOLDER"], blob_root(), cold_root())):
+        raise PermissionError(rel_path)
+    return abs_path
+
+
+def no_frio(abs_path: str) -> bool:
+    return _dentro(abs_path, cold_root())
+
+
+def is_cold(rel_path: str) -> bool:
+    try:
+        return no_frio(resolve(rel_path))
+    except (ValueError, PermissionError):
+        return False
+
+
+def comprimido(abs_path: str) -> bool:
+    """Arquivo do armazenamento frio guardado em gzip (o conteúdo é o .gz descomprimido)."""
+    return abs_path.endswith(".gz") and no_frio(abs_path)
+
+
+def open_original(rel_path: str):
+    """Abre (rb) os bytes originais do conteúdo, quente ou frio."""
+    abs_path = resolve(rel_path)
+    if comprimido(abs_path):
+        return gzip.open(abs_path, "rb")
+    return open(abs_path, "rb")
+
+
+def _incr_ref(sha256: str, rel_path: str, size: int) -> None:
+    """INSERT ... ON CONFLICT: cria o blob ou soma uma referência, de forma atômica."""
+    dialect = db.session.get_bind().dialect.name
+    insert = pg_dialect.insert if dialect == "postgresql" else sqlite_dialect.insert
+
+    stmt = insert(Blob).values(sha256=sha256, path=rel_path, size_bytes=size, ref_count=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Blob.sha256],
+        set_={"ref_count": Blob.ref_count + 1},
+    )
+    db.session.execute(stmt)
+
+
+def store(ingested, ext: str) -> str:
+    """Adota um IngestedFile (ingest.py) no repositório de blobs.
+
+    Se o conteúdo já existe, o temporário é descartado e só a referência é somada.
+    Retorna o caminho relativo do blob (para File.file_path / url do chat).
+    Não faz commit: participa da transação de quem chama.
+
+    A referência é somada antes de olhar o disco: a linha fica travada até o
+    commit de quem chama, e o DELETE do collect_garbage (que confere ref_count)
+    não a apaga no meio do caminho. O mtime do arquivo reaproveitado é
+    renovado para o GC não remover o arquivo de uma linha que acabou de apagar.
+    """
+    sha256 = ingested.sha256
+    dest = _blob_abs_path(sha256, ext)
+    _incr_ref(sha256, relative(dest), ingested.size)
+    rel_path = db.session.execute(
+        select(Blob.path).where(Blob.sha256 == sha256)
+    ).scalar_one()
+
+    abs_path = resolve(rel_path)
+    if os.path.exists(abs_path):
+        ingested.discard()
+        try:
+            os.utime(abs_path)
+        except OSError:
+            pass
+        return rel_path
+
+    # Linha sem arquivo (ou arquivo removido pelo GC): o conteúdo novo vai para o quente
+    if os.path.exists(dest):
+        ingested.discard()
+    else:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        ingested.commit(dest)
+    rel_path = relative(dest)
+    db.session.execute(update(Blob).where(Blob.sha256 == sha256).values(path=rel_path))
+    return rel_path
+
+
+def release(connection, sha256: str) -> None:
+    """Remove uma referência (chamado ao apagar File/ChatAnexo)."""
+    if not sha256:
+        return
+    connection.execute(
+        update(Blob.__table__)
+        .where(Blob.__table__.c.sha256 == sha256)
+        .values(ref_count=Blob.__table__.c.ref_count - 1)
+    )
+
+
+@event.listens_for(File, "after_delete")
+@event.listens_for(ChatAnexo, "after_delete")
+def _release_on_delete(mapper, connection, target):
+    release(connection, target.sha256)
+
+
+def path_of(record) -> str:
+    """Caminho relativo do conteúdo de um File/ChatAnexo (blob ou legado)."""
+    if record.blob is not None:
+        return record.blob.path
+    return getattr(record, "file_path", None) or (getattr(record, "url_arquivo", None) or "").lstrip("/")
+
+
+def collect_garbage(dry_run: bool = False) -> dict:
+    """Recalcula as referências e remove blobs sem uso.
+
+    - ref_count é recontado a partir de File e ChatAnexo (corrige desvios);
+    - blobs com zero referências são apagados: a linha (se ainda sem uso no
+      DELETE), commit, e só então o arquivo;
+    - arquivos soltos no diretório de blobs sem linha correspondente também;
+    - derivados (miniaturas/prévias) de conteúdos sem referência.
+    """
+    refs = {}
+    for model in (File, ChatAnexo):
+        rows = db.session.execute(
+            select(model.sha256, func.count()).where(model.sha256.isnot(None)).group_by(model.sha256)
+        )
+        for sha256, n in rows:
+            refs[sha256] = refs.get(sha256, 0) + n
+
+    stats = {"blobs": 0, "removed": 0, "bytes_freed": 0, "orphan_files": 0}
+    known_paths = set()
+
+    candidatos = []
+    for blob in db.session.execute(select(Blob)).scalars():
+        stats["blobs"] += 1
+        count = refs.get(blob.sha256, 0)
+        known_paths.add(os.path.abspath(os.path.join(current_app.root_path, blob.path)))
+        if count > 0:
+            if blob.ref_count != count and not dry_run:
+                blob.ref_count = count
+            continue
+        candidatos.append((blob.sha256, blob.ref_count, blob.path, blob.size_bytes or 0))
+
+    if dry_run:
+        stats["removed"] = len(candidatos)
+        stats["bytes_freed"] = sum(c[3] for c in candidatos)
+    else:
+        db.session.commit()
+        # Só apaga a linha se ninguém somou referência desde a leitura (store()
+        # soma antes de gravar o File) e se nenhum File/ChatAnexo aponta para ela
+        apagados = []
+        for sha256, ref_count, path, size in candidatos:
+            res = db.session.execute(
+                delete(Blob)
+                .where(
+                    Blob.sha256 == sha256,
+                    Blob.ref_count == ref_count,
+                    ~select(File.id).where(File.sha256 == sha256).exists(),
+                    ~select(ChatAnexo.id).where(ChatAnexo.sha256 == sha256).exists(),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if res.rowcount:
+                apagados.append((path, size))
+        db.session.commit()
+
+        # Arquivos só depois do commit, e só das linhas que saíram de fato
+        now = time.time()
+        for path, size in apagados:
+            stats["removed"] += 1
+            stats["bytes_freed"] += size
+            try:
+                abs_path = resolve(path)
+                # Reaproveitado por um store() agora há pouco: fica para a varredura de órfãos
+                if now - os.path.getmtime(abs_path) < GC_GRACE_SECONDS:
+                    continue
+                os.remove(abs_path)
+            except (OSError, ValueError, PermissionError):
+                pass
+
+    now = time.time()
+    for root, derivados in ((blob_root(), False), (derived_root(), True), (cold_root(), False)):
+        _remove_orphans(root, derivados, known_paths, set(refs), now, dry_run, stats)
+
+    return stats
+
+
+def _remove_orphans(root, derivados, known_paths, vivos, now, dry_run, stats) -> None:
+    # Blobs: arquivo sem linha na tabela. Derivados: prefixo <sha256> sem referências.
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.abspath(os.path.join(dirpath, name))
+            if derivados and name[:64] in vivos:
+                continue
+            if not derivados and path in known_paths:
+                continue
+            try:
+                if now - os.path.getmtime(path) < GC_GRACE_SECONDS:
+                    continue
+                stats["orphan_files"] += 1
+                if not dry_run:
+                    stats["bytes_freed"] += os.path.getsize(path)
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+# ----------------------------------------------------------
+# Armazenamento frio
+# ----------------------------------------------------------
+def _sha256_de(fp) -> str:
+    h = hashlib.sha256()
+    for bloco in iter(lambda: fp.read(COPIA_BLOCO), b""):
+        h.update(bloco)
+    return h.hexdigest()
+
+
+def _copiar_para_frio(src: str, sha256: str) -> str:
+    """Grava a cópia fria de `src` (gzip se compensar) e confere o sha256. Retorna o caminho."""
+    base = os.path.join(cold_root(), sha256[:2], sha256[2:4], os.path.basename(src))
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+
+    tmp = f"{base}.gz.{os.getpid()}.tmp"
+    with open(src, "rb") as origem, open(tmp, "wb") as bruto:
+        with gzip.GzipFile(filename="", mode="wb", fileobj=bruto, compresslevel=6, mtime=0) as gz:
+            shutil.copyfileobj(origem, gz, COPIA_BLOCO)
+        bruto.flush()
+        os.fsync(bruto.fileno())
+    dest = base + ".gz"
+    abrir = gzip.open
+
+    if os.path.getsize(tmp) > os.path.getsize(src) * (1 - COLD_MIN_ECONOMIA):
+        os.remove(tmp)
+        tmp = f"{base}.{os.getpid()}.tmp"
+        with open(src, "rb") as origem, open(tmp, "wb") as copia:
+            shutil.copyfileobj(origem, copia, COPIA_BLOCO)
+            copia.flush()
+            os.fsync(copia.fileno())
+        dest = base
+        abrir = open
+
+    try:
+        with abrir(tmp, "rb") as fp:
+            if _sha256_de(fp) != sha256:
+                raise IOError(f"sha256 não confere para {src}")
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return dest
+
+
+def tier_cold(days: int, limit: int = 0, dry_run: bool = False, echo=None) -> dict:
+    """Move para o frio os blobs sem referência recente (idade >= `days`).
+
+    Ficam de fora: anexos do chat (servidos pela URL gravada na mensagem) e
+    conteúdos reenviados depois do corte (ainda em uso / processamento).
+    Ordem segura: copia e confere -> grava o novo caminho -> apaga o quente.
+    """
+    corte = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    no_chat = select(ChatAnexo.id).where(ChatAnexo.sha256 == Blob.sha256).exists()
+    recente = select(File.id).where(File.sha256 == Blob.sha256, File.uploaded_at >= corte).exists()
+    q = (
+        select(Blob)
+        .where(Blob.tier == "hot", Blob.created_at < corte, Blob.ref_count > 0, ~no_chat, ~recente)
+        .order_by(Blob.created_at)
+    )
+    if limit:
+        q = q.limit(limit)
+
+    stats = {"movidos": 0, "bytes_originais": 0, "bytes_frios": 0, "erros": 0}
+    for blob in db.session.execute(q).scalars().all():
+        try:
+            src = resolve(blob.path)
+            tamanho = os.path.getsize(src)
+            if dry_run:
+                stats["movidos"] += 1
+                stats["bytes_originais"] += tamanho
+                continue
+            dest = _copiar_para_frio(src, blob.sha256)
+        except (OSError, ValueError, PermissionError) as exc:
+            stats["erros"] += 1
+            if echo:
+                echo(f"{blob.sha256}: {exc}")
+            continue
+
+        antigo, novo = blob.path, relative(dest)
+        res = db.session.execute(
+            update(Blob)
+            .where(Blob.sha256 == blob.sha256, Blob.path == antigo)
+            .values(path=novo, tier="cold", stored_size_bytes=os.path.getsize(dest))
+        )
+        db.session.execute(update(File).where(File.sha256 == blob.sha256).values(file_path=novo))
+        db.session.commit()
+        if res.rowcount != 1:  # mudou no meio do caminho: deixa a cópia para o GC
+            continue
+        try:
+            os.remove(src)
+        except OSError:
+            pass
+        stats["movidos"] += 1
+        stats["bytes_originais"] += tamanho
+        stats["bytes_frios"] += os.path.getsize(dest)
+    return stats
+
+
+@click.command("storage-tier")
+@click.option("--days", type=int, default=None, help="Idade mínima (padrão: COLD_AFTER_DAYS).")
+@click.option("--limit", default=0, help="No máximo N blobs nesta execução (0 = todos).")
+@click.option("--dry-run", is_flag=True)
+@with_appcontext
+def storage_tier_command(days, limit: int, dry_run: bool):
+    """Move originais antigos para o armazenamento frio (gzip), conferindo o sha256."""
+    days = current_app.config["COLD_AFTER_DAYS"] if days is None else days
+    stats = tier_cold(days, limit, dry_run, echo=click.echo)
+    click.echo(
+        f"movidos={stats['movidos']} bytes_originais={stats['bytes_originais']} "
+        f"bytes_frios={stats['bytes_frios']} erros={stats['erros']}"
+        + (" (dry-run)" if dry_run else "")
+    )
+
+
+@click.command("storage-gc")
+@click.option("--dry-run", is_flag=True, help="Só mostra o que seria removido.")
+@with_appcontext
+def storage_gc_command(dry_run: bool):
+    """Remove blobs sem referência (uploads e anexos do chat)."""
+    stats = collect_garbage(dry_run=dry_run)
+    click.echo(
+        f"blobs={stats['blobs']} removidos={stats['removed']} "
+        f"arquivos_orfaos={stats['orphan_files']} bytes_liberados={stats['bytes_freed']}"
+        + (" (dry-run)" if dry_run else "")
+    )
@@ -0,0 +1,115 @@
+# transcode.py — versões de reprodução de áudio/vídeo (roda nos processos do worker, jobs.py)
+#
+# Como media.py: funções puras sobre caminhos, sem banco nem Flask, para rodar
+# no ProcessPoolExecutor. O original nunca é alterado (continua no blob, com o
+# sha256 do envio); a versão de reprodução é um derivado do conteúdo:
+#
+#   vídeo -> derived/<aa>/<bb>/<sha256>-play.mp4   H.264 (até VIDEO_ALTURA_MAX), áudio AAC, faststart
+#   áudio -> derived/<aa>/<bb>/<sha256>-play.webm  Opus mono/estéreo
+#
+# Só transcodifica o que compensa: .mov/.wav, codecs que o navegador não toca
+# ou bitrate acima do limite. Se a versão nova não ficar menor, é descartada.
+#
+# Dependência: ffmpeg/ffprobe no PATH (media.FFMPEG / media.FFPROBE).
+
+import os
+import subprocess
+
+import media
+
+VIDEO_ALTURA_MAX = 720
+VIDEO_CRF = int(os.environ.get("TRANSCODE_VIDEO_CRF", 26))
+VIDEO_BITRATE_MAX = 2_500_000       # acima disso (bits/s) o vídeo é recodificado
+AUDIO_BITRATE_MAX = 160_000
+AUDIO_OPUS_KBPS = 48
+VIDEO_AAC_KBPS = 96
+# 0 = o ffmpeg decide; com vários processos no pool, limite para não disputar CPU
+THREADS = int(os.environ.get("TRANSCODE_THREADS", 0))
+TIMEOUT = int(os.environ.get("TRANSCODE_TIMEOUT", 3600))
+
+# Codecs que os navegadores do painel tocam sem conversão
+VIDEO_CODECS_OK = {"h264"}
+AUDIO_CODECS_OK = {"aac", "mp3", "opus", "vorbis"}
+# Áudio sem compressão / sem perdas: sempre vale recodificar
+AUDIO_CODECS_PESADOS = ("pcm_", "flac", "alac")
+
+
+def plano(info: dict, mime: str):
+    """"video", "audio" ou None (original já serve para reprodução)."""
+    mime = (mime or "").lower()
+    bitrate = info.get("bit_rate") or 0
+
+    if mime.startswith("video/") and info.get("video_codec"):
+        if (info["video_codec"] not in VIDEO_CODECS_OK
+                or mime == "video/quicktime"  # .mov: o Firefox não toca o contêiner
+                or (info.get("height") or 0) > VIDEO_ALTURA_MAX
+                or bitrate > VIDEO_BITRATE_MAX):
+            return "video"
+        return None
+
+    if mime.startswith(("audio/", "video/")) and info.get("audio_codec"):
+        codec = info["audio_codec"]
+        if codec.startswith(AUDIO_CODECS_PESADOS) or codec not in AUDIO_CODECS_OK or bitrate > AUDIO_BITRATE_MAX:
+            return "audio"
+    return None
+
+
+def _comando(tipo: str, src: str, dest: str, info: dict) -> list:
+    cmd = [media.FFMPEG, "-v", "error", "-y", "-i", src]
+    if THREADS:
+        cmd += ["-threads", str(THREADS)]
+    if tipo == "video":
+        return cmd + [
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-c:v", "libx264", "-preset", "medium", "-crf", str(VIDEO_CRF),
+            "-vf", f"scale=-2:'min({VIDEO_ALTURA_MAX},ih)'", "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", f"{VIDEO_AAC_KBPS}k",
+            "-movflags", "+faststart", "-f", "mp4", dest,
+        ]
+    return cmd + [
+        "-map", "0:a:0", "-vn",
+        "-c:a", "libopus", "-b:a", f"{AUDIO_OPUS_KBPS}k", "-ac", str(min(2, info.get("channels") or 2)),
+        "-f", "webm", dest,
+    ]
+
+
+SAIDAS = {
+    "video": ("-play.mp4", "video/mp4"),
+    "audio": ("-play.webm", "audio/webm"),
+}
+
+
+def transcodificar(src: str, out_dir: str, sha256: str, mime: str) -> dict:
+    """Gera a versão de reprodução. Retorna {"path", "mime", "size", "motivo"}.
+
+    path = None quando não há o que fazer (motivo explica).
+    """
+    result = {"path": None, "mime": None, "size": None, "motivo": None}
+    if not (media.FFMPEG and media.FFPROBE):
+        result["motivo"] = "ffmpeg/ffprobe indisponível"
+        return result
+
+    info = media.probe(src)
+    tipo = plano(info, mime)
+    if tipo is None:
+        result["motivo"] = "original já é eficiente"
+        return result
+
+    sufixo, saida_mime = SAIDAS[tipo]
+    dest = os.path.join(out_dir, f"{sha256}{sufixo}")
+    # Mesmo conteúdo já transcodificado (reenvio): reaproveita
+    if not os.path.exists(dest):
+        os.makedirs(out_dir, exist_ok=True)
+        tmp = f"{dest}.{os.getpid()}.tmp"
+        try:
+            subprocess.run(_comando(tipo, src, tmp, info), capture_output=True, timeout=TIMEOUT, check=True)
+            if os.path.getsize(tmp) >= os.path.getsize(src):
+                result["motivo"] = "versão transcodificada não ficou menor"
+                return result
+            os.replace(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    result.update(path=dest, mime=saida_mime, size=os.path.getsize(dest))
+    return result